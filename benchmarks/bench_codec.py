@@ -0,0 +1,110 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+Benchmark config file load and save times
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import schema_markdown
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from ollama_chat.app import OLLAMA_CHAT_TYPES # pylint: disable=wrong-import-position
+from ollama_chat.codec import json_dumps, json_loads, orjson, ujson # pylint: disable=wrong-import-position
+from ollama_chat.storage import JSONStorage # pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark config file load and save times')
+    parser.add_argument('-s', dest='size', metavar='MB', type=int, default=100,
+                        help='the approximate config size, in megabytes (default is 100)')
+    parser.add_argument('-e', dest='exchanges', metavar='N', type=int, default=100,
+                        help='the number of exchanges per conversation (default is 100)')
+    args = parser.parse_args()
+
+    # Create the config
+    exchange = {'user': 'Why is the sky blue? ' * 5, 'model': 'Rayleigh scattering of sunlight. ' * 30}
+    exchange_size = len(json.dumps(exchange))
+    conversation_count = max(1, args.size * 1024 * 1024 // (exchange_size * args.exchanges))
+    config = {
+        'model': 'llm',
+        'conversations': [
+            {
+                'id': f'conv{ix}',
+                'model': 'llm',
+                'title': f'Conversation {ix}',
+                'exchanges': [
+                    {'user': exchange['user'], 'model': f'{ix_exchange} {exchange["model"]}'}
+                    for ix_exchange in range(args.exchanges)
+                ]
+            }
+            for ix in range(conversation_count)
+        ]
+    }
+
+    codec_name = 'orjson' if orjson is not None else ('ujson' if ujson is not None else 'json')
+    print(f'Config: {conversation_count} conversations, {args.exchanges} exchanges each, codec is {codec_name}')
+    print()
+    print('| Operation | MB | Seconds | MB/sec |')
+    print('| --------- | -- | ------- | ------ |')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_path = os.path.join(temp_dir, 'ollama-chat.json')
+
+        # Save with the json module (indented)
+        def save_json():
+            with open(config_path, 'w', encoding='utf-8') as fh_config:
+                json.dump(config, fh_config, indent=4, sort_keys=True)
+        print_result('Save - json, indented', config_path, save_json)
+
+        # Load with the json module and validate
+        def load_json():
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                schema_markdown.validate_type(OLLAMA_CHAT_TYPES, 'OllamaChatConfig', json.loads(fh_config.read()))
+        print_result('Load - json, validated', config_path, load_json)
+
+        # Save and load with the codec
+        for compact in (False, True):
+            storage = JSONStorage(config_path, OLLAMA_CHAT_TYPES, compact=compact)
+            compact_name = 'compact' if compact else 'indented'
+            print_result(f'Save - {codec_name}, {compact_name}', config_path, lambda storage=storage: storage.save(config, (), ()))
+
+            # Load with the codec and validate
+            def load_codec():
+                with open(config_path, 'rb') as fh_config:
+                    schema_markdown.validate_type(OLLAMA_CHAT_TYPES, 'OllamaChatConfig', json_loads(fh_config.read()))
+            print_result(f'Load - {codec_name}, {compact_name}, validated', config_path, load_codec)
+
+            # Load a trusted config (checksum matches)
+            print_result(f'Load - {codec_name}, {compact_name}, checksum', config_path, storage.load)
+
+        # Encode a large getConversation response
+        response = {'conversation': {**config['conversations'][0], 'generating': False}}
+        start = time.perf_counter()
+        for _ in range(100):
+            json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        json_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(100):
+            json_dumps(response, compact=True)
+        codec_seconds = time.perf_counter() - start
+        print()
+        print(f'getConversation response encoding (100 iterations): json {json_seconds:.3f} sec, {codec_name} {codec_seconds:.3f} sec')
+
+
+# Helper to time an operation and print its result row
+def print_result(name, config_path, operation):
+    start = time.perf_counter()
+    operation()
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(config_path) / (1024 * 1024)
+    print(f'| {name} | {size:.1f} | {seconds:.3f} | {size / seconds:.0f} |')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+Benchmark chat first-token latency, with and without the model capabilities cache
+"""
+
+import argparse
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import unittest.mock
+
+import urllib3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from ollama_chat.ollama import ModelCache, ollama_chat # pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat first-token latency')
+    parser.add_argument('-r', dest='requests', metavar='N', type=int, default=100,
+                        help='the number of chat requests (default is 100)')
+    parser.add_argument('-s', dest='show_ms', metavar='MS', type=float, action='append',
+                        help='the simulated /api/show latency, in milliseconds (default is 0, 10, and 50)')
+    args = parser.parse_args()
+
+    print('| Show latency (ms) | Uncached first token (ms) | Cached first token (ms) | Speedup |')
+    print('| ----------------- | ------------------------- | ----------------------- | ------- |')
+    for show_ms in args.show_ms or (0, 10, 50):
+        with SimulatedOllama(show_ms / 1000) as ollama_host, \
+             unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': ollama_host}):
+            pool_manager = urllib3.PoolManager()
+            uncached_ms = run_benchmark(pool_manager, None, args.requests)
+            cached_ms = run_benchmark(pool_manager, ModelCache(), args.requests)
+        print(f'| {show_ms:g} | {uncached_ms:.2f} | {cached_ms:.2f} | {uncached_ms / cached_ms:.1f}x |')
+
+
+# Helper to measure the median first-token latency, in milliseconds
+def run_benchmark(pool_manager, model_cache, request_count):
+    latencies = []
+    for _ in range(request_count):
+        start_time = time.perf_counter()
+        chunks = ollama_chat(pool_manager, 'llm', [{'role': 'user', 'content': 'Hello'}], model_cache)
+        next(chunks)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        chunks.close()
+    return statistics.median(latencies)
+
+
+# Simulated Ollama server context manager - yields the Ollama host URL
+class SimulatedOllama:
+    __slots__ = ('server', 'server_thread')
+
+
+    def __init__(self, show_seconds):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self): # pylint: disable=invalid-name
+                self.rfile.read(int(self.headers['Content-Length']))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                if self.path == '/api/show':
+                    time.sleep(show_seconds)
+                    body = json.dumps({'capabilities': ['completion']}).encode('utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    # The chat response is streamed with chunked transfer encoding
+                    body = json.dumps({'message': {'content': 'token'}, 'done': True}).encode('utf-8') + b'\n'
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    self.wfile.write(f'{len(body):x}\r\n'.encode('utf-8') + body + b'\r\n0\r\n\r\n')
+
+            def log_message(self, *unused_args): # pylint: disable=arguments-differ
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+
+
+    def __enter__(self):
+        self.server_thread.start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+
+    def __exit__(self, *unused_args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
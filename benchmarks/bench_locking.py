@@ -0,0 +1,99 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+Benchmark chat streaming throughput with concurrent chats and UI polling
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest.mock
+
+from schema_markdown import encode_query_string
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from ollama_chat.app import OllamaChat # pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat streaming throughput with concurrent chats')
+    parser.add_argument('-c', dest='chats', metavar='N', type=int, action='append',
+                        help='the number of concurrent chats (default is 1, 5, 10, and 20)')
+    parser.add_argument('-t', dest='tokens', metavar='N', type=int, default=500,
+                        help='the number of tokens per chat (default is 500)')
+    parser.add_argument('-d', dest='delay', metavar='MS', type=float, default=1.0,
+                        help='the simulated per-token model latency, in milliseconds (default is 1.0)')
+    parser.add_argument('-e', dest='exchanges', metavar='N', type=int, default=200,
+                        help='the number of exchanges in each existing conversation (default is 200)')
+    parser.add_argument('-p', dest='pollers', metavar='N', type=int, default=4,
+                        help='the number of UI polling threads (default is 4)')
+    args = parser.parse_args()
+
+    print('| Chats | Tokens | Seconds | Tokens/sec | Polls/sec |')
+    print('| ----- | ------ | ------- | ---------- | --------- |')
+    for chat_count in args.chats or (1, 5, 10, 20):
+        tokens, seconds, polls = run_benchmark(chat_count, args.tokens, args.delay / 1000, args.exchanges, args.pollers)
+        print(f'| {chat_count} | {tokens} | {seconds:.3f} | {tokens / seconds:.0f} | {polls / seconds:.0f} |')
+
+
+def run_benchmark(chat_count, token_count, token_delay, exchange_count, poller_count):
+    # Create the conversations - each has a history of exchanges
+    exchanges = [{'user': f'Prompt {ix}', 'model': f'Response {ix} ' * 50} for ix in range(exchange_count)]
+    config = {
+        'conversations': [
+            {'id': f'conv{ix}', 'model': 'llm', 'title': f'Conversation {ix}', 'exchanges': list(exchanges)}
+            for ix in range(chat_count)
+        ],
+        'noSave': True
+    }
+
+    # The simulated Ollama chat stream
+    def ollama_chat(unused_pool_manager, unused_model, unused_messages, unused_model_cache, unused_backends, unused_keep_alive):
+        for _ in range(token_count):
+            time.sleep(token_delay)
+            yield {'message': {'content': 'token '}}
+
+    with tempfile.TemporaryDirectory() as temp_dir, \
+         unittest.mock.patch('ollama_chat.chat.ollama_chat', ollama_chat):
+        config_path = os.path.join(temp_dir, 'ollama-chat.json')
+        with open(config_path, 'w', encoding='utf-8') as config_fh:
+            json.dump(config, config_fh)
+        app = OllamaChat(config_path)
+
+        # Start the UI pollers - each polls the conversation list and a conversation
+        polls = [0] * poller_count
+        polling = True
+        def poller(ix_poller):
+            query_string = encode_query_string({'id': f'conv{ix_poller % chat_count}'})
+            while polling:
+                app.request('GET', '/getConversations')
+                app.request('GET', '/getConversation', query_string=query_string)
+                polls[ix_poller] += 2
+        poller_threads = [threading.Thread(target=poller, args=(ix_poller,)) for ix_poller in range(poller_count)]
+        for poller_thread in poller_threads:
+            poller_thread.start()
+
+        # Start the chats and wait for them to complete
+        start_time = time.perf_counter()
+        for ix_chat in range(chat_count):
+            request = {'id': f'conv{ix_chat}', 'user': 'Hello'}
+            app.request('POST', '/replyConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+        while app.chats:
+            time.sleep(0.001)
+        seconds = time.perf_counter() - start_time
+
+        # Stop the pollers
+        polling = False
+        for poller_thread in poller_threads:
+            poller_thread.join()
+
+    return chat_count * token_count, seconds, sum(polls)
+
+
+if __name__ == '__main__':
+    main()
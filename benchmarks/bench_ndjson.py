@@ -0,0 +1,101 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+Benchmark streamed NDJSON decoding throughput, line-splitting and re-scanning decoders
+"""
+
+import argparse
+import codecs
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from ollama_chat.ollama import _NDJSONDecoder # pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streamed NDJSON decoding throughput')
+    parser.add_argument('-m', dest='megabytes', metavar='MB', type=float, action='append',
+                        help='the stream size, in megabytes (default is 1, 4, and 16)')
+    parser.add_argument('-o', dest='object_bytes', metavar='N', type=int, action='append',
+                        help='the approximate size of each JSON object, in bytes (default is 100, 65536, and 1048576)')
+    parser.add_argument('-c', dest='chunk_bytes', metavar='N', type=int, default=16384,
+                        help='the maximum random chunk size, in bytes (default is 16384)')
+    parser.add_argument('-r', dest='seed', metavar='N', type=int, default=0,
+                        help='the random seed for the chunk boundaries (default is 0)')
+    args = parser.parse_args()
+
+    print('| Stream (MB) | Object bytes | Chunks | Re-scanning MB/sec | Line-splitting MB/sec | Speedup |')
+    print('| ----------- | ------------ | ------ | ------------------ | --------------------- | ------- |')
+    for megabytes in args.megabytes or (1, 4, 16):
+        for object_bytes in args.object_bytes or (100, 65536, 1048576):
+            chunks = create_stream(int(megabytes * 1048576), object_bytes, args.chunk_bytes, random.Random(args.seed))
+            rescan_seconds = run_benchmark(RescanNDJSONDecoder, chunks)
+            line_seconds = run_benchmark(_NDJSONDecoder, chunks)
+            print(
+                f'| {megabytes:g} | {object_bytes} | {len(chunks)} | {megabytes / rescan_seconds:.1f} | '
+                f'{megabytes / line_seconds:.1f} | {rescan_seconds / line_seconds:.1f}x |'
+            )
+
+
+# Helper to create an NDJSON stream split into random-size chunks
+def create_stream(stream_bytes, object_bytes, chunk_bytes, rng):
+    line = (json.dumps({'message': {'thinking': 'x' * max(object_bytes - 30, 1)}}) + '\n').encode('utf-8')
+    ndjson = line * max(stream_bytes // len(line), 1)
+    chunks = []
+    ix_chunk = 0
+    while ix_chunk < len(ndjson):
+        chunk_size = rng.randint(1, chunk_bytes)
+        chunks.append(ndjson[ix_chunk:ix_chunk + chunk_size])
+        ix_chunk += chunk_size
+    return chunks
+
+
+# Helper to measure the time to decode the chunks, in seconds
+def run_benchmark(decoder_class, chunks):
+    start_time = time.perf_counter()
+    decoder = decoder_class()
+    for chunk in chunks:
+        for _ in decoder.decode(chunk):
+            pass
+    for _ in decoder.close():
+        pass
+    return time.perf_counter() - start_time
+
+
+# The previous NDJSON decoder - the decoded text is re-stripped and re-copied for each object, and a
+# partial object is re-decoded from the start after each chunk
+class RescanNDJSONDecoder:
+    __slots__ = ('decoder', 'text_decoder', 'buffer')
+
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+
+
+    def decode(self, data):
+        self.buffer += self.text_decoder.decode(data)
+        while True:
+            self.buffer = self.buffer.lstrip()
+            if not self.buffer:
+                break
+            try:
+                chunk, index = self.decoder.raw_decode(self.buffer)
+            except json.JSONDecodeError:
+                break
+            self.buffer = self.buffer[index:]
+            yield chunk
+
+
+    def close(self):
+        return []
+
+
+if __name__ == '__main__':
+    main()
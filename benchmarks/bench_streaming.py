@@ -0,0 +1,85 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+Benchmark chat stream token handling throughput, buffered and unbuffered
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from ollama_chat.app import OllamaChat # pylint: disable=wrong-import-position
+from ollama_chat.chat import CHAT_ENGINES # pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chat stream token handling throughput')
+    parser.add_argument('-c', dest='streams', metavar='N', type=int, action='append',
+                        help='the number of concurrent streams (default is 1, 10, and 50)')
+    parser.add_argument('-t', dest='tokens', metavar='N', type=int, default=20000,
+                        help='the number of tokens per stream (default is 20000)')
+    parser.add_argument('-k', dest='engine', metavar='ENGINE', choices=CHAT_ENGINES, default='thread',
+                        help='the chat engine - "thread" or "async" (default is "thread")')
+    args = parser.parse_args()
+
+    print('| Streams | Tokens | Unbuffered tokens/sec | Buffered tokens/sec | Speedup |')
+    print('| ------- | ------ | --------------------- | ------------------- | ------- |')
+    for stream_count in args.streams or (1, 10, 50):
+        # Unbuffered - the response text is published for each chunk
+        with unittest.mock.patch('ollama_chat.chat.STREAM_PUBLISH_CHUNKS', 1):
+            tokens, unbuffered_seconds = run_benchmark(stream_count, args.tokens, args.engine)
+        _, buffered_seconds = run_benchmark(stream_count, args.tokens, args.engine)
+        print(
+            f'| {stream_count} | {tokens} | {tokens / unbuffered_seconds:.0f} | {tokens / buffered_seconds:.0f} | '
+            f'{unbuffered_seconds / buffered_seconds:.1f}x |'
+        )
+
+
+def run_benchmark(stream_count, token_count, engine):
+    config = {
+        'conversations': [
+            {'id': f'conv{ix}', 'model': 'llm', 'title': f'Conversation {ix}', 'exchanges': []}
+            for ix in range(stream_count)
+        ],
+        'noSave': True
+    }
+
+    # The simulated Ollama chat stream - tokens are produced as fast as they're consumed
+    def ollama_chat(unused_pool_manager, unused_model, unused_messages, unused_model_cache, unused_backends, unused_keep_alive):
+        chunk = {'message': {'content': 'token '}}
+        for _ in range(token_count):
+            yield chunk
+
+    async def ollama_chat_async(unused_model, unused_messages, unused_model_cache, unused_backends, unused_keep_alive):
+        chunk = {'message': {'content': 'token '}}
+        for _ in range(token_count):
+            yield chunk
+
+    with tempfile.TemporaryDirectory() as temp_dir, \
+         unittest.mock.patch('ollama_chat.chat.ollama_chat', ollama_chat), \
+         unittest.mock.patch('ollama_chat.chat.ollama_chat_async', ollama_chat_async):
+        config_path = os.path.join(temp_dir, 'ollama-chat.json')
+        with open(config_path, 'w', encoding='utf-8') as config_fh:
+            json.dump(config, config_fh)
+        app = OllamaChat(config_path, engine=engine)
+
+        # Start the chats and wait for them to complete
+        start_time = time.perf_counter()
+        for ix_stream in range(stream_count):
+            request = {'id': f'conv{ix_stream}', 'user': 'Hello'}
+            app.request('POST', '/replyConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+        while app.chats:
+            time.sleep(0.001)
+        seconds = time.perf_counter() - start_time
+
+    return stream_count * token_count, seconds
+
+
+if __name__ == '__main__':
+    main()
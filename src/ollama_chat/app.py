@@ -5,38 +5,70 @@
 The ollama-chat back-end application
 """
 
-from contextlib import contextmanager
-import copy
+import asyncio
+from collections import OrderedDict
+from contextlib import ExitStack, aclosing, contextmanager, nullcontext
 import ctypes
-import json
 import os
 from functools import partial
+from http import HTTPStatus
 import platform
 import importlib.resources
+import itertools
+import logging
 import re
 import threading
+import time
 import uuid
 
 import chisel
-import urllib3
 import schema_markdown
 
-from .chat import ChatManager, config_conversation, config_template_prompts
-from .ollama import ollama_delete, ollama_list, ollama_pull
+from .chat import CHAT_PRIORITY_TEMPLATE, AsyncEngine, ChatManager, ChatScheduler, CommandCache, config_template_prompts
+from .codec import json_dumps
+from .ollama import (
+    OLLAMA_POOL_SIZE, URL_POOL_SIZE, LoadStats, ModelCache, OllamaBackends, PoolStats, create_pool_manager, model_keep_alive, ollama_delete,
+    ollama_list, ollama_load, ollama_ps, ollama_pull, ollama_pull_async
+)
+from .storage import Journal, create_storage
 
 
 # The ollama-chat back-end API WSGI application class
 class OllamaChat(chisel.Application):
-    __slots__ = ('config', 'xorigin', 'chats', 'downloads', 'pool_manager')
+    __slots__ = (
+        'config', 'xorigin', 'chats', 'scheduler', 'engine', 'downloads', 'backends', 'pool_stats', 'pool_manager', 'url_pool_stats',
+        'url_pool_manager', 'model_cache', 'command_cache', 'models_response', 'models_version', 'models_version_condition', 'load_stats',
+        'warm', 'warm_lock', 'warm_times', 'waiters'
+    )
 
 
-    def __init__(self, config_path, xorigin=False):
+    def __init__(
+        self, config_path, xorigin=False, storage=None, save_delay=None, journal=False, compact=False, archive_days=None,
+        max_chats=None, max_model_chats=None, engine=None, refresh_includes=False, pool_size=None, url_pool_size=None, warm=False
+    ):
         super().__init__()
-        self.config = ConfigManager(config_path)
+        self.config = ConfigManager(config_path, storage, save_delay, journal, compact, archive_days)
         self.xorigin = xorigin
         self.chats = {}
+        self.scheduler = ChatScheduler(max_chats, max_model_chats) if max_chats else None
+        self.engine = AsyncEngine() if engine == 'async' else None
         self.downloads = {}
-        self.pool_manager = urllib3.PoolManager(num_pools=10, maxsize=10)
+        with self.config() as config:
+            self.backends = OllamaBackends(config.get('backends'))
+        self.pool_stats = PoolStats(pool_size or OLLAMA_POOL_SIZE)
+        self.pool_manager = create_pool_manager(self.pool_stats)
+        self.url_pool_stats = PoolStats(url_pool_size or URL_POOL_SIZE)
+        self.url_pool_manager = create_pool_manager(self.url_pool_stats)
+        self.model_cache = ModelCache()
+        self.command_cache = None if refresh_includes else CommandCache()
+        self.models_response = None
+        self.models_version = 0
+        self.models_version_condition = threading.Condition()
+        self.load_stats = LoadStats()
+        self.warm = warm
+        self.warm_lock = threading.Lock()
+        self.warm_times = {}
+        self.waiters = threading.BoundedSemaphore(MAX_WAITERS)
 
         # Back-end documentation
         self.add_requests(chisel.create_doc_requests())
@@ -51,6 +83,7 @@ class OllamaChat(chisel.Application):
         self.add_request(get_conversation)
         self.add_request(get_conversations)
         self.add_request(get_models)
+        self.add_request(get_stats)
         self.add_request(get_system_info)
         self.add_request(get_template)
         self.add_request(move_conversation)
@@ -63,6 +96,7 @@ class OllamaChat(chisel.Application):
         self.add_request(start_template)
         self.add_request(stop_conversation)
         self.add_request(stop_model_download)
+        self.add_request(stream_conversation)
         self.add_request(update_template)
 
         # Front-end statics
@@ -99,44 +133,446 @@ _CONTENT_TYPES = {
 }
 
 
-# The ollama-chat configuration context manager
+# The default maximum number of conversations whose exchanges are kept in memory
+CONVERSATION_CACHE_SIZE = 100
+
+
+# The ollama-chat application logger - used for errors outside of a request (e.g., saver thread errors)
+_LOG = logging.getLogger(__name__)
+
+
+# The ollama-chat configuration context manager. The config lock protects the config's settings,
+# conversation list, and templates. Each conversation's exchanges are protected by its conversation
+# lock, so unrelated conversations never contend. Config saves are written holding only the storage
+# lock. Locks are always acquired in storage lock, config lock, conversation lock order. Conversations
+# and templates are found by ID (and templates by name) using indexes that are updated by the
+# conversation and template methods below.
+#
+# If a save delay (in seconds) is provided, saves are deferred to a background saver thread that
+# coalesces all saves requested within the save delay into a single write. A failed save is logged and
+# retried, and its changes remain changed until saved.
+#
+# If the journal is enabled, conversation changes are appended to the journal file as they happen
+# (see journal_write). The journal is replayed on startup and cleared on each save, so changes made
+# since the last save survive a crash.
+#
+# If the storage loads conversation exchanges on demand (e.g., SQLite), at most
+# conversation_cache_size conversations' exchanges are kept in memory. The least-recently-used
+# conversations' exchanges are evicted, unless they're changed (unsaved) or pinned (in use).
 class ConfigManager:
-    __slots__ = ('config_path', 'config_lock', 'config')
+    __slots__ = (
+        'config_path', 'config_lock', 'config', 'storage', 'changed_conversations', 'changed_templates', 'conversation_locks',
+        'conversations_by_id', 'templates_by_id', 'templates_by_name', 'save_delay', 'save_event', 'save_thread', 'journal',
+        'conversation_cache_size', 'loaded_conversations', 'conversation_pins', 'conversation_versions', 'exchange_versions',
+        'version_counter', 'list_version', 'list_version_condition', 'instance_id', 'storage_lock', 'saving_conversations'
+    )
 
 
-    def __init__(self, config_path):
+    def __init__(self, config_path, storage=None, save_delay=None, journal=False, compact=False, archive_days=None):
         self.config_path = config_path
         self.config_lock = threading.Lock()
-
-        # Ensure the config file exists with default config if it doesn't exist
-        if os.path.isfile(self.config_path):
-            with open(self.config_path, 'r', encoding='utf-8') as fh_config:
-                self.config = schema_markdown.validate_type(OLLAMA_CHAT_TYPES, 'OllamaChatConfig', json.loads(fh_config.read()))
-        else:
+        self.conversation_locks = {}
+        self.conversation_versions = {}
+        self.exchange_versions = {}
+        self.version_counter = itertools.count(1)
+        self.list_version = 0
+        self.list_version_condition = threading.Condition()
+        self.instance_id = os.urandom(8).hex()
+        self.storage = create_storage(config_path, OLLAMA_CHAT_TYPES, storage, compact, archive_days)
+        self.storage_lock = threading.Lock()
+        self.changed_conversations = set()
+        self.saving_conversations = set()
+        self.changed_templates = set()
+        self.save_delay = save_delay
+        self.save_event = threading.Event()
+        self.save_thread = None
+
+        # Load the config, or use the default config if the config file doesn't exist
+        self.config = self.storage.load()
+        if self.config is None:
             self.config = {'conversations': []}
 
+        # Index the conversations and templates
+        self.conversations_by_id = {conversation['id']: conversation for conversation in self.config['conversations']}
+
+        # Track the loaded conversations, if the storage loads exchanges on demand
+        self.conversation_cache_size = CONVERSATION_CACHE_SIZE
+        self.conversation_pins = {}
+        self.loaded_conversations = None
+        if hasattr(self.storage, 'load_exchanges'):
+            self.loaded_conversations = OrderedDict(
+                (conversation['id'], None) for conversation in self.config['conversations'] if 'exchanges' in conversation
+            )
+        self.templates_by_id = {}
+        self.templates_by_name = {}
+        self._index_templates()
+
+        # Replay the journal, if any, and save the replayed changes
+        self.journal = None
+        if journal and not self.config.get('noSave'):
+            journal_ = Journal(f'{os.path.splitext(config_path)[0]}.journal', OLLAMA_CHAT_TYPES)
+            records = journal_.read()
+            self._replay_journal(records)
+            self.journal = journal_
+            if records:
+                self._save()
+
 
     @contextmanager
     def __call__(self, save=False):
         # Acquire the config lock
         self.config_lock.acquire()
 
+        save_now = False
         try:
             # Yield the config on context entry
             yield self.config
 
             # Save the config file on context exit, if requested
             if save and not self.config.get('noSave'):
-                with open(self.config_path, 'w', encoding='utf-8') as fh_config:
-                    json.dump(self.config, fh_config, indent=4, sort_keys = True)
+                if self.save_delay:
+                    # Start the saver thread, if necessary, and signal it
+                    if self.save_thread is None:
+                        self.save_thread = threading.Thread(target=self._save_thread_fn)
+                        self.save_thread.daemon = True
+                        self.save_thread.start()
+                    self.save_event.set()
+                else:
+                    save_now = True
         finally:
             # Release the config lock
             self.config_lock.release()
 
+        # Save the config file, if requested, without holding the config lock
+        if save_now:
+            self._save()
+
+
+    # Save any deferred (or failed) changes now (e.g., on shutdown)
+    def flush(self):
+        with self.config_lock:
+            if not self.save_event.is_set():
+                return
+        self._save()
+
+
+    # Save the config (must not hold the config lock). The storage lock is held, so saves are written in
+    # order, and the config lock is held only while the config is copied.
+    def _save(self):
+        with self.storage_lock:
+            with self.config_lock:
+                save_copy = self._save_copy()
+            self._save_write(save_copy)
+        with self.config_lock:
+            self._evict_conversations()
+
+
+    # Copy the config for a save (must hold the storage lock and the config lock). The conversation
+    # locks are held so that conversations are not modified (or journaled) while they're copied and
+    # the journal is checkpointed. If the copy fails, a save remains requested.
+    def _save_copy(self):
+        self.save_event.clear()
+        try:
+            with ExitStack() as conversation_locks:
+                for conversation_lock in list(self.conversation_locks.values()):
+                    conversation_locks.enter_context(conversation_lock)
+                if self.journal is not None:
+                    self.journal.checkpoint()
+                save_copy = (_copy_config(self.config), self.changed_conversations, self.changed_templates)
+                self.saving_conversations = self.changed_conversations
+                self.changed_conversations = set()
+                self.changed_templates = set()
+        except:
+            self.save_event.set()
+            raise
+        return save_copy
+
+
+    # Write a config copy (must hold the storage lock; see _save_copy). If the write fails, the copy's
+    # changes are marked changed and a save remains requested, so they're written on the next save.
+    def _save_write(self, save_copy):
+        config, conversation_ids, template_ids = save_copy
+        archived_ids = set(getattr(self.storage, 'archived_ids', ()))
+        try:
+            self.storage.save(config, conversation_ids, template_ids)
+            if self.journal is not None:
+                self.journal.clear_checkpoint()
+        except:
+            with self.config_lock:
+                self.changed_conversations.update(conversation_ids)
+                self.changed_templates.update(template_ids)
+                self.saving_conversations = set()
+                self.save_event.set()
+            raise
+        with self.config_lock:
+            self.saving_conversations = set()
+
+        # Saving may restore archived conversations
+        if set(getattr(self.storage, 'archived_ids', ())) != archived_ids:
+            self.update_list_version()
+
+
+    # The saver thread function - waits for a save request, then waits the save delay so that
+    # subsequent save requests are coalesced, then saves. A failed save is logged and retried after the
+    # save delay.
+    def _save_thread_fn(self):
+        while True:
+            self.save_event.wait()
+            time.sleep(self.save_delay)
+            try:
+                self.flush()
+            except:
+                _LOG.exception('Failed to save "%s"', self.config_path)
+
+
+    # Conversation context manager - yields the conversation (or None if unknown) holding only the
+    # conversation's lock
+    @contextmanager
+    def conversation(self, id_, save=False):
+        # Get the conversation and its lock, and pin the conversation
+        with self.config_lock:
+            conversation = self.get_conversation(id_)
+            conversation_lock = self.conversation_lock(id_) if conversation is not None else nullcontext()
+            self.pin_conversation(id_)
+
+        try:
+            # Yield the conversation - if it was deleted while waiting for the lock, yield None
+            with conversation_lock:
+                if conversation is not None and self.conversation_locks.get(id_) is not conversation_lock:
+                    conversation = None
+                yield conversation
+        finally:
+            # Unpin the conversation
+            with self.config_lock:
+                self.unpin_conversation(id_)
+
+        # Save the conversation, if requested
+        if save:
+            with self(save=True):
+                self.changed(conversation_id=id_)
+
+
+    # Get a conversation's lock, creating it if necessary (must hold the config lock)
+    def conversation_lock(self, id_):
+        conversation_lock = self.conversation_locks.get(id_)
+        if conversation_lock is None:
+            conversation_lock = self.conversation_locks[id_] = threading.Lock()
+        return conversation_lock
+
+
+    # Get a conversation by ID, loading or validating its exchanges if necessary (must hold the
+    # config lock). Exchanges are loaded without the storage lock - the storage's exchange reads are
+    # safe while a save is written, so requests do not wait for a save.
+    def get_conversation(self, id_):
+        conversation = self.conversations_by_id.get(id_)
+        if conversation is None:
+            return None
+        if self.loaded_conversations is not None:
+            if 'exchanges' not in conversation:
+                conversation['exchanges'] = self.storage.load_exchanges(id_)
+            self.loaded_conversations[id_] = None
+            self.loaded_conversations.move_to_end(id_)
+            self._evict_conversations()
+        else:
+            self.storage.validate_exchanges(conversation)
+        return conversation
+
+
+    # Pin a conversation so its exchanges are not evicted (must hold the config lock)
+    def pin_conversation(self, id_):
+        self.conversation_pins[id_] = self.conversation_pins.get(id_, 0) + 1
+
+
+    # Unpin a conversation (must hold the config lock)
+    def unpin_conversation(self, id_):
+        pin_count = self.conversation_pins[id_] - 1
+        if pin_count:
+            self.conversation_pins[id_] = pin_count
+        else:
+            del self.conversation_pins[id_]
+
+
+    # Evict the least-recently-used conversations' exchanges in excess of the cache size. The most
+    # recently-used conversation is never evicted, nor are changed or saving conversations. A config that
+    # is not saved is never evicted, since a migrated config's exchanges are not in the storage. (must
+    # hold the config lock)
+    def _evict_conversations(self):
+        if self.loaded_conversations is None or len(self.loaded_conversations) <= self.conversation_cache_size or \
+           self.config.get('noSave'):
+            return
+        for id_ in list(self.loaded_conversations)[:-1]:
+            if id_ not in self.changed_conversations and id_ not in self.saving_conversations and id_ not in self.conversation_pins:
+                del self.conversations_by_id[id_]['exchanges']
+                del self.loaded_conversations[id_]
+                if len(self.loaded_conversations) <= self.conversation_cache_size:
+                    break
+
+
+    # Add a conversation to the top of the conversation list (must hold the config lock)
+    def add_conversation(self, conversation):
+        self.config['conversations'].insert(0, conversation)
+        self.conversations_by_id[conversation['id']] = conversation
+        if self.loaded_conversations is not None:
+            self.loaded_conversations[conversation['id']] = None
+        self.journal_write({'conversation': conversation})
+
+
+    # Delete a conversation and its lock (must hold the config lock)
+    def delete_conversation(self, id_):
+        conversation = self.conversations_by_id.pop(id_)
+        self.config['conversations'] = [conv for conv in self.config['conversations'] if conv is not conversation]
+        self.conversation_locks.pop(id_, None)
+        if self.loaded_conversations is not None:
+            self.loaded_conversations.pop(id_, None)
+        self.journal_write({'delete': {'id': id_}})
+        self.conversation_versions.pop(id_, None)
+        self.exchange_versions.pop(id_, None)
+
+
+    # Record a conversation change - the conversation is marked changed, its version is updated, and the
+    # change record is appended to the journal, if enabled (must hold the config lock or the
+    # conversation's lock). The journal is cleared on save, so a journaled conversation must be saved. A
+    # truncate record updates the conversation's exchange version (see getConversation).
+    def journal_write(self, record):
+        (record_type, value), = record.items()
+        self.changed_conversations.add(value['id'])
+        self.update_version(value['id'])
+        if record_type == 'truncate':
+            self.exchange_versions[value['id']] = self.conversation_versions[value['id']]
+        if record_type in ('conversation', 'delete', 'title'):
+            self.update_list_version()
+        if self.journal is not None:
+            self.journal.write(record)
+
+
+    # Update a conversation's version (see getConversation). Versions are taken from a shared counter,
+    # so each version is unique to its state, and no lock is needed.
+    def update_version(self, id_):
+        self.conversation_versions[id_] = next(self.version_counter)
+
+
+    # Update the conversation list's version and wake its waiters (see getConversations)
+    def update_list_version(self):
+        with self.list_version_condition:
+            self.list_version = next(self.version_counter)
+            self.list_version_condition.notify_all()
+
+
+    # Wait until the conversation list's version is not the version, or the timeout, in seconds, expires
+    def wait_list_version(self, version, timeout):
+        with self.list_version_condition:
+            self.list_version_condition.wait_for(lambda: self.list_version != version, timeout)
+
+
+    # Apply journal records to the config
+    def _replay_journal(self, records):
+        for record in records:
+            (record_type, value), = record.items()
+            id_ = value['id']
+            if record_type == 'conversation':
+                if id_ not in self.conversations_by_id:
+                    self.add_conversation(value)
+            elif record_type == 'delete':
+                if id_ in self.conversations_by_id:
+                    self.delete_conversation(id_)
+            else:
+                conversation = self.get_conversation(id_)
+                if conversation is None:
+                    continue
+                exchanges = conversation['exchanges']
+                if record_type == 'title':
+                    conversation['title'] = value['title']
+                elif record_type == 'exchange':
+                    del exchanges[value['index']:]
+                    exchanges.append({'user': value['user'], 'model': ''})
+                elif record_type == 'truncate':
+                    del exchanges[value['index']:]
+                elif value['index'] < len(exchanges):
+                    exchange = exchanges[value['index']]
+                    exchange[value['field']] = exchange.get(value['field'], '')[:value['offset']] + value['text']
+            self.changed(conversation_id=id_)
+
+
+    # Move a conversation up or down in the conversation list (must hold the config lock)
+    def move_conversation(self, id_, down):
+        _move_item(self.config['conversations'], self.conversations_by_id[id_], down)
+        self.update_list_version()
+
+
+    # Add a template to the top of the template list (must hold the config lock)
+    def add_template(self, template):
+        if 'templates' not in self.config:
+            self.config['templates'] = []
+        self.config['templates'].insert(0, template)
+        self._index_templates()
+
+
+    # Replace a template (must hold the config lock)
+    def update_template(self, template):
+        templates = self.config['templates']
+        old_template = self.templates_by_id[template['id']]
+        templates[next(ix for ix, tmpl in enumerate(templates) if tmpl is old_template)] = template
+        self._index_templates()
+
+
+    # Delete a template (must hold the config lock)
+    def delete_template(self, id_):
+        template = self.templates_by_id[id_]
+        self.config['templates'] = [tmpl for tmpl in self.config['templates'] if tmpl is not template]
+        self._index_templates()
+
+
+    # Move a template up or down in the template list (must hold the config lock)
+    def move_template(self, id_, down):
+        _move_item(self.config['templates'], self.templates_by_id[id_], down)
+        self._index_templates()
+
+
+    # Re-index the templates - the first template with a name takes precedence
+    def _index_templates(self):
+        self.update_list_version()
+        templates = self.config.get('templates') or []
+        self.templates_by_id = {template['id']: template for template in templates}
+        self.templates_by_name = {}
+        for template in templates:
+            if 'name' in template and template['name'] not in self.templates_by_name:
+                self.templates_by_name[template['name']] = template
+
+
+    # Mark a conversation or template as changed for the next save (must hold the config lock)
+    def changed(self, conversation_id=None, template_id=None):
+        if conversation_id is not None:
+            self.changed_conversations.add(conversation_id)
+        if template_id is not None:
+            self.changed_templates.add(template_id)
+
+
+# Helper to copy a config for a save - the conversations and their loaded exchanges are modified in
+# place, so they're copied. Templates are replaced, not modified, so only the template list is copied.
+def _copy_config(config):
+    config_copy = dict(config)
+    config_copy['conversations'] = [
+        {**conversation, 'exchanges': [dict(exchange) for exchange in conversation['exchanges']]}
+        if 'exchanges' in conversation else dict(conversation)
+        for conversation in config['conversations']
+    ]
+    if 'templates' in config:
+        config_copy['templates'] = list(config['templates'])
+    return config_copy
+
+
+# Helper to move a list item up or down one position
+def _move_item(items, item, down):
+    ix_item = next(ix for ix, other in enumerate(items) if other is item)
+    ix_other = ix_item + 1 if down else ix_item - 1
+    if 0 <= ix_other < len(items):
+        items[ix_item] = items[ix_other]
+        items[ix_other] = item
+
 
 # The model download manager class
 class DownloadManager():
-    __slots__ = ('app', 'model', 'status', 'completed', 'total', 'stop')
+    __slots__ = ('app', 'model', 'status', 'completed', 'total', 'stop', 'progress_time')
 
 
     def __init__(self, app, model):
@@ -146,6 +582,12 @@ class DownloadManager():
         self.completed = 0
         self.total = 0
         self.stop = False
+        self.progress_time = 0
+
+        # Start the download coroutine, if there's an asynchronous chat engine
+        if app.engine is not None:
+            app.engine.submit(self.download_async_fn(self))
+            return
 
         # Start the download thread
         download_thread = threading.Thread(target=self.download_thread_fn, args=(self, app.pool_manager))
@@ -156,23 +598,103 @@ class DownloadManager():
     @staticmethod
     def download_thread_fn(manager, pool_manager):
         try:
-            for progress in ollama_pull(pool_manager, manager.model):
+            for progress in ollama_pull(pool_manager, manager.model, manager.app.backends):
                 # Stopped?
                 if manager.stop:
                     break
 
                 # Update the download status
-                manager.status = progress['status']
-                manager.completed = progress.get('completed', 0)
-                manager.total = progress.get('total')
+                _download_progress(manager, progress)
 
         except:
             pass
 
-        # Delete the application's download entry (under the config lock, and only if it's still ours)
-        with manager.app.config():
-            if manager.app.downloads.get(manager.model) is manager:
-                del manager.app.downloads[manager.model]
+        _download_end(manager)
+
+
+    # The download coroutine - the asynchronous equivalent of download_thread_fn
+    @staticmethod
+    async def download_async_fn(manager):
+        try:
+            async with aclosing(ollama_pull_async(manager.model, manager.app.backends)) as progresses:
+                async for progress in progresses:
+                    # Stopped?
+                    if manager.stop:
+                        break
+
+                    # Update the download status
+                    _download_progress(manager, progress)
+
+        except:
+            pass
+
+        await asyncio.to_thread(_download_end, manager)
+
+
+# The minimum interval, in seconds, at which download progress wakes the model list's waiters
+DOWNLOAD_PROGRESS_INTERVAL = 1
+
+
+# Helper to update a download's status from an Ollama pull progress response - the model list's
+# waiters are woken on status changes and, at intervals, on progress
+def _download_progress(manager, progress):
+    now = time.monotonic()
+    changed = progress['status'] != manager.status or now >= manager.progress_time
+    manager.status = progress['status']
+    manager.completed = progress.get('completed', 0)
+    manager.total = progress.get('total')
+    if changed:
+        manager.progress_time = now + DOWNLOAD_PROGRESS_INTERVAL
+        _update_models_version(manager.app)
+
+
+# Helper to delete the application's download entry (under the config lock, and only if it's still ours)
+def _download_end(manager):
+    manager.app.model_cache.invalidate(manager.model)
+    with manager.app.config():
+        if manager.app.downloads.get(manager.model) is manager:
+            del manager.app.downloads[manager.model]
+    _update_models_version(manager.app)
+
+
+# The minimum interval, in seconds, between a model's warm-up requests
+WARM_INTERVAL = 60
+
+
+# Helper to load (warm up) a model on a background thread, so the model's next chat does not wait for
+# the model to load. A model is warmed at most once per warm-up interval.
+def _warm_model(app, model):
+    if not app.warm:
+        return
+    now = time.monotonic()
+    with app.warm_lock:
+        warm_time = app.warm_times.get(model)
+        if warm_time is not None and now < warm_time + WARM_INTERVAL:
+            return
+        app.warm_times[model] = now
+
+    # Start the warm-up thread
+    warm_thread = threading.Thread(target=_warm_model_thread_fn, args=(app, model))
+    warm_thread.daemon = True
+    warm_thread.start()
+
+
+# The model warm-up thread function - the model list's waiters are woken when the model is loaded
+def _warm_model_thread_fn(app, model):
+    with app.config() as config:
+        keep_alive = model_keep_alive(config.get('keepAlive'), model)
+    try:
+        ollama_load(app.pool_manager, model, keep_alive, app.backends)
+    except:
+        return
+    _update_models_version(app)
+
+
+# Helper to update the model list's version and wake its waiters (see getModels)
+def _update_models_version(app):
+    with app.models_version_condition:
+        app.models_version += 1
+        app.models_version_condition.notify_all()
 
 
 # The Ollama Chat API type model
@@ -180,113 +702,160 @@ with importlib.resources.files('ollama_chat.static').joinpath('ollamaChat.smd').
     OLLAMA_CHAT_TYPES = schema_markdown.parse_schema_markdown(cm_smd.read())
 
 
-@chisel.action(name='getConversations', types=OLLAMA_CHAT_TYPES)
-def get_conversations(ctx, unused_req):
+# The maximum time, in seconds, that a request with a "waitVersion" waits for a version change
+WAIT_VERSION_TIMEOUT = 20
+
+
+# The maximum number of waiting requests - "waitVersion" requests and event streams each hold a web
+# server request thread while waiting, so requests beyond the limit do not wait (see WAITRESS_THREADS)
+MAX_WAITERS = 8
+
+
+# Helper context manager to hold one of the application's waiter slots - yields True if a slot is
+# acquired, or False if the maximum number of requests are already waiting
+@contextmanager
+def _waiter(app):
+    acquired = app.waiters.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            app.waiters.release()
+
+
+@chisel.action(name='getConversations', types=OLLAMA_CHAT_TYPES, wsgi_response=True)
+def get_conversations(ctx, req):
+    # Wait for the conversation list to change?
+    if 'waitVersion' in req:
+        with _waiter(ctx.app) as waiting:
+            if waiting:
+                ctx.app.config.wait_list_version(req['waitVersion'], WAIT_VERSION_TIMEOUT)
+
     with ctx.app.config() as config:
-        response = {
-            'conversations': [
-                {
-                    'id': conversation['id'],
-                    'model': conversation['model'],
-                    'title': conversation['title'],
-                    'generating': conversation['id'] in ctx.app.chats
-                }
-                for conversation in config['conversations']
-            ],
-            'templates': [] if 'templates' not in config else [
-                {
-                    'id': template['id'],
-                    'title': template['title']
-                }
-                for template in config['templates']
-            ]
-        }
-        if 'model' in config:
-            response['model'] = config['model']
-        return response
+        # Unchanged?
+        list_version = ctx.app.config.list_version
+        etag = _etag(ctx, list_version)
+        response_not_modified = _response_not_modified(ctx, etag)
+        if response_not_modified is not None:
+            return response_not_modified
+
+        response = _conversations_response(ctx.app, config, list_version)
+    return _response_json(ctx, response, etag)
+
+
+# Helper to create the getConversations response (under the config lock)
+def _conversations_response(app, config, list_version):
+    archived_ids = getattr(app.config.storage, 'archived_ids', ())
+    response = {
+        'conversations': [
+            {
+                'id': conversation['id'],
+                'model': conversation['model'],
+                'title': conversation['title'],
+                'generating': conversation['id'] in app.chats,
+                **({'archived': True} if conversation['id'] in archived_ids else {})
+            }
+            for conversation in config['conversations']
+        ],
+        'templates': [] if 'templates' not in config else [
+            {
+                'id': template['id'],
+                'title': template['title']
+            }
+            for template in config['templates']
+        ],
+        'version': list_version
+    }
+    if 'model' in config:
+        response['model'] = config['model']
+    return response
+
+
+# Helper to create a JSON action response using the JSON codec. Polled actions use wsgi_response and
+# this helper since their responses are large, frequent, and can be encoded without validation. The
+# client revalidates the response with its ETag on each request (see _response_not_modified).
+def _response_json(ctx, response, etag):
+    return ctx.response(HTTPStatus.OK, 'application/json', [json_dumps(response, compact=True)], headers=_etag_headers(etag))
+
+
+# Helper to create a not-modified response if the request's If-None-Match header matches the ETag -
+# returns None otherwise
+def _response_not_modified(ctx, etag):
+    if_none_match = ctx.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is None or etag not in (match.strip() for match in if_none_match.split(',')):
+        return None
+    return ctx.response(HTTPStatus.NOT_MODIFIED, 'application/json', [], headers=_etag_headers(etag))
+
+
+# Helper to create a polled action's ETag from version values - the config manager's instance ID is
+# included so that ETags from a previous run never match
+def _etag(ctx, *versions):
+    return '"' + '-'.join(str(value) for value in (ctx.app.config.instance_id, *versions)) + '"'
+
+
+# Helper to create a polled action's response headers
+def _etag_headers(etag):
+    return [('Cache-Control', 'no-cache'), ('ETag', etag)]
 
 
 @chisel.action(name='setModel', types=OLLAMA_CHAT_TYPES)
 def set_model(ctx, req):
     with ctx.app.config(save=True) as config:
         config['model'] = req['model']
+        ctx.app.config.update_list_version()
+        _update_models_version(ctx.app)
+
+    # Load the model, so the next chat does not wait for it
+    _warm_model(ctx.app, req['model'])
 
 
 @chisel.action(name='moveConversation', types=OLLAMA_CHAT_TYPES)
 def move_conversation(ctx, req):
-    with ctx.app.config(save=True) as config:
-        # Find the conversation index
+    with ctx.app.config(save=True):
         id_ = req['id']
-        conversations = config['conversations']
-        ix_conv = next((ix for ix, conv in enumerate(conversations) if conv['id'] == id_), None)
-        if ix_conv is None:
+        if id_ not in ctx.app.config.conversations_by_id:
             raise chisel.ActionError('UnknownConversationID')
-        conversation = conversations[ix_conv]
-
-        # Move down?
-        if req['down']:
-            if ix_conv < len(conversations) - 1:
-                conversations[ix_conv] = conversations[ix_conv + 1]
-                conversations[ix_conv + 1] = conversation
-        else:
-            if ix_conv > 0:
-                conversations[ix_conv] = conversations[ix_conv - 1]
-                conversations[ix_conv - 1] = conversation
+        ctx.app.config.move_conversation(id_, req['down'])
 
 
 @chisel.action(name='moveTemplate', types=OLLAMA_CHAT_TYPES)
 def move_template(ctx, req):
-    with ctx.app.config(save=True) as config:
-        # Find the template index
+    with ctx.app.config(save=True):
         id_ = req['id']
-        templates = config.get('templates') or []
-        ix_tmpl = next((ix for ix, tmpl in enumerate(templates) if tmpl['id'] == id_), None)
-        if ix_tmpl is None:
+        if id_ not in ctx.app.config.templates_by_id:
             raise chisel.ActionError('UnknownTemplateID')
-        template = templates[ix_tmpl]
-
-        # Move down?
-        if req['down']:
-            if ix_tmpl < len(templates) - 1:
-                templates[ix_tmpl] = templates[ix_tmpl + 1]
-                templates[ix_tmpl + 1] = template
-        else:
-            if ix_tmpl > 0:
-                templates[ix_tmpl] = templates[ix_tmpl - 1]
-                templates[ix_tmpl - 1] = template
+        ctx.app.config.move_template(id_, req['down'])
 
 
 @chisel.action(name='deleteTemplate', types=OLLAMA_CHAT_TYPES)
 def delete_template(ctx, req):
-    with ctx.app.config(save=True) as config:
+    with ctx.app.config(save=True):
         id_ = req['id']
-        templates = config.get('templates') or []
-        ix_tmpl = next((ix for ix, tmpl in enumerate(templates) if tmpl['id'] == id_), None)
-        if ix_tmpl is None:
+        if id_ not in ctx.app.config.templates_by_id:
             raise chisel.ActionError('UnknownTemplateID')
-        del templates[ix_tmpl]
+        ctx.app.config.delete_template(id_)
 
 
 @chisel.action(name='getTemplate', types=OLLAMA_CHAT_TYPES)
 def get_template(ctx, req):
     template_id = req['id']
-    with ctx.app.config() as config:
-        templates = config.get('templates') or []
-        template = next((template for template in templates if template['id'] == template_id), None)
-        if template is None:
-            raise chisel.ActionError('UnknownTemplateID')
-        return copy.deepcopy(template)
+    with ctx.app.config():
+        template = ctx.app.config.templates_by_id.get(template_id)
+    if template is None:
+        raise chisel.ActionError('UnknownTemplateID')
+
+    # Templates are replaced, not modified, when updated, so no copy is needed
+    return template
 
 
 @chisel.action(name='updateTemplate', types=OLLAMA_CHAT_TYPES)
 def update_template(ctx, req):
     template_id = req['id']
-    with ctx.app.config(save=True) as config:
-        templates = config.get('templates') or []
-        ix_template = next((ix_tmpl for ix_tmpl, tmpl in enumerate(templates) if tmpl['id'] == template_id), None)
-        if ix_template is None:
+    with ctx.app.config(save=True):
+        if template_id not in ctx.app.config.templates_by_id:
             raise chisel.ActionError('UnknownTemplateID')
-        templates[ix_template] = req
+        ctx.app.config.update_template(req)
+        ctx.app.config.changed(template_id=template_id)
 
 
 @chisel.action(name='startConversation', types=OLLAMA_CHAT_TYPES)
@@ -308,10 +877,10 @@ def start_conversation(ctx, req):
         conversation = {'id': id_, 'model': model, 'title': title, 'exchanges': []}
 
         # Add the new conversation to the application config
-        config['conversations'].insert(0, conversation)
+        ctx.app.config.add_conversation(conversation)
 
         # Start the model chat
-        ctx.app.chats[id_] = ChatManager(ctx.app, id_, [user_prompt])
+        ctx.app.chats[id_] = ChatManager(ctx.app, id_, [user_prompt], model)
 
         # Return the new conversation identifier
         return {'id': id_}
@@ -324,10 +893,9 @@ def start_template(ctx, req):
 
     with ctx.app.config() as config:
         # Get the conversation template
-        templates = config.get('templates') or []
-        template = next((template for template in templates if template['id'] == template_id), None)
+        template = ctx.app.config.templates_by_id.get(template_id)
         if template is None:
-            template = next((template for template in templates if template.get('name') == template_id), None)
+            template = ctx.app.config.templates_by_name.get(template_id)
         if template is None:
             raise chisel.ActionError('UnknownTemplateID', f'Unknown template "{template_id}"')
 
@@ -347,10 +915,10 @@ def start_template(ctx, req):
         conversation = {'id': id_, 'model': model, 'title': title, 'exchanges': []}
 
         # Add the new conversation to the application config
-        config['conversations'].insert(0, conversation)
+        ctx.app.config.add_conversation(conversation)
 
         # Start the model chat
-        ctx.app.chats[id_] = ChatManager(ctx.app, id_, prompts)
+        ctx.app.chats[id_] = ChatManager(ctx.app, id_, prompts, model, CHAT_PRIORITY_TEMPLATE)
 
         # Return the new conversation identifier
         return {'id': id_}
@@ -358,9 +926,8 @@ def start_template(ctx, req):
 
 @chisel.action(name='stopConversation', types=OLLAMA_CHAT_TYPES)
 def stop_conversation(ctx, req):
-    with ctx.app.config() as config:
-        id_ = req['id']
-        conversation = config_conversation(config, id_)
+    id_ = req['id']
+    with ctx.app.config.conversation(id_) as conversation:
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
@@ -369,34 +936,184 @@ def stop_conversation(ctx, req):
         if chat is None:
             return
 
-        # Stop the conversation
+        # Stop the conversation - a queued chat is removed from the queue
         chat.stop = True
         del ctx.app.chats[id_]
+        ctx.app.config.update_version(id_)
+        ctx.app.config.update_list_version()
+        if ctx.app.scheduler is not None:
+            ctx.app.scheduler.cancel(chat)
 
 
-@chisel.action(name='getConversation', types=OLLAMA_CHAT_TYPES)
+@chisel.action(name='getConversation', types=OLLAMA_CHAT_TYPES, wsgi_response=True)
 def get_conversation(ctx, req):
-    with ctx.app.config() as config:
-        id_ = req['id']
-        conversation = config_conversation(config, id_)
+    id_ = req['id']
+    with ctx.app.config.conversation(id_) as conversation:
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
-        # Add the generating status
-        conversation = copy.deepcopy(conversation)
-        conversation['generating'] = id_ in ctx.app.chats
+        # Get the conversation's queue position, if queued
+        chat = ctx.app.chats.get(id_)
+        queued = None
+        if chat is not None and ctx.app.scheduler is not None:
+            queued = ctx.app.scheduler.queue_position(chat)
+
+        # Not generating? If so, load the conversation's model so the next reply does not wait for it.
+        if chat is None:
+            _warm_model(ctx.app, conversation['model'])
+
+        # Unchanged?
+        version = ctx.app.config.conversation_versions.get(id_, 0)
+        etag = _etag(ctx, version, queued or 0)
+        response_not_modified = _response_not_modified(ctx, etag)
+        if response_not_modified is not None:
+            return response_not_modified
+
+        # Return the conversation with its generating status and version
+        response_conversation = {**conversation, 'generating': chat is not None, 'version': version}
+        if queued is not None:
+            response_conversation['queued'] = queued
+        response = {'conversation': response_conversation}
+
+        # Add the most recent exchange's response text offsets (for the next delta request)
+        exchanges = conversation['exchanges']
+        if exchanges:
+            exchange = exchanges[-1]
+            response_conversation['modelOffset'] = len(exchange['model'])
+            if 'thinking' in exchange:
+                response_conversation['thinkingOffset'] = len(exchange['thinking'])
+
+        # Delta request? If so, return only the exchanges and response text since the request's offsets.
+        # The delta is valid only if no exchange was deleted or replaced since the request's version.
+        response_exchanges = None
+        if 'sinceExchange' in req and ctx.app.config.exchange_versions.get(id_, 0) <= req.get('sinceVersion', -1) <= version:
+            response_exchanges = _delta_exchanges(
+                exchanges, req['sinceExchange'], req.get('sinceModelOffset', 0), req.get('sinceThinkingOffset', 0)
+            )
+            if response_exchanges is not None:
+                response_conversation['sinceExchange'] = req['sinceExchange']
+        if response_exchanges is None:
+            response_exchanges = list(exchanges)
+
+        # Only the most recent exchange is modified in place, so the previous exchanges are shared with
+        # the conversation and the response is encoded outside of the conversation lock
+        if response_exchanges and response_exchanges[-1] is exchanges[-1]:
+            response_exchanges[-1] = dict(response_exchanges[-1])
+        response_conversation['exchanges'] = response_exchanges
+
+    return _response_json(ctx, response, etag)
+
+
+# Helper to compute a delta request's exchanges (see getConversation) - returns None if the delta
+# exchange index or offsets are out of range (e.g., the exchange was deleted)
+def _delta_exchanges(exchanges, ix_since, model_offset, thinking_offset):
+    if ix_since >= len(exchanges):
+        return None
+    exchange = exchanges[ix_since]
+    if model_offset > len(exchange['model']) or thinking_offset > len(exchange.get('thinking', '')):
+        return None
+
+    # The first exchange's response text is the text since the offsets
+    delta_exchange = {'user': exchange['user'], 'model': exchange['model'][model_offset:]}
+    if 'thinking' in exchange:
+        delta_exchange['thinking'] = exchange['thinking'][thinking_offset:]
+    return [delta_exchange, *exchanges[ix_since + 1:]]
+
+
+# The interval, in seconds, at which a conversation event stream checks for new response text
+STREAM_CONVERSATION_INTERVAL = 0.1
+
+
+@chisel.action(name='streamConversation', types=OLLAMA_CHAT_TYPES, wsgi_response=True)
+def stream_conversation(ctx, req):
+    id_ = req['id']
+    with ctx.app.config():
+        if id_ not in ctx.app.config.conversations_by_id:
+            raise chisel.ActionError('UnknownConversationID')
+    return ctx.response(
+        HTTPStatus.OK, 'text/event-stream', _stream_conversation_events(ctx.app, id_), headers=[('Cache-Control', 'no-cache')]
+    )
+
+
+# Helper generator to yield a conversation's server-sent events (see streamConversation). The
+# conversation is pinned while streaming so its exchanges are not evicted. Only the new response text
+# is sent, so each check costs the new text rather than the whole conversation. A stream holds one of
+# the application's waiter slots - if none is available, the stream ends after the current events.
+def _stream_conversation_events(app, id_):
+    # Conversation deleted? If so, don't create its lock.
+    with app.config():
+        conversation = app.config.get_conversation(id_)
+        if conversation is None:
+            conversation_lock = None
+        else:
+            conversation_lock = app.config.conversation_lock(id_)
+            app.config.pin_conversation(id_)
+    if conversation is None:
+        yield _sse_event('done', {})
+        return
+
+    try:
+        with _waiter(app) as waiting:
+            exchange_state = {}
+            while True:
+                with conversation_lock:
+                    # Conversation deleted?
+                    if app.config.conversation_locks.get(id_) is not conversation_lock:
+                        break
+                    generating = id_ in app.chats
+                    events = _exchange_events(conversation['exchanges'], exchange_state)
+
+                # Send the events
+                for event, data in events:
+                    yield _sse_event(event, data)
+
+                # Done generating?
+                if not generating:
+                    break
+
+                # Beyond the maximum number of waiting requests? If so, end the stream - the client reconnects.
+                if not waiting:
+                    return
+                time.sleep(STREAM_CONVERSATION_INTERVAL)
+
+        yield _sse_event('done', {})
+
+    finally:
+        with app.config():
+            app.config.unpin_conversation(id_)
+
+
+# Helper to create a conversation's exchange events since the previous call (under the conversation
+# lock). A new exchange is sent entire, otherwise only the most recent exchange's new response text is
+# sent. The state dict tracks the sent exchange index and response text offsets between calls.
+def _exchange_events(exchanges, state):
+    events = []
+    if exchanges:
+        exchange = exchanges[-1]
+        ix_exchange = len(exchanges) - 1
+        if ix_exchange != state.get('index'):
+            state['index'] = ix_exchange
+            state['offsets'] = {field: len(exchange.get(field, '')) for field in ('thinking', 'model')}
+            events.append(('exchange', {'index': ix_exchange, **exchange}))
+        else:
+            offsets = state['offsets']
+            for field in ('thinking', 'model'):
+                text = exchange.get(field, '')
+                if len(text) > offsets[field]:
+                    events.append((field, {'index': ix_exchange, 'text': text[offsets[field]:]}))
+                    offsets[field] = len(text)
+    return events
 
-        # Return the conversation
-        return {
-            'conversation': conversation
-        }
+
+# Helper to encode a server-sent event
+def _sse_event(event, data):
+    return b'event: ' + event.encode('utf-8') + b'\ndata: ' + json_dumps(data, compact=True) + b'\n\n'
 
 
 @chisel.action(name='replyConversation', types=OLLAMA_CHAT_TYPES)
 def reply_conversation(ctx, req):
-    with ctx.app.config() as config:
-        id_ = req['id']
-        conversation = config_conversation(config, id_)
+    id_ = req['id']
+    with ctx.app.config.conversation(id_) as conversation:
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
@@ -405,44 +1122,50 @@ def reply_conversation(ctx, req):
             raise chisel.ActionError('ConversationBusy')
 
         # Start the model chat
-        ctx.app.chats[id_] = ChatManager(ctx.app, id_, [req['user']])
+        ctx.app.chats[id_] = ChatManager(ctx.app, id_, [req['user']], conversation['model'])
+        ctx.app.config.update_list_version()
 
 
 @chisel.action(name='setConversationTitle', types=OLLAMA_CHAT_TYPES)
 def set_conversation_title(ctx, req):
-    with ctx.app.config(save=True) as config:
+    with ctx.app.config(save=True):
         id_ = req['id']
-        conversation = config_conversation(config, id_)
+        conversation = ctx.app.config.conversations_by_id.get(id_)
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
-        # Busy?
-        if id_ in ctx.app.chats:
-            raise chisel.ActionError('ConversationBusy')
+        with ctx.app.config.conversation_lock(id_):
+            # Busy?
+            if id_ in ctx.app.chats:
+                raise chisel.ActionError('ConversationBusy')
 
-        # Set the conversation title
-        conversation['title'] = req['title']
+            # Set the conversation title
+            conversation['title'] = req['title']
+            ctx.app.config.changed(conversation_id=id_)
+            ctx.app.config.journal_write({'title': {'id': id_, 'title': req['title']}})
 
 
 @chisel.action(name='deleteConversation', types=OLLAMA_CHAT_TYPES)
 def delete_conversation(ctx, req):
-    with ctx.app.config(save=True) as config:
+    with ctx.app.config(save=True):
         id_ = req['id']
-        conversation = config_conversation(config, id_)
-        if conversation is None:
+        if id_ not in ctx.app.config.conversations_by_id:
             raise chisel.ActionError('UnknownConversationID')
 
-        # Busy?
-        if id_ in ctx.app.chats:
-            raise chisel.ActionError('ConversationBusy')
+        with ctx.app.config.conversation_lock(id_):
+            # Busy?
+            if id_ in ctx.app.chats:
+                raise chisel.ActionError('ConversationBusy')
 
-        # Delete the conversation
-        config['conversations'] = [conversation for conversation in config['conversations'] if conversation['id'] != id_]
+            # Delete the conversation
+            ctx.app.config.delete_conversation(id_)
+            if ctx.app.command_cache is not None:
+                ctx.app.command_cache.delete(id_)
 
 
 @chisel.action(name='createTemplate', types=OLLAMA_CHAT_TYPES)
 def create_template(ctx, req):
-    with ctx.app.config(save=True) as config:
+    with ctx.app.config(save=True):
         # Create the new template
         id_ = str(uuid.uuid4())
         template = {
@@ -456,9 +1179,8 @@ def create_template(ctx, req):
             template['variables'] = req['variables']
 
         # Add the new template to the application config
-        if 'templates' not in config:
-            config['templates'] = []
-        config['templates'].insert(0, template)
+        ctx.app.config.add_template(template)
+        ctx.app.config.changed(template_id=id_)
 
         # Return the new template identifier
         return {'id': id_}
@@ -466,9 +1188,8 @@ def create_template(ctx, req):
 
 @chisel.action(name='deleteConversationExchange', types=OLLAMA_CHAT_TYPES)
 def delete_conversation_exchange(ctx, req):
-    with ctx.app.config(save=True) as config:
-        id_ = req['id']
-        conversation = config_conversation(config, id_)
+    id_ = req['id']
+    with ctx.app.config.conversation(id_, save=True) as conversation:
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
@@ -480,13 +1201,13 @@ def delete_conversation_exchange(ctx, req):
         exchanges = conversation['exchanges']
         if len(exchanges):
             del exchanges[-1]
+            ctx.app.config.journal_write({'truncate': {'id': id_, 'index': len(exchanges)}})
 
 
 @chisel.action(name='regenerateConversationExchange', types=OLLAMA_CHAT_TYPES)
 def regenerate_conversation_exchange(ctx, req):
-    with ctx.app.config(save=True) as config:
-        id_ = req['id']
-        conversation = config_conversation(config, id_)
+    id_ = req['id']
+    with ctx.app.config.conversation(id_, save=True) as conversation:
         if conversation is None:
             raise chisel.ActionError('UnknownConversationID')
 
@@ -500,48 +1221,78 @@ def regenerate_conversation_exchange(ctx, req):
             # Delete the most recent exchange
             prompt = exchanges[-1]['user']
             del exchanges[-1]
+            ctx.app.config.journal_write({'truncate': {'id': id_, 'index': len(exchanges)}})
 
             # Start the model chat
-            ctx.app.chats[id_] = ChatManager(ctx.app, id_, [prompt])
+            ctx.app.chats[id_] = ChatManager(ctx.app, id_, [prompt], conversation['model'])
+            ctx.app.config.update_list_version()
+
 
+@chisel.action(name='getModels', types=OLLAMA_CHAT_TYPES, wsgi_response=True)
+def get_models(ctx, req):
+    # Wait for the model list to change?
+    if 'waitVersion' in req:
+        with _waiter(ctx.app) as waiting:
+            if waiting:
+                with ctx.app.models_version_condition:
+                    ctx.app.models_version_condition.wait_for(lambda: ctx.app.models_version != req['waitVersion'], WAIT_VERSION_TIMEOUT)
 
-@chisel.action(name='getModels', types=OLLAMA_CHAT_TYPES)
-def get_models(ctx, unused_req):
-    # Get the Ollama models
-    models = ollama_list(ctx.app.pool_manager)
+    # Get the Ollama models and loaded models, and update the model cache's digests
+    models = ollama_list(ctx.app.pool_manager, ctx.app.backends)
+    loaded_models = {model['model']: model for model in ollama_ps(ctx.app.pool_manager, ctx.app.backends)}
+    ctx.app.model_cache.update_digests(models)
 
     # Create the models response
-    response_models = [
-        {
+    response_models = []
+    for model in models:
+        response_model = {
             'id': model['model'],
             'name': model['model'].split(':')[0],
             'parameters': _parse_parameter_size(ctx, model['details']['parameter_size']),
             'size': model['size'],
             'modified': model['modified_at']
         }
-        for model in models
-    ]
+        loaded_model = loaded_models.get(model['model'])
+        if loaded_model is not None:
+            response_model['loadedUntil'] = loaded_model['expires_at']
+        response_models.append(response_model)
 
     with ctx.app.config() as config:
-        # Create the downloading models response
-        downloading_models = []
-        for model_id, download_manager in ctx.app.downloads.items():
-            download = {
-                'id': model_id,
-                'status': download_manager.status,
-                'completed': download_manager.completed
-            }
-            if download_manager.total:
-                download['size'] = download_manager.total
-            downloading_models.append(download)
-
         response = {
             'models': sorted(response_models, key=lambda model: model['id']),
-            'downloading': sorted(downloading_models, key=lambda model: model['id'])
+            'downloading': _downloading_models(ctx.app)
         }
         if 'model' in config:
             response['model'] = config['model']
-        return response
+
+        # Update the model list's version, if the response changed (e.g., a model pulled outside of the application)
+        if response != ctx.app.models_response:
+            ctx.app.models_response = response
+            _update_models_version(ctx.app)
+
+        # Unchanged?
+        models_version = ctx.app.models_version
+        etag = _etag(ctx, models_version)
+        response_not_modified = _response_not_modified(ctx, etag)
+        if response_not_modified is not None:
+            return response_not_modified
+
+    return _response_json(ctx, {**response, 'version': models_version}, etag)
+
+
+# Helper to create the downloading models response (under the config lock)
+def _downloading_models(app):
+    downloading_models = []
+    for model_id, download_manager in app.downloads.items():
+        download = {
+            'id': model_id,
+            'status': download_manager.status,
+            'completed': download_manager.completed
+        }
+        if download_manager.total:
+            download['size'] = download_manager.total
+        downloading_models.append(download)
+    return sorted(downloading_models, key=lambda model: model['id'])
 
 
 def _parse_parameter_size(ctx, parameter_size):
@@ -572,7 +1323,9 @@ def download_model(ctx, req):
     with ctx.app.config():
         model = req['model']
         if model not in ctx.app.downloads:
+            ctx.app.model_cache.invalidate(model)
             ctx.app.downloads[model] = DownloadManager(ctx.app, model)
+            _update_models_version(ctx.app)
 
 
 @chisel.action(name='stopModelDownload', types=OLLAMA_CHAT_TYPES)
@@ -584,7 +1337,22 @@ def stop_model_download(ctx, req):
 
 @chisel.action(name='deleteModel', types=OLLAMA_CHAT_TYPES)
 def delete_model(ctx, req):
-    ollama_delete(ctx.app.pool_manager, req['model'])
+    ollama_delete(ctx.app.pool_manager, req['model'], ctx.app.backends)
+    ctx.app.model_cache.invalidate(req['model'])
+    _update_models_version(ctx.app)
+
+
+@chisel.action(name='getStats', types=OLLAMA_CHAT_TYPES)
+def get_stats(ctx, unused_req):
+    response = {
+        'ollamaPool': ctx.app.pool_stats.stats(),
+        'urlPool': ctx.app.url_pool_stats.stats(),
+        'backends': ctx.app.backends.stats(),
+        'loads': ctx.app.load_stats.stats()
+    }
+    if hasattr(ctx.app.config.storage, 'archive_stats'):
+        response['archive'] = ctx.app.config.storage.archive_stats()
+    return response
 
 
 @chisel.action(name='getSystemInfo', types=OLLAMA_CHAT_TYPES)
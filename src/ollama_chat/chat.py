@@ -6,8 +6,13 @@ The ollama-chat chat manager
 """
 
 import argparse
+import asyncio
 import base64
+import bisect
+import collections
+import contextlib
 import functools
+import hashlib
 import itertools
 import os
 import pathlib
@@ -15,22 +20,63 @@ import re
 import shlex
 import sys
 import threading
+import time
 
 import urllib3
 
-from .ollama import ollama_chat
+from .ollama import model_keep_alive, ollama_chat, ollama_chat_async
 
 
-# The ollama chat manager class
+# The interval, in seconds, at which streaming response text is written to the config journal
+JOURNAL_INTERVAL = 1
+
+
+# The interval, in seconds, and the maximum number of chunks, at which buffered streaming response
+# text is published to the conversation
+STREAM_PUBLISH_INTERVAL = 0.1
+STREAM_PUBLISH_CHUNKS = 100
+
+
+# The chat priorities - lower priority chats are started first
+CHAT_PRIORITY = 0
+CHAT_PRIORITY_TEMPLATE = 1
+
+
+# The chat engine names - chats are run on a thread per chat or as coroutines on a single event loop thread
+CHAT_ENGINES = ('thread', 'async')
+
+
+# The ollama chat manager class. If the application has a chat scheduler, the chat is queued. If the
+# application has an asynchronous chat engine, the chat coroutine is started. Otherwise, the chat
+# thread is started. The caller must hold the config lock or the conversation's lock.
 class ChatManager():
-    __slots__ = ('app', 'conversation_id', 'prompts', 'stop')
+    __slots__ = ('app', 'conversation_id', 'prompts', 'stop', 'prompt_added')
 
 
-    def __init__(self, app, conversation_id, prompts):
+    def __init__(self, app, conversation_id, prompts, model=None, priority=CHAT_PRIORITY):
         self.app = app
         self.conversation_id = conversation_id
         self.prompts = list(prompts)
         self.stop = False
+        self.prompt_added = False
+
+        # The conversation is now generating
+        app.config.update_version(conversation_id)
+
+        # Queue the chat, if there's a chat scheduler. The first prompt is added to the conversation and
+        # journaled now, so a queued prompt is not lost if the application exits before the chat runs.
+        if app.scheduler is not None:
+            exchanges = app.config.conversations_by_id[conversation_id]['exchanges']
+            exchanges.append({'user': self.prompts[0], 'model': ''})
+            app.config.journal_write({'exchange': {'id': conversation_id, 'index': len(exchanges) - 1, 'user': self.prompts[0]}})
+            self.prompt_added = True
+            app.scheduler.submit(self, model, priority)
+            return
+
+        # Start the chat coroutine, if there's an asynchronous chat engine
+        if app.engine is not None:
+            app.engine.submit(self.chat_async_fn(self))
+            return
 
         # Start the chat thread
         chat_thread = threading.Thread(target=self.chat_thread_fn, args=(self,))
@@ -40,101 +86,455 @@ class ChatManager():
 
     @staticmethod
     def chat_thread_fn(chat):
+        conversation, conversation_lock = _chat_begin(chat)
+        stream = _ChatStream(chat, conversation, conversation_lock)
         try:
             while chat.prompts:
-                # Create the Ollama messages from the conversation
-                messages = []
-                flags = {}
-                with chat.app.config() as config:
-                    conversation = config_conversation(config, chat.conversation_id)
-                    model = conversation['model']
-
-                    # Add the next user prompt
-                    conversation['exchanges'].append({'user': chat.prompts[0], 'model': ''})
-                    del chat.prompts[0]
-
-                    # Process user prompt commands append to messages (unless there's a "do" command)
-                    for exchange in conversation['exchanges']:
-                        flags = {}
-                        user_content = _process_commands(chat, exchange['user'], flags)
-                        if 'do' not in flags:
-                            messages.append({'role': 'user', 'content': user_content, 'images': flags.get('images')})
-                            if exchange['model'] != '':
-                                messages.append({'role': 'assistant', 'content': exchange['model']})
-
-                    # Help command?
-                    if 'help' in flags:
-                        exchange = conversation['exchanges'][-1]
-                        exchange['model'] = f'```\n{flags["help"].strip()}\n```'
-                        continue
-
-                    # Show command?
-                    elif 'show' in flags:
-                        exchange = conversation['exchanges'][-1]
-                        exchange['model'] = user_content
-                        continue
-
-                    # Do command?
-                    elif 'do' in flags:
-                        messages = []
-                        for template_name, variable_values in reversed(flags['do']):
-                            # Insert the template prompts to the chat
-                            templates = config.get('templates') or []
-                            template = next((tmpl for tmpl in templates if tmpl.get('name') == template_name), None)
-                            if template is None:
-                                raise ValueError(f'unknown template "{template_name}"')
-                            _, template_prompts = config_template_prompts(template, variable_values)
-                            for template_prompt in reversed(template_prompts):
-                                chat.prompts.insert(0, template_prompt)
-
-                            # Add the template message
-                            message_values = ', '.join(f'{vname} = "{vval}"' for vname, vval in sorted(variable_values.items()))
-                            if message_values:
-                                message = f'Executing template "{template_name}" - {message_values}'
-                            else:
-                                message = f'Executing template "{template_name}"'
-                            messages.append(message)
-
-                        # Update the conversation
-                        exchange = conversation['exchanges'][-1]
-                        exchange['model'] = '\n\n'.join(reversed(messages))
-                        continue
+                # Add the next user prompt and create the Ollama messages
+                chat_request = _chat_prompt(chat, stream)
+                if chat_request is None:
+                    continue
+                model, messages, keep_alive = chat_request
 
                 # Stream the chat response
-                for chunk in ollama_chat(chat.app.pool_manager, model, messages):
+                stream.start()
+                for chunk in ollama_chat(chat.app.pool_manager, model, messages, chat.app.model_cache, chat.app.backends, keep_alive):
                     if chat.stop:
                         break
-
-                    # Update the conversation
-                    with chat.app.config() as config:
-                        conversation = config_conversation(config, chat.conversation_id)
-                        exchange = conversation['exchanges'][-1]
-                        if 'thinking' in chunk['message']:
-                            if 'thinking' not in exchange:
-                                exchange['thinking'] = ''
-                            exchange['thinking'] += chunk['message']['thinking']
-                        else:
-                            exchange['model'] += chunk['message']['content']
+                    stream.add(chunk)
+                stream.finish()
                 if chat.stop:
                     break
 
         except Exception as exc:
-            # Communicate the error
-            with chat.app.config() as config:
-                conversation = config_conversation(config, chat.conversation_id)
-                exchange = conversation['exchanges'][-1]
-                exchange['model'] += f'\n**ERROR:** {exc}'
+            stream.error(exc)
+
+        _chat_end(chat)
 
-        # Save the conversation
-        with chat.app.config(save=True):
-            # Delete the application's chat entry
-            if chat.conversation_id in chat.app.chats:
-                del chat.app.chats[chat.conversation_id]
 
+    # The chat coroutine - the asynchronous equivalent of chat_thread_fn. Prompt command processing,
+    # which may read files and URLs, and the config updates, which may wait on a config save, are run
+    # on worker threads so they do not block the event loop.
+    @staticmethod
+    async def chat_async_fn(chat):
+        conversation, conversation_lock = await asyncio.to_thread(_chat_begin, chat)
+        stream = _ChatStream(chat, conversation, conversation_lock)
+        try:
+            while chat.prompts:
+                # Add the next user prompt and create the Ollama messages
+                chat_request = await asyncio.to_thread(_chat_prompt, chat, stream)
+                if chat_request is None:
+                    continue
+                model, messages, keep_alive = chat_request
+
+                # Stream the chat response - the buffered response text is published only when the
+                # conversation lock is available, so a config save does not block the event loop
+                stream.start()
+                chat_chunks = ollama_chat_async(model, messages, chat.app.model_cache, chat.app.backends, keep_alive)
+                async with contextlib.aclosing(chat_chunks) as chunks:
+                    async for chunk in chunks:
+                        if chat.stop:
+                            break
+                        stream.add(chunk, blocking=False)
+                await asyncio.to_thread(stream.finish)
+                if chat.stop:
+                    break
+
+        except Exception as exc:
+            await asyncio.to_thread(stream.error, exc)
+
+        await asyncio.to_thread(_chat_end, chat)
+
+
+# Helper to get a chat's conversation and its lock - the conversation's exchanges are updated holding
+# only the conversation lock. The conversation is pinned so its exchanges are not evicted.
+def _chat_begin(chat):
+    with chat.app.config():
+        conversation = chat.app.config.get_conversation(chat.conversation_id)
+        conversation_lock = chat.app.config.conversation_lock(chat.conversation_id)
+        chat.app.config.pin_conversation(chat.conversation_id)
+    return conversation, conversation_lock
+
+
+# Helper to save a chat's conversation and delete the application's chat entry
+def _chat_end(chat):
+    with chat.app.config(save=True):
+        chat.app.config.changed(conversation_id=chat.conversation_id)
+        chat.app.config.unpin_conversation(chat.conversation_id)
+        chat.app.config.update_version(chat.conversation_id)
+        chat.app.config.update_list_version()
+
+        # Delete the application's chat entry
+        if chat.conversation_id in chat.app.chats:
+            del chat.app.chats[chat.conversation_id]
+
+
+# Helper to add a chat's next user prompt to its conversation and create the Ollama messages -
+# returns the model, messages, and model keep-alive duration, or None if the prompt was handled by a
+# prompt command
+def _chat_prompt(chat, stream):
+    conversation = stream.conversation
+
+    # Get the templates-by-name index (for "do" commands) - the index is replaced, not modified, when
+    # templates change, so no copy is needed
+    with chat.app.config() as config:
+        templates_by_name = chat.app.config.templates_by_name
+        keep_alives = config.get('keepAlive')
+
+    # Add the next user prompt, unless it was added when the chat was queued. The exchanges' prompts and
+    # responses are copied, so the prompt commands, which may read files, directories, and URLs, are
+    # processed without holding the conversation lock.
+    with stream.conversation_lock:
+        model = conversation['model']
+        if chat.prompt_added:
+            chat.prompt_added = False
+        else:
+            conversation['exchanges'].append({'user': chat.prompts[0], 'model': ''})
+            chat.app.config.journal_write({'exchange': {
+                'id': chat.conversation_id, 'index': len(conversation['exchanges']) - 1, 'user': conversation['exchanges'][-1]['user']
+            }})
+        del chat.prompts[0]
+        stream.journal_offsets = {}
+        exchanges = [(exchange['user'], exchange['model']) for exchange in conversation['exchanges']]
+
+    # Process user prompt commands append to messages (unless there's a "do" command)
+    messages = []
+    flags = {}
+    for ix_exchange, (user, model_content) in enumerate(exchanges):
+        user_content, flags = _process_exchange_commands(chat, user, ix_exchange, ix_exchange == len(exchanges) - 1)
+        if 'do' not in flags:
+            messages.append({'role': 'user', 'content': user_content, 'images': flags.get('images')})
+            if model_content != '':
+                messages.append({'role': 'assistant', 'content': model_content})
+
+    # Help command?
+    if 'help' in flags:
+        response = f'```\n{flags["help"].strip()}\n```'
+
+    # Show command?
+    elif 'show' in flags:
+        response = user_content
+
+    # Do command?
+    elif 'do' in flags:
+        messages = []
+        for template_name, variable_values in reversed(flags['do']):
+            # Insert the template prompts to the chat
+            template = templates_by_name.get(template_name)
+            if template is None:
+                raise ValueError(f'unknown template "{template_name}"')
+            _, template_prompts = config_template_prompts(template, variable_values)
+            for template_prompt in reversed(template_prompts):
+                chat.prompts.insert(0, template_prompt)
+
+            # Add the template message
+            message_values = ', '.join(f'{vname} = "{vval}"' for vname, vval in sorted(variable_values.items()))
+            if message_values:
+                message = f'Executing template "{template_name}" - {message_values}'
+            else:
+                message = f'Executing template "{template_name}"'
+            messages.append(message)
+        response = '\n\n'.join(reversed(messages))
+
+    else:
+        return model, messages, model_keep_alive(keep_alives, model)
+
+    # Update the conversation, unless the chat was stopped
+    with stream.conversation_lock:
+        if not chat.stop:
+            conversation['exchanges'][-1]['model'] = response
+            stream.journal()
+    return None
+
+
+# Helper to process a conversation exchange's prompt commands - returns the processed prompt and the
+# command flags. If the application has a prompt command cache, the previous exchanges' processed
+# prompts are cached, so their file, directory, image, and URL content is read only once. The current
+# (most recent) exchange's prompt is always processed.
+def _process_exchange_commands(chat, prompt, ix_exchange, is_current):
+    command_cache = chat.app.command_cache
+    if command_cache is not None and not is_current:
+        cached = command_cache.get(chat.conversation_id, ix_exchange, prompt)
+        if cached is not None:
+            return cached
+
+    # Process the prompt commands
+    flags = {}
+    user_content = _process_commands(chat, prompt, flags)
+    if command_cache is not None:
+        command_cache.set(chat.conversation_id, ix_exchange, prompt, user_content, flags)
+    return user_content, flags
+
+
+# The default maximum number of conversations whose processed prompts are cached
+COMMAND_CACHE_SIZE = 20
+
+
+# The prompt command cache class - caches the processed prompts and command flags of conversation
+# exchanges, keyed by exchange index and prompt hash, for the max_conversations most recently-used
+# conversations
+class CommandCache:
+    __slots__ = ('max_conversations', 'cache_lock', 'conversations')
+
+
+    def __init__(self, max_conversations=COMMAND_CACHE_SIZE):
+        self.max_conversations = max_conversations
+        self.cache_lock = threading.Lock()
+        self.conversations = collections.OrderedDict()
+
+
+    # Get an exchange's cached processed prompt and command flags - returns None if the exchange is not
+    # cached or its prompt has changed
+    def get(self, conversation_id, ix_exchange, prompt):
+        with self.cache_lock:
+            exchanges = self.conversations.get(conversation_id)
+            if exchanges is None:
+                return None
+            self.conversations.move_to_end(conversation_id)
+            entry = exchanges.get(ix_exchange)
+            if entry is None or entry[0] != _prompt_hash(prompt):
+                return None
+            return entry[1], dict(entry[2])
+
+
+    # Cache an exchange's processed prompt and command flags
+    def set(self, conversation_id, ix_exchange, prompt, user_content, flags):
+        with self.cache_lock:
+            exchanges = self.conversations.get(conversation_id)
+            if exchanges is None:
+                exchanges = self.conversations[conversation_id] = {}
+                while len(self.conversations) > self.max_conversations:
+                    self.conversations.popitem(last=False)
+            self.conversations.move_to_end(conversation_id)
+            exchanges[ix_exchange] = (_prompt_hash(prompt), user_content, dict(flags))
+
+
+    # Delete a conversation's cached processed prompts
+    def delete(self, conversation_id):
+        with self.cache_lock:
+            self.conversations.pop(conversation_id, None)
+
+
+# Helper to hash a prompt for the prompt command cache
+def _prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).digest()
+
+
+# The chat response stream class - the streaming response text is buffered and published to the
+# conversation's most recent exchange at intervals, so the conversation lock is not acquired for each
+# chunk. The published response text is journaled at intervals.
+class _ChatStream:
+    __slots__ = (
+        'chat', 'conversation', 'conversation_lock', 'journal_offsets', 'buffer', 'buffer_chunks', 'publish_time', 'journal_time'
+    )
+
+
+    def __init__(self, chat, conversation, conversation_lock):
+        self.chat = chat
+        self.conversation = conversation
+        self.conversation_lock = conversation_lock
+
+        # The journaled text lengths of the current exchange's response fields
+        self.journal_offsets = {}
+
+        # The unpublished streaming response text chunks, by response field
+        self.buffer = {'thinking': [], 'model': []}
+        self.buffer_chunks = 0
+        self.publish_time = None
+        self.journal_time = None
+
+
+    # Start a response stream
+    def start(self):
+        now = time.monotonic()
+        self.publish_time = now + STREAM_PUBLISH_INTERVAL
+        self.journal_time = now + JOURNAL_INTERVAL
+        self.buffer_chunks = 0
+
+
+    # Buffer a response chunk's text and publish the buffered text, at intervals. If blocking is
+    # False and the conversation lock is held, the text remains buffered until the next chunk.
+    def add(self, chunk, blocking=True):
+        # Final chunk? If so, count the chat's model load.
+        if 'load_duration' in chunk:
+            self.chat.app.load_stats.add_chat(chunk['load_duration'])
+
+        # Buffer the response text
+        if 'thinking' in chunk['message']:
+            self.buffer['thinking'].append(chunk['message']['thinking'])
+        else:
+            self.buffer['model'].append(chunk['message']['content'])
+        self.buffer_chunks += 1
+
+        # Publish the buffered response text, at intervals
+        now = time.monotonic()
+        if (self.buffer_chunks >= STREAM_PUBLISH_CHUNKS or now >= self.publish_time) and self.conversation_lock.acquire(blocking):
+            try:
+                self.publish()
+
+                # Journal the response text, at intervals
+                if now >= self.journal_time:
+                    self.journal()
+                    self.journal_time = now + JOURNAL_INTERVAL
+            finally:
+                self.conversation_lock.release()
+            self.publish_time = now + STREAM_PUBLISH_INTERVAL
+            self.buffer_chunks = 0
+
+
+    # Publish and journal the remaining response text
+    def finish(self):
+        with self.conversation_lock:
+            self.publish()
+            self.journal()
+
+
+    # Publish the remaining response text and communicate an error
+    def error(self, exc):
+        with self.conversation_lock:
+            self.publish()
+            if self.chat.stop:
+                return
+            exchange = self.conversation['exchanges'][-1]
+            exchange['model'] += f'\n**ERROR:** {exc}'
+            self.chat.app.config.update_version(self.chat.conversation_id)
+            self.journal()
+
+
+    # Append the buffered response text to the conversation's most recent exchange and update the
+    # conversation's version (must hold the conversation lock). The buffer's text chunk lists are cleared.
+    # Only the most recent exchange is modified - getConversation relies on previous exchanges being
+    # unchanged. A stopped chat's buffered text is discarded - the conversation's exchanges may have
+    # changed since the chat was stopped (stopConversation sets the stop flag holding the lock).
+    def publish(self):
+        if self.chat.stop:
+            for chunks in self.buffer.values():
+                chunks.clear()
+            return
+        exchange = self.conversation['exchanges'][-1]
+        for field, chunks in self.buffer.items():
+            if chunks:
+                exchange[field] = exchange.get(field, '') + ''.join(chunks)
+                chunks.clear()
+                self.chat.app.config.update_version(self.chat.conversation_id)
+
+
+    # Journal the new response text of the conversation's most recent exchange (must hold the
+    # conversation lock). The journal offsets dict tracks the journaled length of each response field.
+    # A stopped chat's conversation is saved by _chat_end, so it is not journaled.
+    def journal(self):
+        if self.chat.app.config.journal is None or self.chat.stop:
+            return
+        ix_exchange = len(self.conversation['exchanges']) - 1
+        exchange = self.conversation['exchanges'][ix_exchange]
+        for field in ('thinking', 'model'):
+            text = exchange.get(field, '')
+            offset = self.journal_offsets.get(field, 0)
+            if len(text) > offset:
+                self.chat.app.config.journal_write({'text': {
+                    'id': self.chat.conversation_id, 'index': ix_exchange, 'field': field, 'offset': offset, 'text': text[offset:]
+                }})
+                self.journal_offsets[field] = len(text)
+
+
+# The asynchronous chat engine class. Chats and model downloads are run as coroutines on a single
+# event loop thread, so concurrent response streams do not each require a thread. The event loop
+# thread is started with the first coroutine.
+class AsyncEngine:
+    __slots__ = ('engine_lock', 'loop')
+
+
+    def __init__(self):
+        self.engine_lock = threading.Lock()
+        self.loop = None
+
+
+    # Run a coroutine on the event loop - returns a concurrent.futures.Future
+    def submit(self, coroutine):
+        with self.engine_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                loop_thread = threading.Thread(target=self.loop.run_forever)
+                loop_thread.daemon = True
+                loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+# The chat scheduler class. Queued chats are run by a pool of at most max_chats worker threads, in
+# priority order and then in queued order. If max_model_chats is provided, at most max_model_chats
+# chats run at once for each model - the first queued chat whose model is under its limit is run
+# next. Worker threads are started as chats are queued, and they exit when no queued chat can run.
+class ChatScheduler:
+    __slots__ = ('max_chats', 'max_model_chats', 'scheduler_lock', 'queue', 'queue_count', 'model_chats', 'workers')
+
+
+    def __init__(self, max_chats, max_model_chats=None):
+        self.max_chats = max_chats
+        self.max_model_chats = max_model_chats
+        self.scheduler_lock = threading.Lock()
+        self.queue = []
+        self.queue_count = 0
+        self.model_chats = {}
+        self.workers = 0
+
+
+    # Queue a chat, and start a worker thread, if necessary
+    def submit(self, chat, model, priority=CHAT_PRIORITY):
+        with self.scheduler_lock:
+            # The queue is sorted by priority and then by queued order
+            bisect.insort(self.queue, (priority, self.queue_count, chat, model))
+            self.queue_count += 1
+
+            # Start a worker thread, if necessary
+            if self.workers < self.max_chats:
+                self.workers += 1
+                worker_thread = threading.Thread(target=self._worker_thread_fn)
+                worker_thread.daemon = True
+                worker_thread.start()
+
+
+    # Remove a queued chat - returns True if the chat was queued
+    def cancel(self, chat):
+        with self.scheduler_lock:
+            for ix_item, item in enumerate(self.queue):
+                if item[2] is chat:
+                    del self.queue[ix_item]
+                    return True
+        return False
+
+
+    # Get a chat's queue position (1 is next), or None if the chat is not queued
+    def queue_position(self, chat):
+        with self.scheduler_lock:
+            for ix_item, item in enumerate(self.queue):
+                if item[2] is chat:
+                    return ix_item + 1
+        return None
+
+
+    # The worker thread function - runs queued chats until no queued chat can run
+    def _worker_thread_fn(self):
+        while True:
+            # Get the next chat whose model is under its limit
+            with self.scheduler_lock:
+                for ix_item, (_, _, chat, model) in enumerate(self.queue):
+                    if self.max_model_chats is None or self.model_chats.get(model, 0) < self.max_model_chats:
+                        del self.queue[ix_item]
+                        self.model_chats[model] = self.model_chats.get(model, 0) + 1
+                        break
+                else:
+                    self.workers -= 1
+                    return
 
-# Helper to find a conversation by ID
-def config_conversation(config, id_):
-    return next((conv for conv in config['conversations'] if conv['id'] == id_), None)
+            # Run the chat
+            try:
+                ChatManager.chat_thread_fn(chat)
+            except:
+                pass
+            with self.scheduler_lock:
+                self.model_chats[model] -= 1
+                if not self.model_chats[model]:
+                    del self.model_chats[model]
 
 
 # Helper to get the template prompts
@@ -269,7 +669,7 @@ def _process_commands_sub(chat, flags, scan, match):
     # Include a URL?
     elif command == 'url':
         # Add URL content
-        url_response = chat.app.pool_manager.request('GET', args.url, retries=0)
+        url_response = chat.app.url_pool_manager.request('GET', args.url, retries=0)
         try:
             if url_response.status != 200:
                 raise urllib3.exceptions.HTTPError(f'Failed to load URL "{args.url}"')
@@ -0,0 +1,50 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+The ollama-chat JSON codec - uses orjson or ujson, if installed, or the json module otherwise
+"""
+
+import datetime
+import json
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError: # pragma: no cover
+    ujson = None
+
+
+# Helper to decode JSON text or UTF-8 bytes
+def json_loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    if ujson is not None:
+        return ujson.loads(text)
+    return json.loads(text)
+
+
+# Helper to encode a value as JSON UTF-8 bytes with sorted keys. If compact is False, the JSON is
+# indented by 2 spaces (the only indent orjson supports). Datetime values are encoded as ISO format
+# strings.
+def json_dumps(value, compact=False):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if compact else orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+    if ujson is not None:
+        return ujson.dumps(
+            value, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False, indent=0 if compact else 2, default=_json_default
+        ).encode('utf-8')
+    if compact:
+        return json.dumps(value, sort_keys=True, separators=(',', ':'), default=_json_default).encode('utf-8')
+    return json.dumps(value, sort_keys=True, indent=2, default=_json_default).encode('utf-8')
+
+
+# Helper to encode the non-JSON values supported by orjson (datetimes) for the ujson and json modules
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -16,13 +16,25 @@ from schema_markdown import encode_query_string
 import urllib3
 import waitress
 
-from .app import OllamaChat
+from .app import MAX_WAITERS, OllamaChat
+from .chat import CHAT_ENGINES
+from .ollama import OLLAMA_POOL_SIZE, URL_POOL_SIZE
+from .storage import STORAGE_NAMES
 
 
 # The default config file name
 CONFIG_FILENAME = 'ollama-chat.json'
 
 
+# The default SQLite config file name
+CONFIG_FILENAME_SQLITE = 'ollama-chat.db'
+
+
+# The web server's request thread count - long-poll and streaming requests each hold a thread, so at
+# most half of the threads wait at once
+WAITRESS_THREADS = 2 * MAX_WAITERS
+
+
 def main(argv=None):
     """
     ollama-chat command-line script main entry point
@@ -43,6 +55,28 @@ def main(argv=None):
                         help='the model name (default is current model)')
     parser.add_argument('-v', nargs=2, action='append', metavar=('VAR', 'VALUE'), dest='template_vars', default = [],
                         help='the template variables')
+    parser.add_argument('-s', metavar='STORAGE', dest='storage', choices=STORAGE_NAMES,
+                        help='the configuration storage - "json", "sharded", or "sqlite" (default is existing or by file extension)')
+    parser.add_argument('-d', metavar='SECONDS', dest='save_delay', type=float, default=1,
+                        help='the configuration save delay - 0 saves immediately (default is 1)')
+    parser.add_argument('-z', dest='compact', action='store_true',
+                        help='save compact (unindented) configuration files')
+    parser.add_argument('-a', metavar='DAYS', dest='archive_days', type=float,
+                        help='archive at startup the conversations not changed within DAYS days (sharded storage only)')
+    parser.add_argument('-g', metavar='N', dest='max_chats', type=int,
+                        help='the maximum number of concurrent chat generations (default is unlimited)')
+    parser.add_argument('-e', metavar='N', dest='max_model_chats', type=int,
+                        help='the maximum number of concurrent chat generations per model, with -g (default is unlimited)')
+    parser.add_argument('-k', metavar='ENGINE', dest='engine', choices=CHAT_ENGINES, default='thread',
+                        help='the chat engine - "thread" or "async" (default is "thread")')
+    parser.add_argument('-o', metavar='N', dest='pool_size', type=int,
+                        help=f'the maximum number of Ollama API connections (default is {OLLAMA_POOL_SIZE})')
+    parser.add_argument('-u', metavar='N', dest='url_pool_size', type=int,
+                        help=f'the maximum number of "/url" prompt command connections per host (default is {URL_POOL_SIZE})')
+    parser.add_argument('-i', dest='refresh_includes', action='store_true',
+                        help="re-read previous prompts' files, directories, images, and URLs on each reply")
+    parser.add_argument('-w', dest='warm', action='store_false', default=True,
+                        help="don't load (warm up) the selected model and the viewed conversations' models")
     parser.add_argument('-p', metavar='N', dest='port', type=int, default=8080,
                         help='the application port (default is 8080)')
     parser.add_argument('-x', dest='xorigin', action='store_true', default=False,
@@ -55,21 +89,34 @@ def main(argv=None):
                         help="don't display access logging")
     args = parser.parse_args(args=argv)
 
+    # The chat scheduler runs chats on its worker threads, so it can't be used with the async chat engine
+    if args.max_chats and args.engine == 'async':
+        parser.error('argument -g: not allowed with argument -k async')
+
+    # The per-model chat limit is enforced by the chat scheduler
+    if args.max_model_chats and not args.max_chats:
+        parser.error('argument -e: requires argument -g')
+
     # Starting a backend server? If so, create the backend application.
     if args.backend:
 
         # Determine the config path
         config_path = args.config
+        config_filename = CONFIG_FILENAME_SQLITE if args.storage == 'sqlite' else CONFIG_FILENAME
         if config_path is None:
-            if os.path.isfile(CONFIG_FILENAME):
-                config_path = CONFIG_FILENAME
+            if os.path.isfile(config_filename):
+                config_path = config_filename
             else:
-                config_path = os.path.join(os.path.expanduser('~'), CONFIG_FILENAME)
+                config_path = os.path.join(os.path.expanduser('~'), config_filename)
         elif config_path.endswith(os.sep) or os.path.isdir(config_path):
-            config_path = os.path.join(config_path, CONFIG_FILENAME)
+            config_path = os.path.join(config_path, config_filename)
 
         # Create the backend application
-        application = OllamaChat(config_path, args.xorigin)
+        application = OllamaChat(
+            config_path, args.xorigin, args.storage, args.save_delay, journal=True, compact=args.compact, archive_days=args.archive_days,
+            max_chats=args.max_chats, max_model_chats=args.max_model_chats, engine=args.engine,
+            refresh_includes=args.refresh_includes, pool_size=args.pool_size, url_pool_size=args.url_pool_size, warm=args.warm
+        )
 
     # Construct the URL
     host = '127.0.0.1'
@@ -154,7 +201,11 @@ def main(argv=None):
         # Start the backend application
         if not args.quiet:
             print(f'ollama-chat: Serving at {url} ...')
-        waitress.serve(application_wrap, port=args.port)
+        try:
+            waitress.serve(application_wrap, port=args.port, threads=WAITRESS_THREADS)
+        finally:
+            # Save any deferred configuration changes
+            application.config.flush()
 
     # Not starting a backend service, so we must wait on the web browser start
     elif args.browser:
@@ -1,120 +1,791 @@
 # Licensed under the MIT License
 # https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
 
-import codecs
+import asyncio
+import contextlib
 import datetime
+import functools
 import json
 import os
+import threading
+import time
+import urllib.parse
 
 import urllib3
 
+from .codec import json_loads
 
-# Helper function to get an Ollama API URL
-def _get_ollama_url(path):
-    ollama_host = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
-    return f'{ollama_host}{path}'
+
+# The default model capabilities cache time-to-live, in seconds
+MODEL_CACHE_TTL = 600
+
+
+# The Ollama model capabilities cache class. Each model's capabilities (from /api/show) are cached for
+# ttl seconds, keyed by model name and digest. The model digests are updated from the local model list
+# (see update_digests) - a cached model whose digest changed, or that is no longer listed, is
+# invalidated.
+class ModelCache:
+    __slots__ = ('ttl', 'cache_lock', 'capabilities', 'digests')
+
+
+    def __init__(self, ttl=MODEL_CACHE_TTL):
+        self.ttl = ttl
+        self.cache_lock = threading.Lock()
+        self.capabilities = {}
+        self.digests = {}
+
+
+    # Get a model's cached capabilities - returns None if the model is not cached, or if its cache
+    # entry has expired or its digest has changed
+    def get(self, model):
+        model_key = _model_key(model)
+        with self.cache_lock:
+            entry = self.capabilities.get(model_key)
+            if entry is None:
+                return None
+            digest, capabilities, expire_time = entry
+            if digest != self.digests.get(model_key) or time.monotonic() >= expire_time:
+                del self.capabilities[model_key]
+                return None
+            return capabilities
+
+
+    # Cache a model's capabilities
+    def set(self, model, capabilities):
+        model_key = _model_key(model)
+        with self.cache_lock:
+            self.capabilities[model_key] = (self.digests.get(model_key), capabilities, time.monotonic() + self.ttl)
+
+
+    # Invalidate a model's cached capabilities (e.g., the model was downloaded or deleted)
+    def invalidate(self, model):
+        model_key = _model_key(model)
+        with self.cache_lock:
+            self.capabilities.pop(model_key, None)
+            self.digests.pop(model_key, None)
+
+
+    # Update the model digests from the local model list (see ollama_list)
+    def update_digests(self, models):
+        with self.cache_lock:
+            self.digests = {_model_key(model['model']): model['digest'] for model in models}
+            for model_key, (digest, _, _) in list(self.capabilities.items()):
+                if model_key not in self.digests or digest != self.digests[model_key]:
+                    del self.capabilities[model_key]
+
+
+# Helper to get a model's cache key - an untagged model name is the "latest" tag
+def _model_key(model):
+    return model if ':' in model else f'{model}:latest'
+
+
+# Get a model's keep-alive duration (e.g., "30m") from a dict of keep-alive durations by model ID (see
+# the config's "keepAlive") - returns None if the model has no keep-alive duration
+def model_keep_alive(keep_alives, model):
+    if keep_alives:
+        model_key = _model_key(model)
+        for keep_alive_model, keep_alive in keep_alives.items():
+            if _model_key(keep_alive_model) == model_key:
+                return keep_alive
+    return None
+
+
+# The minimum model load time, in seconds, of a cold-start chat
+COLD_START_SECONDS = 1
+
+
+# The model load statistics class - counts the chats and the chats that waited for their model to load
+# (cold starts)
+class LoadStats:
+    __slots__ = ('stats_lock', 'chats', 'cold_starts', 'load_seconds')
+
+
+    def __init__(self):
+        self.stats_lock = threading.Lock()
+        self.chats = 0
+        self.cold_starts = 0
+        self.load_seconds = 0
+
+
+    # Count a chat from its final response chunk's model load duration, in nanoseconds
+    def add_chat(self, load_duration):
+        load_seconds = load_duration / 1e9
+        with self.stats_lock:
+            self.chats += 1
+            if load_seconds >= COLD_START_SECONDS:
+                self.cold_starts += 1
+                self.load_seconds += load_seconds
+
+
+    # Get the statistics (see the OllamaChatLoadStats struct)
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'chats': self.chats,
+                'coldStarts': self.cold_starts,
+                'loadSeconds': round(self.load_seconds, 3)
+            }
+
+
+# The default maximum number of connections kept per host by the Ollama API connection pool
+OLLAMA_POOL_SIZE = 32
+
+
+# The default maximum number of connections kept per host by the URL fetch connection pool
+URL_POOL_SIZE = 4
+
+
+# The Ollama API connect timeout, in seconds
+OLLAMA_CONNECT_TIMEOUT = 10
+
+
+# The Ollama API read timeout, in seconds - the time to wait for response data (e.g., a cold-start chat's
+# model load)
+OLLAMA_READ_TIMEOUT = 600
+
+
+# The connection pool timeout, in seconds - the time a request waits for a free connection
+OLLAMA_POOL_TIMEOUT = 60
+
+
+# The connection pool statistics class - counts a pool manager's requests and new connections. The
+# requests beyond the new connections reused a kept-alive connection.
+class PoolStats:
+    __slots__ = ('maxsize', 'stats_lock', 'requests', 'connections')
+
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+
+    # Count a request
+    def add_request(self):
+        with self.stats_lock:
+            self.requests += 1
+
+
+    # Count a new connection
+    def add_connection(self):
+        with self.stats_lock:
+            self.connections += 1
+
+
+    # Get the statistics (see the OllamaChatPoolStats struct)
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'maxsize': self.maxsize,
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': max(self.requests - self.connections, 0)
+            }
+
+
+# Create a connection pool manager that counts its requests and new connections. Each host's pool
+# keeps up to the pool stats' maxsize connections, and a request waits for a free connection
+# (back-pressure) rather than opening a connection that's discarded after use. A request that waits
+# longer than the pool timeout fails with an EmptyPoolError.
+def create_pool_manager(pool_stats, num_pools=10):
+    pool_manager = urllib3.PoolManager(
+        num_pools=num_pools,
+        maxsize=pool_stats.maxsize,
+        block=True,
+        timeout=urllib3.Timeout(connect=OLLAMA_CONNECT_TIMEOUT, read=OLLAMA_READ_TIMEOUT)
+    )
+    pool_manager.pool_classes_by_scheme = {
+        'http': functools.partial(_StatsHTTPConnectionPool, pool_stats=pool_stats, wait_timeout=OLLAMA_POOL_TIMEOUT),
+        'https': functools.partial(_StatsHTTPSConnectionPool, pool_stats=pool_stats, wait_timeout=OLLAMA_POOL_TIMEOUT)
+    }
+    return pool_manager
+
+
+# Connection pool mixin class that counts the pool's requests and new connections, and waits at most
+# the wait timeout for a free connection (see create_pool_manager). The counts override urllib3 private
+# methods, so the urllib3 dependency is pinned to its major version.
+class _StatsConnectionPoolMixin:
+
+    def __init__(self, *args, pool_stats, wait_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_stats = pool_stats
+        self.wait_timeout = wait_timeout
+
+
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        return super().urlopen(*args, pool_timeout=self.wait_timeout if pool_timeout is None else pool_timeout, **kwargs)
+
+
+    def _new_conn(self):
+        self.pool_stats.add_connection()
+        return super()._new_conn()
+
+
+    def _make_request(self, *args, **kwargs):
+        self.pool_stats.add_request()
+        return super()._make_request(*args, **kwargs)
+
+
+class _StatsHTTPConnectionPool(_StatsConnectionPoolMixin, urllib3.HTTPConnectionPool):
+    pass
+
+
+class _StatsHTTPSConnectionPool(_StatsConnectionPoolMixin, urllib3.HTTPSConnectionPool):
+    pass
+
+
+# Helper function to get the default Ollama host URL
+def _get_ollama_host():
+    return _normalize_host(os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434"))
+
+
+# Helper to normalize an Ollama host URL - a host without a scheme (e.g., "127.0.0.1:11434") is HTTP
+def _normalize_host(host):
+    if '://' not in host:
+        host = f'http://{host}'
+    return host.rstrip('/')
+
+
+# The interval, in seconds, before an unreachable Ollama backend is tried again
+BACKEND_RETRY_INTERVAL = 30
+
+
+# The loaded models (/api/ps) time-to-live, in seconds
+BACKEND_LOADED_TTL = 10
+
+
+# The loaded models (/api/ps) request timeout, in seconds
+BACKEND_LOADED_TIMEOUT = 2
+
+
+# The Ollama backends class - routes requests among one or more Ollama servers. A chat is sent to a
+# reachable backend that has its model loaded (see refresh_loaded), and otherwise to the reachable backend
+# with the fewest outstanding requests. A backend that fails to connect is marked down and skipped until
+# the retry interval passes. If no hosts are provided, the only backend is the OLLAMA_HOST environment
+# variable's host.
+class OllamaBackends:
+    __slots__ = ('backend_hosts', 'backends_lock', 'outstanding', 'down_until', 'loaded', 'loaded_time')
+
+
+    def __init__(self, hosts=None):
+        self.backend_hosts = [_normalize_host(host) for host in hosts] if hosts else None
+        self.backends_lock = threading.Lock()
+        self.outstanding = {}
+        self.down_until = {}
+        self.loaded = {}
+        self.loaded_time = None
+
+
+    # The backend hosts
+    @property
+    def hosts(self):
+        return self.backend_hosts or [_get_ollama_host()]
+
+
+    # Get the backend hosts in the order to try them for a model's request - the down backends are last
+    def route(self, model=None):
+        hosts = self.hosts
+        if len(hosts) == 1:
+            return hosts
+        now = time.monotonic()
+        with self.backends_lock:
+            return sorted(hosts, key=lambda host: (
+                self.down_until.get(host, 0) > now,
+                model is None or model not in self.loaded.get(host, ()),
+                self.outstanding.get(host, 0)
+            ))
+
+
+    # Get the backend hosts that are not down - all hosts if every backend is down
+    def reachable(self):
+        hosts = self.hosts
+        if len(hosts) == 1:
+            return hosts
+        now = time.monotonic()
+        with self.backends_lock:
+            reachable_hosts = [host for host in hosts if self.down_until.get(host, 0) <= now]
+        return reachable_hosts or hosts
+
+
+    # Mark a backend down (it failed to connect)
+    def mark_down(self, host):
+        with self.backends_lock:
+            self.down_until[host] = time.monotonic() + BACKEND_RETRY_INTERVAL
+
+
+    # Mark a backend up (it responded)
+    def mark_up(self, host):
+        with self.backends_lock:
+            self.down_until.pop(host, None)
+
+
+    # Context manager to count a backend's outstanding request
+    @contextlib.contextmanager
+    def request(self, host):
+        with self.backends_lock:
+            self.outstanding[host] = self.outstanding.get(host, 0) + 1
+        try:
+            yield host
+        finally:
+            with self.backends_lock:
+                self.outstanding[host] -= 1
+
+
+    # Update the backends' loaded models from the Ollama process status API (/api/ps), if there are
+    # multiple backends and the loaded models have expired. This is also the backends' health check - a
+    # backend that fails to connect is marked down, and a down backend that responds is marked up. The
+    # down backends are skipped until their retry interval passes, and each request uses a short timeout,
+    # so an unreachable backend doesn't delay the chat.
+    def refresh_loaded(self, pool_manager):
+        if len(self.hosts) == 1:
+            return
+        now = time.monotonic()
+        with self.backends_lock:
+            if self.loaded_time is not None and now < self.loaded_time + BACKEND_LOADED_TTL:
+                return
+            self.loaded_time = now
+        loaded = {}
+        for host in self.reachable():
+            try:
+                response_ps = pool_manager.request('GET', f'{host}/api/ps', retries=0, timeout=BACKEND_LOADED_TIMEOUT)
+            except BACKEND_ERRORS:
+                self.mark_down(host)
+                continue
+            try:
+                if response_ps.status == 200:
+                    loaded[host] = {_model_key(model['model']) for model in response_ps.json().get('models', [])}
+                    self.mark_up(host)
+            finally:
+                response_ps.close()
+        with self.backends_lock:
+            self.loaded = loaded
+
+
+    # Get the backend statistics (see the OllamaChatBackendStats struct)
+    def stats(self):
+        now = time.monotonic()
+        with self.backends_lock:
+            return [
+                {
+                    'host': host,
+                    'outstanding': self.outstanding.get(host, 0),
+                    'down': self.down_until.get(host, 0) > now,
+                    'loaded': sorted(self.loaded.get(host, ()))
+                }
+                for host in self.hosts
+            ]
+
+
+# The backend connection errors that fail over to the next backend
+BACKEND_ERRORS = (urllib3.exceptions.MaxRetryError, urllib3.exceptions.NewConnectionError, urllib3.exceptions.ProtocolError)
+
+
+# Helper to make a backend request, failing over to the next host if a backend is unreachable - returns
+# the host and the response
+def _backend_request(pool_manager, backends, hosts, method, path, **kwargs):
+    for ix_host, host in enumerate(hosts): # pragma: no branch
+        try:
+            response = pool_manager.request(method, f'{host}{path}', retries=0, **kwargs)
+        except BACKEND_ERRORS:
+            backends.mark_down(host)
+            if ix_host == len(hosts) - 1:
+                raise
+            continue
+        backends.mark_up(host)
+        return host, response
+
+
+# Helper to close a streamed (preload_content=False) response - the response's connection is not
+# returned to the pool until it is released, and a blocking pool waits forever for an unreleased
+# connection, so release it on every path (e.g. an error status or a stopped chat)
+def _close_streamed(response):
+    response.close()
+    response.release_conn()
 
 
 # Decode a streamed, newline-delimited JSON (NDJSON) response into individual JSON objects. The
 # Ollama API streams one JSON object per line, but HTTP chunk boundaries do not align with those
 # lines - a single chunk may carry multiple objects (common with cloud models) or a partial object
-# split across chunks. Buffer the decoded text and yield each complete JSON object as it arrives.
+# split across chunks. Buffer the data and yield each complete JSON object as it arrives.
 def _iter_ndjson(response):
-    decoder = json.JSONDecoder()
-    text_decoder = codecs.getincrementaldecoder('utf-8')()
-    buffer = ''
+    decoder = _NDJSONDecoder()
     for data in response.read_chunked():
-        buffer += text_decoder.decode(data)
-        while True:
-            buffer = buffer.lstrip()
-            if not buffer:
-                break
-            try:
-                chunk, index = decoder.raw_decode(buffer)
-            except json.JSONDecodeError:
-                # Incomplete object - wait for the next chunk to complete it
-                break
-            buffer = buffer[index:]
+        yield from decoder.decode(data)
+    yield from decoder.close()
+
+
+# Decode a streamed NDJSON asynchronous response into individual JSON objects (see _iter_ndjson)
+async def _iter_ndjson_async(response):
+    decoder = _NDJSONDecoder()
+    async for data in response.read_chunked():
+        for chunk in decoder.decode(data):
             yield chunk
+    for chunk in decoder.close():
+        yield chunk
 
-    # The stream ended mid-object - the response was truncated or malformed
-    if buffer.strip():
-        raise urllib3.exceptions.HTTPError(f'Invalid streamed response: {buffer.strip()!r}')
 
+# The NDJSON decoder class - data chunks are buffered as bytes, and each complete line is parsed once.
+# Only the new data is scanned for line ends, and the parsed lines are removed from the buffer once per
+# chunk, so the decoding cost is linear in the stream size regardless of the chunk boundaries.
+class _NDJSONDecoder:
+    __slots__ = ('buffer', 'scan_index')
 
-# Call the Ollama chat API and yield each streamed JSON response chunk
-def ollama_chat(pool_manager, model, messages):
-    # Is this a thinking model?
-    url_show = _get_ollama_url('/api/show')
-    data_show = {'model': model}
-    response_show = pool_manager.request('POST', url_show, json=data_show, retries=0)
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scan_index = 0
+
+
+    # Buffer a data chunk - returns the list of the complete lines' JSON objects
+    def decode(self, data):
+        buffer = self.buffer
+        buffer += data
+        chunks = []
+        line_start = 0
+        line_end = buffer.find(b'\n', self.scan_index)
+        if line_end != -1:
+            with memoryview(buffer) as view:
+                while line_end != -1:
+                    chunks.extend(_parse_ndjson_line(view[line_start:line_end].tobytes()))
+                    line_start = line_end + 1
+                    line_end = buffer.find(b'\n', line_start)
+            del buffer[:line_start]
+        self.scan_index = len(buffer)
+        return chunks
+
+
+    # End the stream - returns the list of the final (unterminated) line's JSON object, if any
+    def close(self):
+        line = bytes(self.buffer)
+        self.buffer.clear()
+        self.scan_index = 0
+        return _parse_ndjson_line(line)
+
+
+# Helper to parse an NDJSON line - returns a list of the line's JSON object, or an empty list for a blank
+# line. Raises an error if the line is not a JSON object (the response was truncated or malformed).
+def _parse_ndjson_line(line):
+    line = line.strip()
+    if not line:
+        return []
     try:
-        if response_show.status != 200:
-            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_show.status})')
-        model_show = response_show.json()
-    finally:
-        response_show.close()
-    is_thinking = 'capabilities' in model_show and 'thinking' in model_show['capabilities']
+        return [json_loads(line)]
+    except ValueError:
+        raise urllib3.exceptions.HTTPError(f'Invalid streamed response: {line.decode("utf-8", "replace")!r}') from None
+
+
+# Call the Ollama chat API and yield each streamed JSON response chunk. If a model cache is provided,
+# the model's capabilities are cached. If backends are provided, the chat is routed among them. If a
+# keep-alive duration is provided, the model stays loaded for that long after the chat.
+def ollama_chat(pool_manager, model, messages, model_cache=None, backends=None, keep_alive=None):
+    if backends is None:
+        backends = OllamaBackends()
+    backends.refresh_loaded(pool_manager)
+    hosts = backends.route(_model_key(model))
+
+    # Is this a thinking model?
+    capabilities = model_cache.get(model) if model_cache is not None else None
+    if capabilities is None:
+        data_show = {'model': model}
+        host, response_show = _backend_request(pool_manager, backends, hosts, 'POST', '/api/show', json=data_show)
+        hosts = [host, *(other_host for other_host in hosts if other_host != host)]
+        try:
+            if response_show.status != 200:
+                raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_show.status})')
+            capabilities = response_show.json().get('capabilities', [])
+        finally:
+            response_show.close()
+        if model_cache is not None:
+            model_cache.set(model, capabilities)
+    is_thinking = 'thinking' in capabilities
 
     # Start a streaming chat request
-    url_chat = _get_ollama_url('/api/chat')
     data_chat = {'model': model, 'messages': messages, 'stream': True, 'think': is_thinking}
-    response_chat = pool_manager.request('POST', url_chat, json=data_chat, preload_content=False, retries=0)
+    if keep_alive is not None:
+        data_chat['keep_alive'] = keep_alive
+    host, response_chat = _backend_request(pool_manager, backends, hosts, 'POST', '/api/chat', json=data_chat, preload_content=False)
     try:
-        if response_chat.status != 200:
-            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_chat.status})')
+        with backends.request(host):
+            if response_chat.status != 200:
+                raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_chat.status})')
 
-        # Respond with each streamed JSON chunk
-        for chunk in _iter_ndjson(response_chat):
-            if 'error' in chunk:
-                raise urllib3.exceptions.HTTPError(chunk['error'])
-            yield chunk
+            # Respond with each streamed JSON chunk
+            for chunk in _iter_ndjson(response_chat):
+                if 'error' in chunk:
+                    raise urllib3.exceptions.HTTPError(chunk['error'])
+                yield chunk
     finally:
-        response_chat.close()
+        _close_streamed(response_chat)
 
 
-# List the locally available Ollama models
-def ollama_list(pool_manager):
-    url_list = _get_ollama_url('/api/tags')
-    response_list = pool_manager.request('GET', url_list, retries=0)
-    try:
-        if response_list.status != 200:
-            raise urllib3.exceptions.HTTPError(f'Unexpected error ({response_list.status})')
-        return [
-            {
+# List the locally available Ollama models. If backends are provided, the reachable backends' models are
+# merged.
+def ollama_list(pool_manager, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
+    models = {}
+    for response_list in _reachable_json(pool_manager, backends, '/api/tags'):
+        for model in response_list['models']:
+            models.setdefault(model['model'], {
                 'model': model['model'],
+                'digest': model.get('digest'),
                 'details': model['details'],
                 'size': model['size'],
                 'modified_at': datetime.datetime.fromisoformat(model['modified_at'])
-            }
-            for model in response_list.json()['models']
-        ]
-    finally:
-        response_list.close()
+            })
+    return list(models.values())
 
 
-# Delete a locally available Ollama model
-def ollama_delete(pool_manager, model):
-    url_delete = _get_ollama_url('/api/delete')
-    data_delete = {'model': model}
-    response_delete = pool_manager.request('DELETE', url_delete, json=data_delete, retries=0)
+# List the Ollama models loaded in memory, with the time each is unloaded. If backends are provided, the
+# reachable backends' loaded models are merged.
+def ollama_ps(pool_manager, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
+    models = {}
+    for response_ps in _reachable_json(pool_manager, backends, '/api/ps'):
+        for model in response_ps['models']:
+            expires_at = datetime.datetime.fromisoformat(model['expires_at'])
+            if model['model'] not in models or expires_at > models[model['model']]['expires_at']:
+                models[model['model']] = {'model': model['model'], 'expires_at': expires_at}
+    return list(models.values())
+
+
+# Helper to get an Ollama API JSON response from each reachable backend - a backend that fails to
+# connect is skipped, unless no backend responds
+def _reachable_json(pool_manager, backends, path):
+    hosts = backends.reachable()
+    responses = []
+    for ix_host, host in enumerate(hosts):
+        try:
+            _, response = _backend_request(pool_manager, backends, [host], 'GET', path)
+        except BACKEND_ERRORS:
+            if ix_host == len(hosts) - 1 and not responses:
+                raise
+            continue
+        try:
+            if response.status != 200:
+                raise urllib3.exceptions.HTTPError(f'Unexpected error ({response.status})')
+            responses.append(response.json())
+        finally:
+            response.close()
+    return responses
+
+
+# Load an Ollama model into memory (a chat request without messages), so the model's next chat does not
+# wait for the model to load. If a keep-alive duration is provided, the model stays loaded for that long.
+def ollama_load(pool_manager, model, keep_alive=None, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
+    data_load = {'model': model, 'messages': [], 'stream': False}
+    if keep_alive is not None:
+        data_load['keep_alive'] = keep_alive
+    _, response_load = _backend_request(pool_manager, backends, backends.route(_model_key(model)), 'POST', '/api/chat', json=data_load)
     try:
-        if response_delete.status != 200:
-            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_delete.status})')
+        if response_load.status != 200:
+            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_load.status})')
     finally:
-        response_delete.close()
+        response_load.close()
+
+
+# Delete a locally available Ollama model. If backends are provided, the model is deleted from each
+# reachable backend that has it - a backend that fails to connect is skipped.
+def ollama_delete(pool_manager, model, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
+    data_delete = {'model': model}
+    hosts = backends.reachable()
+    deleted = False
+    status = None
+    for ix_host, host in enumerate(hosts):
+        try:
+            _, response_delete = _backend_request(pool_manager, backends, [host], 'DELETE', '/api/delete', json=data_delete)
+        except BACKEND_ERRORS:
+            if ix_host == len(hosts) - 1 and status is None:
+                raise
+            continue
+        try:
+            status = response_delete.status
+            if status == 200:
+                deleted = True
+            elif status != 404:
+                break
+        finally:
+            response_delete.close()
+    if not deleted or status not in (200, 404):
+        raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({status})')
 
 
-# Pull an Ollama model, yielding each streamed JSON progress chunk
-def ollama_pull(pool_manager, model):
-    url_pull = _get_ollama_url('/api/pull')
+# Pull an Ollama model, yielding each streamed JSON progress chunk. If backends are provided, the model
+# is pulled to each reachable backend, in turn - a backend that fails to connect is skipped.
+def ollama_pull(pool_manager, model, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
     data_pull = {'model': model, 'stream': True}
-    response_pull = pool_manager.request('POST', url_pull, json=data_pull, preload_content=False, retries=0)
-    try:
-        if response_pull.status != 200:
-            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_pull.status})')
+    hosts = backends.reachable()
+    pulled = False
+    for ix_host, host in enumerate(hosts):
+        try:
+            _, response_pull = _backend_request(pool_manager, backends, [host], 'POST', '/api/pull', json=data_pull, preload_content=False)
+        except BACKEND_ERRORS:
+            if ix_host == len(hosts) - 1 and not pulled:
+                raise
+            continue
+        pulled = True
+        try:
+            if response_pull.status != 200:
+                raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_pull.status})')
+
+            # Respond with each streamed JSON chunk
+            yield from _iter_ndjson(response_pull)
+        finally:
+            _close_streamed(response_pull)
+
+
+# Call the Ollama chat API asynchronously and yield each streamed JSON response chunk (see ollama_chat)
+async def ollama_chat_async(model, messages, model_cache=None, backends=None, keep_alive=None):
+    if backends is None:
+        backends = OllamaBackends()
+    hosts = backends.route(_model_key(model))
+
+    # Is this a thinking model?
+    capabilities = model_cache.get(model) if model_cache is not None else None
+    if capabilities is None:
+        data_show = {'model': model}
+        async with _ollama_request_async(backends, hosts, 'POST', '/api/show', data_show) as response_show:
+            if response_show.status != 200:
+                raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_show.status})')
+            capabilities = (await response_show.json()).get('capabilities', [])
+        if model_cache is not None:
+            model_cache.set(model, capabilities)
+    is_thinking = 'thinking' in capabilities
+
+    # Start a streaming chat request
+    data_chat = {'model': model, 'messages': messages, 'stream': True, 'think': is_thinking}
+    if keep_alive is not None:
+        data_chat['keep_alive'] = keep_alive
+    async with _ollama_request_async(backends, hosts, 'POST', '/api/chat', data_chat) as response_chat:
+        if response_chat.status != 200:
+            raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_chat.status})')
 
         # Respond with each streamed JSON chunk
-        yield from _iter_ndjson(response_pull)
+        async for chunk in _iter_ndjson_async(response_chat):
+            if 'error' in chunk:
+                raise urllib3.exceptions.HTTPError(chunk['error'])
+            yield chunk
+
+
+# Pull an Ollama model asynchronously, yielding each streamed JSON progress chunk (see ollama_pull)
+async def ollama_pull_async(model, backends=None):
+    if backends is None:
+        backends = OllamaBackends()
+    data_pull = {'model': model, 'stream': True}
+    hosts = backends.reachable()
+    pulled = False
+    for ix_host, host in enumerate(hosts):
+        connected = False
+        try:
+            async with _ollama_request_async(backends, [host], 'POST', '/api/pull', data_pull) as response_pull:
+                connected = pulled = True
+                if response_pull.status != 200:
+                    raise urllib3.exceptions.HTTPError(f'Unknown model "{model}" ({response_pull.status})')
+
+                # Respond with each streamed JSON chunk
+                async for chunk in _iter_ndjson_async(response_pull):
+                    yield chunk
+        except OSError:
+            if connected or (ix_host == len(hosts) - 1 and not pulled):
+                raise
+
+
+# Helper context manager to make an asynchronous Ollama API JSON request - yields the response. The
+# request is made to the first backend host that connects. Each request uses its own HTTP/1.1
+# connection, which is closed on context exit.
+@contextlib.asynccontextmanager
+async def _ollama_request_async(backends, hosts, method, path, data):
+    host, url, reader, writer = await _open_connection_async(backends, hosts, path)
+    try:
+        # Send the request
+        body = json.dumps(data).encode('utf-8')
+        writer.write(
+            f'{method} {url.path} HTTP/1.1\r\nHost: {url.netloc}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('utf-8') + body
+        )
+        await writer.drain()
+
+        # Read the response status and headers
+        status_line = (await _read_async(reader.readline())).split()
+        if len(status_line) < 2 or not status_line[0].startswith(b'HTTP/') or not status_line[1].isdigit():
+            raise urllib3.exceptions.HTTPError('Invalid response')
+        headers = {}
+        while (header_line := await _read_async(reader.readline())).strip():
+            name, _, value = header_line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        with backends.request(host):
+            yield AsyncResponse(int(status_line[1]), headers, reader)
     finally:
-        response_pull.close()
+        writer.close()
+
+
+# Helper to open an asynchronous backend connection, failing over to the next host if a backend is
+# unreachable - returns the host, the request URL, and the connection's reader and writer
+async def _open_connection_async(backends, hosts, path):
+    for ix_host, host in enumerate(hosts): # pragma: no branch
+        url = urllib.parse.urlsplit(f'{host}{path}')
+        is_https = url.scheme == 'https'
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(url.hostname, url.port or (443 if is_https else 80), ssl=is_https or None),
+                OLLAMA_CONNECT_TIMEOUT
+            )
+        except OSError:
+            backends.mark_down(host)
+            if ix_host == len(hosts) - 1:
+                raise
+            continue
+        backends.mark_up(host)
+        return host, url, reader, writer
+
+
+# Helper to await an asynchronous connection read, raising TimeoutError if no data arrives within the
+# read timeout
+async def _read_async(read_coroutine):
+    return await asyncio.wait_for(read_coroutine, OLLAMA_READ_TIMEOUT)
+
+
+# The asynchronous Ollama API response class
+class AsyncResponse:
+    __slots__ = ('status', 'headers', 'reader')
+
+
+    def __init__(self, status, headers, reader):
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+
+
+    # Yield the response body data as it arrives
+    async def read_chunked(self):
+        # Chunked transfer encoding?
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await _read_async(self.reader.readline())).split(b';')[0], 16)
+                if size == 0:
+                    break
+                yield await _read_async(self.reader.readexactly(size))
+                await _read_async(self.reader.readline())
+
+        # Content length?
+        elif 'content-length' in self.headers:
+            yield await _read_async(self.reader.readexactly(int(self.headers['content-length'])))
+
+        # Otherwise, read until the connection is closed
+        else:
+            while data := await _read_async(self.reader.read(65536)):
+                yield data
+
+
+    # Read the response body JSON
+    async def json(self):
+        return json.loads(b''.join([data async for data in self.read_chunked()]))
@@ -0,0 +1,698 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+"""
+The ollama-chat config storage backends
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import schema_markdown
+
+from .codec import json_dumps, json_loads
+
+
+# The config storage names
+STORAGE_NAMES = ('json', 'sharded', 'sqlite')
+
+
+# The SQLite config file extensions
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+# Helper to create a config storage backend by name - if no name is provided, the storage is
+# determined by the existing config file (see _config_storage) or by the config file extension. A
+# single-file JSON config is migrated to sharded or SQLite storage - other storage changes are
+# errors. If compact is True, JSON files are written without indentation. If archive_days is
+# provided, sharded storage archives the conversations not changed within that many days.
+def create_storage(config_path, types, storage=None, compact=False, archive_days=None):
+    config_storage = _config_storage(config_path)
+    if storage is None:
+        storage = config_storage or ('sqlite' if os.path.splitext(config_path)[1].lower() in SQLITE_EXTENSIONS else 'json')
+    elif config_storage not in (None, 'json', storage):
+        raise ValueError(f'Configuration file "{config_path}" uses {config_storage} storage, not {storage} storage')
+    if storage == 'sharded':
+        return ShardedStorage(config_path, types, compact, archive_days)
+    elif storage == 'sqlite':
+        return SQLiteStorage(config_path, types)
+    return JSONStorage(config_path, types, compact)
+
+
+# The single-file JSON config storage class
+class JSONStorage:
+    __slots__ = ('config_path', 'types', 'compact', 'unvalidated_ids')
+
+
+    def __init__(self, config_path, types, compact=False):
+        self.config_path = config_path
+        self.types = types
+        self.compact = compact
+        self.unvalidated_ids = set()
+
+
+    # Load the config - returns None if the config file does not exist. The config is validated
+    # unless it was written by ollama-chat (see _read_json). Conversation exchanges are not
+    # validated until the conversation is accessed (see validate_exchanges).
+    def load(self):
+        if not os.path.isfile(self.config_path):
+            return None
+        config, trusted = _read_json(self.config_path)
+        if trusted:
+            # A trusted index is valid, but it's not a single-file config
+            if _is_index_config(config):
+                raise ValueError(f'Configuration file "{self.config_path}" is a sharded storage index')
+            self.unvalidated_ids = set()
+            return config
+        config, self.unvalidated_ids = _validate_config_infos(self.types, config)
+        return config
+
+
+    # Validate a conversation's exchanges, if not yet validated
+    def validate_exchanges(self, conversation):
+        if conversation['id'] in self.unvalidated_ids:
+            conversation['exchanges'] = schema_markdown.validate_type(self.types, 'Conversation', conversation)['exchanges']
+            self.unvalidated_ids.discard(conversation['id'])
+
+
+    # Save the config - the entire config is always written. The checksum file is written only if
+    # all conversations are validated, so unvalidated conversations are validated after reload.
+    def save(self, config, unused_conversation_ids, unused_template_ids):
+        if self.unvalidated_ids:
+            self.unvalidated_ids.intersection_update(conversation['id'] for conversation in config['conversations'])
+        _write_json(self.config_path, config, self.compact, checksum=not self.unvalidated_ids)
+
+
+# The sharded config storage class. The config file is an index of conversation and template
+# infos. Each conversation and template is stored in its own file in the shard directory, so saves
+# write only the shards that changed. Conversation shards are not loaded until the conversation is
+# accessed (see load_exchanges). A shard is validated only if its content hash is not that of the
+# shard last read or written.
+#
+# If archive_days is provided, the conversation shards not changed within that many days are
+# gzip-compressed and moved to the archive directory on load (at startup). Archived conversations are
+# decompressed when accessed and are moved back to the conversations directory when changed. Each
+# archive's bytes saved is recorded when it's archived or loaded, so the archive metrics read no files.
+#
+# A single-file config is migrated to sharded storage on load. The single-file config is kept as a
+# backup file (e.g. "ollama-chat.json.bak").
+class ShardedStorage:
+    __slots__ = (
+        'config_path', 'types', 'compact', 'archive_days', 'shard_dir', 'index', 'conversation_ids', 'template_ids', 'shard_hashes',
+        'archived_ids', 'archive_savings', 'archive_bytes_saved', 'rehydration_lock', 'rehydrations', 'rehydration_seconds',
+        'rehydration_max_seconds'
+    )
+
+
+    def __init__(self, config_path, types, compact=False, archive_days=None):
+        self.config_path = config_path
+        self.types = types
+        self.compact = compact
+        self.archive_days = archive_days
+        self.shard_dir = f'{os.path.splitext(config_path)[0]}.d'
+        self.index = None
+        self.conversation_ids = set()
+        self.template_ids = set()
+        self.shard_hashes = {}
+        self.archived_ids = set()
+        self.archive_savings = {}
+        self.archive_bytes_saved = 0
+        self.rehydration_lock = threading.Lock()
+        self.rehydrations = 0
+        self.rehydration_seconds = 0
+        self.rehydration_max_seconds = 0
+
+
+    # Load the config - returns None if the index file does not exist
+    def load(self):
+        if not os.path.isfile(self.config_path):
+            return None
+        index, trusted = _read_json(self.config_path)
+
+        # Single-file config? If so, migrate it to shards.
+        if _is_single_file_config(index):
+            config = index if trusted else schema_markdown.validate_type(self.types, 'OllamaChatConfig', index)
+            if not config.get('noSave'):
+                shutil.copyfile(self.config_path, f'{self.config_path}.bak')
+                self.save(config, (), ())
+            return config
+
+        # Load the template shards - the loaded conversations do not have exchanges
+        if not trusted:
+            index = schema_markdown.validate_type(self.types, 'OllamaChatIndex', index)
+        config = {key: value for key, value in index.items() if key not in ('conversations', 'templates')}
+        config['conversations'] = [dict(conversation_info) for conversation_info in index['conversations']]
+        if 'templates' in index:
+            config['templates'] = [
+                self._read_shard('templates', template_info['id'], 'ConversationTemplate')
+                for template_info in index['templates']
+            ]
+        self.index = index
+        self.conversation_ids = set(conversation_info['id'] for conversation_info in index['conversations'])
+        self.template_ids = set(template_info['id'] for template_info in index.get('templates', ()))
+
+        # Archive the conversations not changed within the archive days
+        self._load_archive()
+        if self.archive_days is not None:
+            archive_time = time.time() - self.archive_days * 86400
+            for conversation_info in index['conversations']:
+                id_ = conversation_info['id']
+                if id_ not in self.archived_ids:
+                    try:
+                        if os.path.getmtime(self._shard_path('conversations', id_)) < archive_time:
+                            self._archive_shard(id_)
+                    except FileNotFoundError:
+                        pass
+        return config
+
+
+    # Load a conversation's exchanges - an archived conversation is decompressed. Exchanges may be
+    # loaded while a save is written (see _read_exchanges), so the rehydration metrics have their own
+    # lock.
+    def load_exchanges(self, conversation_id):
+        if conversation_id not in self.archived_ids:
+            return self._read_exchanges(conversation_id)
+
+        # Read the archived conversation and update the rehydration metrics
+        start_time = time.perf_counter()
+        exchanges = self._read_exchanges(conversation_id)
+        rehydration_seconds = time.perf_counter() - start_time
+        with self.rehydration_lock:
+            self.rehydrations += 1
+            self.rehydration_seconds += rehydration_seconds
+            self.rehydration_max_seconds = max(self.rehydration_max_seconds, rehydration_seconds)
+        return exchanges
+
+
+    # Get the archive metrics (OllamaChatArchiveStats) - the recorded values, so no lock is needed other
+    # than the rehydration metrics' lock
+    def archive_stats(self):
+        with self.rehydration_lock:
+            return {
+                'conversations': len(self.archived_ids),
+                'bytesSaved': self.archive_bytes_saved,
+                'rehydrations': self.rehydrations,
+                'rehydrationSeconds': self.rehydration_seconds,
+                'rehydrationMaxSeconds': self.rehydration_max_seconds
+            }
+
+
+    # Save the config - only the changed (or new) shards are written. The index is written only if
+    # it changed, and the shards no longer in the index are deleted.
+    def save(self, config, conversation_ids, template_ids):
+        # Write the changed conversation and template shards
+        current_conversation_ids = set()
+        for conversation in config['conversations']:
+            id_ = conversation['id']
+            current_conversation_ids.add(id_)
+            if id_ in conversation_ids or id_ not in self.conversation_ids:
+                if 'exchanges' not in conversation:
+                    conversation = {**conversation, 'exchanges': self.load_exchanges(id_)}
+                self._write_shard('conversations', id_, conversation)
+                if id_ in self.archived_ids:
+                    self._unarchive(id_)
+        current_template_ids = set()
+        for template in config.get('templates', ()):
+            id_ = template['id']
+            current_template_ids.add(id_)
+            if id_ in template_ids or id_ not in self.template_ids:
+                self._write_shard('templates', id_, template)
+
+        # Write the index, if necessary - the shard directory is always created, since it identifies the
+        # index file as sharded storage (see _config_storage)
+        index = _config_index(config)
+        if index != self.index:
+            os.makedirs(self.shard_dir, exist_ok=True)
+            _write_json(self.config_path, index, self.compact, checksum=True)
+            self.index = index
+
+        # Delete the removed shards
+        for id_ in self.conversation_ids - current_conversation_ids:
+            self._delete_shard('conversations', id_)
+            if id_ in self.archived_ids:
+                self._unarchive(id_)
+        for id_ in self.template_ids - current_template_ids:
+            self._delete_shard('templates', id_)
+        self.conversation_ids = current_conversation_ids
+        self.template_ids = current_template_ids
+
+
+    # Load the archived conversation IDs and their bytes saved. If an archived conversation also has a
+    # conversation shard, the archive or move was interrupted and the conversation shard is current.
+    def _load_archive(self):
+        archive_ids = _shard_ids(os.path.join(self.shard_dir, 'archive'), '.json.gz')
+        archived_ids = (archive_ids & self.conversation_ids) - _shard_ids(os.path.join(self.shard_dir, 'conversations'), '.json')
+        for id_ in archive_ids - archived_ids:
+            self._delete_shard('archive', id_)
+        for id_ in archived_ids:
+            # The gzip file's last four bytes are the uncompressed size, modulo 2^32
+            with open(self._shard_path('archive', id_), 'rb') as fh_archive:
+                fh_archive.seek(-4, os.SEEK_END)
+                self._add_archive(id_, int.from_bytes(fh_archive.read(4), 'little') - fh_archive.tell())
+
+
+    # Archive a conversation shard - the compressed shard is written before the shard is deleted
+    def _archive_shard(self, id_):
+        shard_path = self._shard_path('conversations', id_)
+        archive_path = self._shard_path('archive', id_)
+        with open(shard_path, 'rb') as fh_shard:
+            shard_json = fh_shard.read()
+        archive_data = gzip.compress(shard_json)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        _write_file(archive_path, archive_data)
+        self.shard_hashes.pop(shard_path, None)
+        _delete_file(shard_path)
+        self._add_archive(id_, len(shard_json) - len(archive_data))
+
+
+    # Add an archived conversation and record its bytes saved
+    def _add_archive(self, id_, bytes_saved):
+        self.archived_ids.add(id_)
+        self.archive_savings[id_] = bytes_saved
+        self.archive_bytes_saved += bytes_saved
+
+
+    # Remove an archived conversation and delete its archive shard
+    def _unarchive(self, id_):
+        self.archived_ids.discard(id_)
+        self.archive_bytes_saved -= self.archive_savings.pop(id_)
+        self._delete_shard('archive', id_)
+
+
+    # Read a conversation shard's exchanges. Shards are written atomically, but a save may move an
+    # archived conversation back to the conversations directory while it's read, so a missing archive
+    # shard is read from the conversations directory.
+    def _read_exchanges(self, id_):
+        if id_ in self.archived_ids:
+            try:
+                return self._read_shard('archive', id_, 'Conversation')['exchanges']
+            except FileNotFoundError:
+                pass
+        return self._read_shard('conversations', id_, 'Conversation')['exchanges']
+
+
+    def _shard_path(self, kind, id_):
+        extension = '.json.gz' if kind == 'archive' else '.json'
+        return os.path.join(self.shard_dir, kind, f'{urllib.parse.quote(id_, safe="")}{extension}')
+
+
+    def _read_shard(self, kind, id_, type_name):
+        shard_path = self._shard_path(kind, id_)
+        with open(shard_path, 'rb') as fh_shard:
+            shard_json = fh_shard.read()
+        if kind == 'archive':
+            shard_json = gzip.decompress(shard_json)
+        shard = json_loads(shard_json)
+        shard_hash = hashlib.sha256(shard_json).digest()
+        if self.shard_hashes.get(shard_path) != shard_hash:
+            shard = schema_markdown.validate_type(self.types, type_name, shard)
+            self.shard_hashes[shard_path] = shard_hash
+        return shard
+
+
+    def _write_shard(self, kind, id_, value):
+        shard_path = self._shard_path(kind, id_)
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        self.shard_hashes[shard_path] = hashlib.sha256(_write_json(shard_path, value, self.compact)).digest()
+
+
+    def _delete_shard(self, kind, id_):
+        shard_path = self._shard_path(kind, id_)
+        self.shard_hashes.pop(shard_path, None)
+        _delete_file(shard_path)
+
+
+# The SQLite config storage class. Conversation infos, exchanges, and templates are table rows.
+# Conversation exchanges are not loaded until the conversation is accessed (see load_exchanges).
+# Exchanges are read using their own connection, so they may be loaded while a save is written.
+#
+# A single-file config is migrated to SQLite storage on load. The single-file config is kept as a
+# backup file (e.g. "ollama-chat.json.bak").
+class SQLiteStorage:
+    __slots__ = ('config_path', 'types', 'connection', 'read_connection', 'index')
+
+
+    def __init__(self, config_path, types):
+        self.config_path = config_path
+        self.types = types
+        self.connection = None
+        self.read_connection = None
+        self.index = None
+
+
+    # Load the config - returns None if the database file does not exist. The loaded
+    # conversations do not have exchanges, unless the config was migrated.
+    def load(self):
+        if not os.path.isfile(self.config_path):
+            return None
+
+        # Single-file config? If so, migrate it to the database.
+        with open(self.config_path, 'rb') as fh_config:
+            header = fh_config.read(len(_SQLITE_HEADER))
+        if header and header != _SQLITE_HEADER:
+            return self._migrate()
+        self._connect()
+
+        # Load the settings and conversation infos
+        config = {key: json.loads(value) for key, value in self.connection.execute('SELECT key, value FROM settings')}
+        config['conversations'] = [
+            {'id': id_, 'model': model, 'title': title}
+            for id_, model, title in self.connection.execute('SELECT id, model, title FROM conversations ORDER BY position')
+        ]
+        config = schema_markdown.validate_type(self.types, 'OllamaChatIndex', config)
+
+        # Load the templates
+        templates = [
+            schema_markdown.validate_type(self.types, 'ConversationTemplate', json.loads(template))
+            for (template,) in self.connection.execute('SELECT template FROM templates ORDER BY position')
+        ]
+        if templates:
+            config['templates'] = templates
+
+        self.index = _config_index(config)
+        return config
+
+
+    # Load a conversation's exchanges
+    def load_exchanges(self, conversation_id):
+        if self.read_connection is None:
+            # The read connection is used by request and chat threads, always under the config lock
+            self.read_connection = sqlite3.connect(self.config_path, check_same_thread=False)
+        return [
+            {'user': user, 'model': model} if thinking is None else {'user': user, 'model': model, 'thinking': thinking}
+            for user, model, thinking in self.read_connection.execute(
+                'SELECT user, model, thinking FROM exchanges WHERE conversation_id = ? ORDER BY position',
+                (conversation_id,)
+            )
+        ]
+
+
+    # Save the config - conversation info rows are written only if changed, and exchange rows are
+    # written only for changed conversations
+    def save(self, config, conversation_ids, template_ids):
+        if self.connection is None:
+            self._connect()
+        index = _config_index(config)
+        with self.connection:
+            # Write the settings
+            settings = [(key, json.dumps(value)) for key, value in index.items() if key not in ('conversations', 'templates')]
+            old_settings = [] if self.index is None else \
+                [(key, json.dumps(value)) for key, value in self.index.items() if key not in ('conversations', 'templates')]
+            if settings != old_settings:
+                self.connection.execute('DELETE FROM settings')
+                self.connection.executemany('INSERT INTO settings (key, value) VALUES (?, ?)', settings)
+
+            # Write the changed conversation infos and delete the removed conversations
+            old_infos = {} if self.index is None else \
+                {info['id']: (ix_info, info) for ix_info, info in enumerate(self.index['conversations'])}
+            current_ids = set()
+            for ix_info, info in enumerate(index['conversations']):
+                current_ids.add(info['id'])
+                if old_infos.get(info['id']) != (ix_info, info):
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO conversations (id, position, model, title) VALUES (?, ?, ?, ?)',
+                        (info['id'], ix_info, info['model'], info['title'])
+                    )
+            for id_ in old_infos.keys() - current_ids:
+                self.connection.execute('DELETE FROM conversations WHERE id = ?', (id_,))
+                self.connection.execute('DELETE FROM exchanges WHERE conversation_id = ?', (id_,))
+
+            # Write the changed conversations' exchanges
+            for conversation in config['conversations']:
+                id_ = conversation['id']
+                if 'exchanges' in conversation and (id_ in conversation_ids or id_ not in old_infos):
+                    self.connection.execute('DELETE FROM exchanges WHERE conversation_id = ?', (id_,))
+                    self.connection.executemany(
+                        'INSERT INTO exchanges (conversation_id, position, user, model, thinking) VALUES (?, ?, ?, ?, ?)',
+                        [
+                            (id_, ix_exchange, exchange['user'], exchange['model'], exchange.get('thinking'))
+                            for ix_exchange, exchange in enumerate(conversation['exchanges'])
+                        ]
+                    )
+
+            # Write the templates, if changed
+            if template_ids or index.get('templates') != (self.index or {}).get('templates'):
+                self.connection.execute('DELETE FROM templates')
+                self.connection.executemany(
+                    'INSERT INTO templates (id, position, template) VALUES (?, ?, ?)',
+                    [
+                        (template['id'], ix_template, json.dumps(template))
+                        for ix_template, template in enumerate(config.get('templates', ()))
+                    ]
+                )
+        self.index = index
+
+
+    # Helper to migrate a single-file config to the database - the single-file config is moved to a
+    # backup file, since the database replaces it
+    def _migrate(self):
+        config, trusted = _read_json(self.config_path)
+        if trusted and _is_index_config(config):
+            raise ValueError(f'Configuration file "{self.config_path}" is a sharded storage index')
+        if not trusted:
+            config = schema_markdown.validate_type(self.types, 'OllamaChatConfig', config)
+        if not config.get('noSave'):
+            os.replace(self.config_path, f'{self.config_path}.bak')
+            self.save(config, (), ())
+        return config
+
+
+    def _connect(self):
+        # The connection is used by the saving threads, always under the storage lock
+        self.connection = sqlite3.connect(self.config_path, check_same_thread=False)
+        self.connection.executescript(_SQLITE_SCHEMA)
+
+
+# The append-only config journal class. Each line of the journal file is a JSON change record
+# (OllamaChatJournalRecord). Records are idempotent, so replaying a record whose change was already
+# saved is harmless. When a config save starts, the journal is checkpointed - its records are moved to
+# the checkpoint file, which is deleted once the save is written - so the records written during the
+# save are kept, and a failed save's records are replayed.
+class Journal:
+    __slots__ = ('journal_path', 'checkpoint_path', 'types', 'journal_lock', 'fh_journal')
+
+
+    def __init__(self, journal_path, types):
+        self.journal_path = journal_path
+        self.checkpoint_path = f'{journal_path}.checkpoint'
+        self.types = types
+        self.journal_lock = threading.Lock()
+        self.fh_journal = None
+
+
+    # Read the checkpoint and journal records - reading a file stops at its first invalid (e.g.,
+    # partially-written) record
+    def read(self):
+        records = []
+        for path in (self.checkpoint_path, self.journal_path):
+            try:
+                with open(path, 'rb') as fh_journal:
+                    for line in fh_journal:
+                        try:
+                            records.append(schema_markdown.validate_type(self.types, 'OllamaChatJournalRecord', json_loads(line)))
+                        except (ValueError, schema_markdown.ValidationError):
+                            break
+            except FileNotFoundError:
+                pass
+        return records
+
+
+    # Append a record to the journal
+    def write(self, record):
+        with self.journal_lock:
+            if self.fh_journal is None:
+                self.fh_journal = open(self.journal_path, 'ab') # pylint: disable=consider-using-with
+            self.fh_journal.write(json_dumps(record, compact=True) + b'\n')
+            self.fh_journal.flush()
+
+
+    # Move the journal records to the checkpoint file - if a checkpoint file exists (its save failed),
+    # the records are appended to it
+    def checkpoint(self):
+        with self.journal_lock:
+            if self.fh_journal is not None:
+                self.fh_journal.close()
+                self.fh_journal = None
+            if not os.path.isfile(self.journal_path):
+                return
+            if not os.path.isfile(self.checkpoint_path):
+                os.replace(self.journal_path, self.checkpoint_path)
+                return
+            with open(self.journal_path, 'rb') as fh_journal:
+                journal_bytes = fh_journal.read()
+            with open(self.checkpoint_path, 'ab') as fh_checkpoint:
+                fh_checkpoint.write(journal_bytes)
+            _delete_file(self.journal_path)
+
+
+    # Delete the checkpoint file
+    def clear_checkpoint(self):
+        _delete_file(self.checkpoint_path)
+
+
+    # Delete the journal and checkpoint files
+    def clear(self):
+        with self.journal_lock:
+            if self.fh_journal is not None:
+                self.fh_journal.close()
+                self.fh_journal = None
+            _delete_file(self.journal_path)
+            _delete_file(self.checkpoint_path)
+
+
+_SQLITE_SCHEMA = '''\
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    title TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_position ON conversations (position);
+CREATE TABLE IF NOT EXISTS exchanges (
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    model TEXT NOT NULL,
+    thinking TEXT,
+    PRIMARY KEY (conversation_id, position)
+);
+CREATE TABLE IF NOT EXISTS templates (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    template TEXT NOT NULL
+);
+'''
+
+
+# Helper to write a JSON file atomically - the JSON is written to a temporary file that then
+# replaces the file, so an interrupted write never leaves a partially-written file. If checksum is
+# True, the JSON's checksum file is also written (see _read_json). Returns the written JSON bytes.
+def _write_json(path, value, compact=False, checksum=False):
+    value_json = json_dumps(value, compact)
+    _write_file(path, value_json)
+    if checksum:
+        _write_file(f'{path}.sha256', hashlib.sha256(value_json).hexdigest().encode('utf-8'))
+    return value_json
+
+
+# Helper to write a file atomically (see _write_json)
+def _write_file(path, data):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as fh_temp:
+        fh_temp.write(data)
+    os.replace(temp_path, path)
+
+
+# Helper to delete a file, if it exists
+def _delete_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Helper to read a JSON file - returns the value and True if the file matches its checksum file.
+# A matching file was written by ollama-chat, so it's trusted and need not be validated.
+def _read_json(path):
+    with open(path, 'rb') as fh_json:
+        value_json = fh_json.read()
+    try:
+        with open(f'{path}.sha256', 'r', encoding='utf-8') as fh_checksum:
+            trusted = fh_checksum.read() == hashlib.sha256(value_json).hexdigest()
+    except FileNotFoundError:
+        trusted = False
+    return json_loads(value_json), trusted
+
+
+# The SQLite database file header
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+# Helper to determine an existing config file's storage name - returns None if the config file does
+# not exist. A config file with a shard directory is a sharded storage index.
+def _config_storage(config_path):
+    try:
+        with open(config_path, 'rb') as fh_config:
+            header = fh_config.read(len(_SQLITE_HEADER))
+    except FileNotFoundError:
+        return None
+    if header == _SQLITE_HEADER:
+        return 'sqlite'
+    if os.path.isdir(f'{os.path.splitext(config_path)[0]}.d'):
+        return 'sharded'
+    return 'json'
+
+
+# Helper to get the IDs of a shard directory's shard files
+def _shard_ids(shard_dir, extension):
+    try:
+        return set(
+            urllib.parse.unquote(filename[:-len(extension)])
+            for filename in os.listdir(shard_dir) if filename.endswith(extension)
+        )
+    except FileNotFoundError:
+        return set()
+
+
+# Helper to validate a single-file config without its conversations' exchanges - returns the
+# validated config, with the conversations' unvalidated exchanges, and the set of conversation IDs
+# with unvalidated exchanges. The exchange list and exchange object shapes are validated, so an
+# unvalidated conversation can always be copied and saved.
+def _validate_config_infos(types, config):
+    # Malformed conversations or exchanges? If so, validate the entire config for the error.
+    conversations = config.get('conversations') if isinstance(config, dict) else None
+    if not isinstance(conversations, list) or not all(
+        isinstance(conversation, dict) and isinstance(conversation.get('exchanges'), list)
+        and all(isinstance(exchange, dict) for exchange in conversation['exchanges'])
+        for conversation in conversations
+    ):
+        return schema_markdown.validate_type(types, 'OllamaChatConfig', config), set()
+
+    # Validate the config with empty exchanges, then restore the exchanges
+    config = schema_markdown.validate_type(types, 'OllamaChatConfig', {
+        **config,
+        'conversations': [{**conversation, 'exchanges': []} for conversation in conversations]
+    })
+    for conversation, conversation_exchanges in zip(config['conversations'], conversations):
+        conversation['exchanges'] = conversation_exchanges['exchanges']
+    return config, set(conversation['id'] for conversation in config['conversations'])
+
+
+# Helper to determine if a config file is a single-file config (i.e., not an index)
+def _is_single_file_config(config):
+    return isinstance(config, dict) and (
+        any(isinstance(conversation, dict) and 'exchanges' in conversation for conversation in config.get('conversations') or ())
+        or any(isinstance(template, dict) and 'prompts' in template for template in config.get('templates') or ())
+    )
+
+
+# Helper to determine if a config file is an index (i.e., its conversations or templates are not stored
+# in the config file)
+def _is_index_config(config):
+    return isinstance(config, dict) and (
+        any(isinstance(conversation, dict) and 'exchanges' not in conversation for conversation in config.get('conversations') or ())
+        or any(isinstance(template, dict) and 'prompts' not in template for template in config.get('templates') or ())
+    )
+
+
+# Helper to compute a config's index
+def _config_index(config):
+    index = {key: value for key, value in config.items() if key not in ('conversations', 'templates')}
+    index['conversations'] = [
+        {'id': conversation['id'], 'model': conversation['model'], 'title': conversation['title']}
+        for conversation in config['conversations']
+    ]
+    if 'templates' in config:
+        index['templates'] = [{'id': template['id'], 'title': template['title']} for template in config['templates']]
+    return index
@@ -1,20 +1,40 @@
 # Licensed under the MIT License
 # https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
 
+import asyncio
 import json
 from io import StringIO
 import os
 import re
+import threading
+import time
 import unittest
 import unittest.mock
 
+import chisel
 import urllib3
 from schema_markdown import encode_query_string
-from ollama_chat.app import DownloadManager, OllamaChat
+from ollama_chat.app import MAX_WAITERS, DownloadManager, OllamaChat
+from ollama_chat.chat import CHAT_PRIORITY_TEMPLATE
+from ollama_chat.codec import json_dumps
+from ollama_chat.storage import JSONStorage, Journal
 
 from .util import create_test_files
 
 
+# Helper to create a mock pool manager request function for the model list (/api/tags) and loaded
+# models (/api/ps) requests
+def mock_models_request(mock_list_response, loaded_models=()):
+    mock_ps_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+    mock_ps_response.status = 200
+    mock_ps_response.json.return_value = {'models': list(loaded_models)}
+
+    def request(unused_method, url, **unused_kwargs):
+        return mock_ps_response if url.endswith('/api/ps') else mock_list_response
+
+    return request
+
+
 class TestApp(unittest.TestCase):
 
     def test_init(self):
@@ -40,6 +60,7 @@ class TestApp(unittest.TestCase):
                     'getConversation',
                     'getConversations',
                     'getModels',
+                    'getStats',
                     'getSystemInfo',
                     'getTemplate',
                     'index.html',
@@ -58,6 +79,7 @@ class TestApp(unittest.TestCase):
                     'startTemplate',
                     'stopConversation',
                     'stopModelDownload',
+                    'streamConversation',
                     'updateTemplate'
                 ]
             )
@@ -83,6 +105,7 @@ class TestApp(unittest.TestCase):
                     'getConversation',
                     'getConversations',
                     'getModels',
+                    'getStats',
                     'getSystemInfo',
                     'getTemplate',
                     'index.html',
@@ -101,11 +124,565 @@ class TestApp(unittest.TestCase):
                     'startTemplate',
                     'stopConversation',
                     'stopModelDownload',
+                    'streamConversation',
                     'updateTemplate'
                 ]
             )
 
 
+class TestConfigManager(unittest.TestCase):
+
+    def test_indexes(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ],
+            'templates': [
+                {'id': 'tmpl1', 'title': 'Template 1', 'name': 'test', 'prompts': ['Hello']},
+                {'id': 'tmpl2', 'title': 'Template 2', 'name': 'test', 'prompts': ['Goodbye']}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            with app.config() as config:
+                self.assertListEqual(list(app.config.conversations_by_id.keys()), ['conv1', 'conv2'])
+                self.assertListEqual(list(app.config.templates_by_id.keys()), ['tmpl1', 'tmpl2'])
+
+                # The first template with a name takes precedence
+                self.assertIs(app.config.templates_by_name['test'], config['templates'][0])
+                app.config.move_template('tmpl1', True)
+                self.assertEqual(app.config.templates_by_name['test']['id'], 'tmpl2')
+
+                # Update a template
+                app.config.update_template({'id': 'tmpl2', 'title': 'Template 2', 'name': 'test2', 'prompts': ['Goodbye']})
+                self.assertEqual(app.config.templates_by_name['test']['id'], 'tmpl1')
+                self.assertEqual(app.config.templates_by_name['test2']['id'], 'tmpl2')
+                self.assertIs(app.config.templates_by_id['tmpl2'], config['templates'][0])
+
+                # Delete a template
+                app.config.delete_template('tmpl1')
+                self.assertListEqual(list(app.config.templates_by_id.keys()), ['tmpl2'])
+                self.assertListEqual(list(app.config.templates_by_name.keys()), ['test2'])
+
+                # Add and delete conversations
+                conversation = {'id': 'conv3', 'model': 'llm', 'title': 'Conversation 3', 'exchanges': []}
+                app.config.add_conversation(conversation)
+                self.assertIs(app.config.get_conversation('conv3'), conversation)
+                self.assertIs(config['conversations'][0], conversation)
+                app.config.delete_conversation('conv1')
+                self.assertIsNone(app.config.get_conversation('conv1'))
+                self.assertListEqual([conv['id'] for conv in config['conversations']], ['conv3', 'conv2'])
+
+
+    def test_conversation_lock(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Holding one conversation's lock does not block other conversations or the conversation list
+            with app.config.conversation('conv1') as conversation:
+                self.assertDictEqual(conversation, original_config['conversations'][0])
+                conv1_lock = app.config.conversation_locks['conv1']
+                self.assertTrue(conv1_lock.locked())
+
+                status, _, content_bytes = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv2'}))
+                self.assertEqual(status, '200 OK')
+                self.assertEqual(json.loads(content_bytes.decode('utf-8'))['conversation']['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+
+                status, _, content_bytes = app.request('GET', '/getConversations')
+                self.assertEqual(status, '200 OK')
+                self.assertEqual(len(json.loads(content_bytes.decode('utf-8'))['conversations']), 2)
+            self.assertFalse(conv1_lock.locked())
+
+            # The conversation lock is reused
+            with app.config.conversation('conv1'):
+                self.assertIs(app.config.conversation_locks['conv1'], conv1_lock)
+
+            # Deleting the conversation deletes its lock
+            status, _, _ = app.request('POST', '/deleteConversation', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(list(app.config.conversation_locks.keys()), ['conv2'])
+
+
+    def test_conversation_cache(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('threading.Thread'):
+            config_path = os.path.join(temp_dir, 'ollama-chat.db')
+            app = OllamaChat(config_path)
+            with app.config(save=True):
+                for ix_conv in range(4, 0, -1):
+                    app.config.add_conversation({
+                        'id': f'conv{ix_conv}', 'model': 'llm', 'title': f'Conversation {ix_conv}',
+                        'exchanges': [{'user': 'Hello', 'model': f'Hi {ix_conv}'}]
+                    })
+
+            # Only the exchanges of the most recently-used conversations are kept
+            app2 = OllamaChat(config_path, save_delay=60)
+            app2.config.conversation_cache_size = 2
+            def loaded_ids():
+                return [conv['id'] for conv in app2.config.config['conversations'] if 'exchanges' in conv]
+            for id_ in ('conv1', 'conv2', 'conv3'):
+                status, _, content_bytes = app2.request('GET', '/getConversation', query_string=encode_query_string({'id': id_}))
+                self.assertEqual(status, '200 OK')
+                self.assertEqual(json.loads(content_bytes.decode('utf-8'))['conversation']['exchanges'][0]['model'], f'Hi {id_[-1]}')
+            self.assertListEqual(loaded_ids(), ['conv2', 'conv3'])
+            self.assertListEqual(list(app2.config.loaded_conversations.keys()), ['conv2', 'conv3'])
+
+            # Pinned conversations are not evicted
+            with app2.config.conversation('conv2') as conversation:
+                self.assertEqual(conversation['exchanges'][0]['model'], 'Hi 2')
+                with app2.config():
+                    app2.config.get_conversation('conv1')
+                self.assertListEqual(loaded_ids(), ['conv1', 'conv2'])
+            self.assertDictEqual(app2.config.conversation_pins, {})
+
+            # Changed conversations are not evicted until saved
+            status, _, _ = app2.request('POST', '/deleteConversationExchange', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            with app2.config():
+                app2.config.get_conversation('conv3')
+                app2.config.get_conversation('conv4')
+            self.assertListEqual(loaded_ids(), ['conv1', 'conv4'])
+            app2.config.conversation_cache_size = 1
+            app2.config.flush()
+            self.assertListEqual(loaded_ids(), ['conv4'])
+            with app2.config():
+                self.assertListEqual(app2.config.get_conversation('conv1')['exchanges'], [])
+
+            # Deleted conversations are removed from the cache
+            status, _, _ = app2.request('POST', '/deleteConversation', wsgi_input=json.dumps({'id': 'conv4'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(list(app2.config.loaded_conversations.keys()), ['conv1'])
+
+            # Evict multiple conversations - pinned conversations may exceed the cache size
+            app2.config.conversation_cache_size = 3
+            with app2.config():
+                for id_ in ('conv2', 'conv3'):
+                    app2.config.get_conversation(id_)
+            self.assertListEqual(loaded_ids(), ['conv1', 'conv2', 'conv3'])
+            app2.config.conversation_cache_size = 1
+            with app2.config():
+                app2.config.pin_conversation('conv1')
+                app2.config.pin_conversation('conv1')
+                self.assertDictEqual(app2.config.conversation_pins, {'conv1': 2})
+                app2.config.get_conversation('conv3')
+                self.assertListEqual(loaded_ids(), ['conv1', 'conv3'])
+                app2.config.unpin_conversation('conv1')
+                app2.config.unpin_conversation('conv1')
+                self.assertDictEqual(app2.config.conversation_pins, {})
+                app2.config.get_conversation('conv2')
+            self.assertListEqual(loaded_ids(), ['conv2'])
+
+
+    def test_conversation_deleted_while_waiting(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Get the conversation on another thread while the conversation is locked
+            responses = []
+            def get_conversation():
+                responses.append(app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'})))
+            with app.config():
+                conversation_lock = app.config.conversation_lock('conv1')
+            with conversation_lock:
+                get_thread = threading.Thread(target=get_conversation)
+                get_thread.start()
+                time.sleep(0.1)
+
+                # Delete the conversation
+                with app.config():
+                    app.config.delete_conversation('conv1')
+            get_thread.join()
+
+            status, _, content_bytes = responses[0]
+            self.assertEqual(status, '400 Bad Request')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {'error': 'UnknownConversationID'})
+
+
+    def test_save_delay(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        saved_event = threading.Event()
+        json_storage_save = JSONStorage.save
+        def save(*args):
+            json_storage_save(*args)
+            saved_event.set()
+
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('ollama_chat.app.time.sleep') as mock_sleep, \
+             unittest.mock.patch.object(JSONStorage, 'save', autospec=True, side_effect=save) as mock_save:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, save_delay=0.5)
+
+            # Block the saver thread's save delay until the requests are complete
+            sleep_event = threading.Event()
+            mock_sleep.side_effect = lambda unused_delay: sleep_event.wait()
+
+            # Make several changes - nothing is saved yet
+            for request in [
+                {'id': 'conv1', 'down': True},
+                {'id': 'conv1', 'down': False},
+                {'id': 'conv2', 'down': False}
+            ]:
+                status, _, _ = app.request('POST', '/moveConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+            self.assertEqual(mock_save.call_count, 0)
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), original_config)
+
+            # Complete the save delay - the changes are saved once
+            sleep_event.set()
+            self.assertTrue(saved_event.wait(5))
+            with app.config():
+                self.assertEqual(mock_save.call_count, 1)
+                mock_sleep.assert_called_once_with(0.5)
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertListEqual([conv['id'] for conv in json.load(fh_config)['conversations']], ['conv2', 'conv1'])
+
+            # Flush does nothing if there are no deferred changes
+            app.config.flush()
+            self.assertEqual(mock_save.call_count, 1)
+
+
+    def test_save_delay_flush(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('threading.Thread') as mock_thread:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, save_delay=0.5)
+
+            # Make changes - the saver thread is started once
+            request = {'title': 'Template 1', 'prompts': ['Hello']}
+            for _ in range(2):
+                status, _, _ = app.request('POST', '/createTemplate', wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+            mock_thread.assert_called_once_with(target=app.config._save_thread_fn)
+            self.assertTrue(mock_thread.return_value.daemon)
+            mock_thread.return_value.start.assert_called_once_with()
+            self.assertFalse(os.path.isfile(config_path))
+
+            # Flush the changes
+            app.config.flush()
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertEqual(len(json.load(fh_config)['templates']), 2)
+
+
+    def test_save_thread_error(self):
+        save_template_ids = []
+        def save(unused_storage, unused_config, unused_conversation_ids, template_ids):
+            save_template_ids.append(set(template_ids))
+            if len(save_template_ids) == 1:
+                raise Exception('Boom')
+
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('ollama_chat.app.time.sleep') as mock_sleep, \
+             unittest.mock.patch.object(JSONStorage, 'save', autospec=True, side_effect=save):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, save_delay=0.5)
+
+            # Request a save
+            request = {'title': 'Template 1', 'prompts': ['Hello']}
+            status, _, content_bytes = app.request('POST', '/createTemplate', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            template_id = json.loads(content_bytes.decode('utf-8'))['id']
+
+            # Run the saver thread function - the failed save is logged and its changes are saved by the next save
+            mock_save_event = unittest.mock.Mock(spec=threading.Event)
+            mock_save_event.wait.side_effect = [True, True, StopIteration]
+            mock_save_event.is_set.return_value = True
+            app.config.save_event = mock_save_event
+            with self.assertRaises(StopIteration), \
+                 self.assertLogs('ollama_chat.app', level='ERROR') as cm_logs:
+                app.config._save_thread_fn()
+            self.assertEqual(len(cm_logs.records), 1)
+            self.assertEqual(cm_logs.records[0].getMessage(), f'Failed to save "{config_path}"')
+            self.assertEqual(str(cm_logs.records[0].exc_info[1]), 'Boom')
+            mock_save_event.set.assert_called_once_with()
+            self.assertListEqual(save_template_ids, [{template_id}, {template_id}])
+            self.assertListEqual(mock_sleep.call_args_list, [unittest.mock.call(0.5), unittest.mock.call(0.5)])
+            self.assertSetEqual(app.config.changed_templates, set())
+
+
+    def test_save_unlocked(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+                ]
+            }))
+        ]
+        json_storage_save = JSONStorage.save
+        def save(storage, config, conversation_ids, template_ids):
+            # The config is written holding only the storage lock
+            self.assertFalse(app.config.config_lock.locked())
+            self.assertFalse(conversation_lock.locked())
+            self.assertTrue(app.config.storage_lock.locked())
+
+            # Changes made while the config is written are not written, and their records are journaled
+            with conversation_lock:
+                conversation['exchanges'][0]['model'] = 'Hi there'
+                app.config.journal_write({'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 2, 'text': ' there'}})
+            json_storage_save(storage, config, conversation_ids, template_ids)
+
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch.object(JSONStorage, 'save', autospec=True, side_effect=save):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, journal=True)
+            with app.config():
+                conversation = app.config.get_conversation('conv1')
+                conversation_lock = app.config.conversation_lock('conv1')
+
+            # Save a title change
+            request = {'id': 'conv1', 'title': 'Title'}
+            status, _, _ = app.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertFalse(app.config.storage_lock.locked())
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), {
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Title', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+                    ]
+                })
+            self.assertListEqual(
+                app.config.journal.read(),
+                [{'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 2, 'text': ' there'}}]
+            )
+            self.assertSetEqual(app.config.changed_conversations, {'conv1'})
+
+
+    def test_save_error_flush(self):
+        save_count = []
+        json_storage_save = JSONStorage.save
+        def save(storage, config, conversation_ids, template_ids):
+            save_count.append(None)
+            if len(save_count) < 3:
+                raise OSError('Boom')
+            json_storage_save(storage, config, conversation_ids, template_ids)
+
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch.object(JSONStorage, 'save', autospec=True, side_effect=save):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The save fails - the changes remain changed and a save remains requested
+            with self.assertRaises(OSError):
+                with app.config(save=True):
+                    app.config.add_conversation({'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []})
+            self.assertSetEqual(app.config.changed_conversations, {'conv1'})
+            self.assertSetEqual(app.config.saving_conversations, set())
+            self.assertTrue(app.config.save_event.is_set())
+
+            # Flush raises the save error
+            with self.assertRaises(OSError):
+                app.config.flush()
+            self.assertTrue(app.config.save_event.is_set())
+            self.assertFalse(os.path.exists(config_path))
+
+            # Flush saves the changes
+            app.config.flush()
+            self.assertFalse(app.config.save_event.is_set())
+            self.assertSetEqual(app.config.changed_conversations, set())
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertEqual(json.load(fh_config)['conversations'][0]['id'], 'conv1')
+
+
+    def test_save_unlocked_load(self):
+        for config_filename, storage in (('ollama-chat.json', 'sharded'), ('ollama-chat.db', 'sqlite')):
+            with self.subTest(storage=storage), create_test_files([]) as temp_dir:
+                config_path = os.path.join(temp_dir, config_filename)
+                app = OllamaChat(config_path, storage=storage)
+                with app.config(save=True):
+                    app.config.add_conversation({'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []})
+                    app.config.add_conversation({
+                        'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]
+                    })
+
+                # Get a conversation on another thread while the config is written
+                app2 = OllamaChat(config_path, storage=storage)
+                storage_class = type(app2.config.storage)
+                storage_save = storage_class.save
+                responses = []
+                def get_conversation(app_):
+                    responses.append(app_.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'})))
+                def save(storage_, config, conversation_ids, template_ids):
+                    get_thread = threading.Thread(target=get_conversation, args=(app2,))
+                    get_thread.start()
+                    get_thread.join(5)
+                    storage_save(storage_, config, conversation_ids, template_ids)
+
+                with unittest.mock.patch.object(storage_class, 'save', autospec=True, side_effect=save):
+                    request = {'id': 'conv2', 'title': 'New Title'}
+                    status, _, _ = app2.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+                    self.assertEqual(status, '200 OK')
+
+                # The conversation was loaded without waiting for the save
+                self.assertEqual(len(responses), 1)
+                status, _, content_bytes = responses[0]
+                self.assertEqual(status, '200 OK')
+                response = json.loads(content_bytes.decode('utf-8'))
+                self.assertListEqual(response['conversation']['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+
+
+    def test_save_checkpoint_error(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch.object(Journal, 'checkpoint', side_effect=OSError('Boom')):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, journal=True)
+
+            # The journal checkpoint fails - the changes remain changed and the storage lock is released
+            with self.assertRaises(OSError):
+                with app.config(save=True):
+                    app.config.add_conversation({'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []})
+            self.assertSetEqual(app.config.changed_conversations, {'conv1'})
+            self.assertFalse(app.config.storage_lock.locked())
+            self.assertFalse(os.path.exists(config_path))
+
+
+    def test_journal(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [
+                    {'user': 'Hello', 'model': 'Hi'},
+                    {'user': 'Goodbye', 'model': 'Bye'}
+                ]},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            journal_path = os.path.join(temp_dir, 'ollama-chat.journal')
+            app = OllamaChat(config_path, save_delay=60, journal=True)
+
+            # Make changes - the changes are journaled but not saved
+            responses = []
+            for url, request in [
+                ('/setConversationTitle', {'id': 'conv1', 'title': 'New Title'}),
+                ('/deleteConversationExchange', {'id': 'conv1'}),
+                ('/deleteConversation', {'id': 'conv2'}),
+                ('/startConversation', {'user': 'Hello', 'model': 'llm'}),
+                ('/regenerateConversationExchange', {'id': 'conv1'})
+            ]:
+                status, _, content_bytes = app.request('POST', url, wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+                responses.append(json.loads(content_bytes.decode('utf-8')))
+            conversation_id = responses[3]['id']
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), original_config)
+            expected_records = [
+                {'title': {'id': 'conv1', 'title': 'New Title'}},
+                {'truncate': {'id': 'conv1', 'index': 1}},
+                {'delete': {'id': 'conv2'}},
+                {'conversation': {'id': conversation_id, 'model': 'llm', 'title': 'Hello', 'exchanges': []}},
+                {'truncate': {'id': 'conv1', 'index': 0}}
+            ]
+            with open(journal_path, 'r', encoding='utf-8') as fh_journal:
+                self.assertListEqual([json.loads(line) for line in fh_journal], expected_records)
+
+            # Simulate a crash during a response - ignored records, and a partially-written record
+            with open(journal_path, 'a', encoding='utf-8') as fh_journal:
+                for record in [
+                    {'exchange': {'id': 'conv1', 'index': 0, 'user': 'Hello'}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'thinking', 'offset': 0, 'text': 'Hmm'}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 0, 'text': 'Hi '}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 3, 'text': 'there'}},
+                    {'text': {'id': 'conv1', 'index': 1, 'field': 'model', 'offset': 0, 'text': 'Unknown exchange'}},
+                    {'title': {'id': 'unknown', 'title': 'Unknown conversation'}},
+                    {'delete': {'id': 'unknown'}},
+                    {'conversation': {'id': 'conv1', 'model': 'llm', 'title': 'Existing conversation', 'exchanges': []}}
+                ]:
+                    fh_journal.write(f'{json.dumps(record)}\n')
+                fh_journal.write('{"title": {"id": "conv1", "ti')
+
+            # Replay the journal on startup - the replayed changes are saved and the journal is cleared
+            app2 = OllamaChat(config_path, save_delay=60, journal=True)
+            expected_config = {
+                'conversations': [
+                    {'id': conversation_id, 'model': 'llm', 'title': 'Hello', 'exchanges': []},
+                    {'id': 'conv1', 'model': 'llm', 'title': 'New Title', 'exchanges': [
+                        {'user': 'Hello', 'model': 'Hi there', 'thinking': 'Hmm'}
+                    ]}
+                ]
+            }
+            with app2.config() as config:
+                self.assertDictEqual(config, expected_config)
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), expected_config)
+            self.assertFalse(os.path.exists(journal_path))
+
+            # No journal with noSave
+            with app2.config() as config:
+                config['noSave'] = True
+                app2.config.journal_write({'delete': {'id': 'conv1'}})
+            app2.config._save()
+            app3 = OllamaChat(config_path, journal=True)
+            self.assertIsNone(app3.config.journal)
+            with app3.config() as config:
+                self.assertEqual(len(config['conversations']), 2)
+
+
+    def test_journal_unrelated_save(self):
+        for config_filename, storage in (('ollama-chat.json', 'sharded'), ('ollama-chat.db', 'sqlite')):
+            with self.subTest(storage=storage), create_test_files([]) as temp_dir:
+                config_path = os.path.join(temp_dir, config_filename)
+                app = OllamaChat(config_path, storage=storage, journal=True)
+                with app.config(save=True):
+                    app.config.add_conversation({'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []})
+                    app.config.add_conversation({'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []})
+
+                # A response is journaled holding only the conversation lock (as by a chat)
+                with app.config():
+                    conversation = app.config.get_conversation('conv1')
+                    conversation_lock = app.config.conversation_lock('conv1')
+                with conversation_lock:
+                    conversation['exchanges'].append({'user': 'Hello', 'model': 'Hi'})
+                    app.config.journal_write({'exchange': {'id': 'conv1', 'index': 0, 'user': 'Hello'}})
+                    app.config.journal_write({'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 0, 'text': 'Hi'}})
+
+                # An unrelated change is saved, clearing the journal - the journaled conversation is saved
+                status, _, _ = app.request(
+                    'POST', '/setConversationTitle', wsgi_input=json.dumps({'id': 'conv2', 'title': 'New Title'}).encode('utf-8')
+                )
+                self.assertEqual(status, '200 OK')
+                self.assertListEqual(app.config.journal.read(), [])
+                app2 = OllamaChat(config_path, storage=storage, journal=True)
+                with app2.config():
+                    self.assertListEqual(app2.config.get_conversation('conv1')['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+                    self.assertEqual(app2.config.get_conversation('conv2')['title'], 'New Title')
+
+
 class TestDownloadManager(unittest.TestCase):
 
     def test_download_fn(self):
@@ -119,7 +696,7 @@ class TestDownloadManager(unittest.TestCase):
             mock_pull_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_pull_response.status = 200
             mock_pull_response.read_chunked.return_value = [
-                json.dumps({'status': 'success', 'completed': 1000, 'total': 2000}).encode('utf-8'),
+                (json.dumps({'status': 'success', 'completed': 1000, 'total': 2000}) + '\n').encode('utf-8'),
             ]
 
             # Configure the mock PoolManager instance
@@ -136,8 +713,10 @@ class TestDownloadManager(unittest.TestCase):
             mock_thread.return_value.start.assert_called_once_with()
             self.assertTrue(mock_thread.return_value.daemon)
 
-            # Run the thread function
+            # Run the thread function - the model's cached capabilities are invalidated
+            app.model_cache.set('llm:7b', ['completion'])
             DownloadManager.download_thread_fn(download_manager, mock_pool_manager_instance)
+            self.assertIsNone(app.model_cache.get('llm:7b'))
             self.assertDictEqual(app.downloads, {})
             self.assertEqual(download_manager.status, 'success')
             self.assertEqual(download_manager.completed, 1000)
@@ -152,6 +731,35 @@ class TestDownloadManager(unittest.TestCase):
             self.assertFalse(os.path.exists(config_path))
 
 
+    def test_download_fn_progress_interval(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager, \
+             unittest.mock.patch('ollama_chat.app.time.monotonic') as mock_monotonic:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Progress wakes the model list's waiters on status changes and at intervals
+            mock_monotonic.side_effect = [10, 10.5, 11, 11.5]
+            mock_pull_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_pull_response.status = 200
+            mock_pull_response.read_chunked.return_value = [
+                (json.dumps({'status': 'pulling', 'completed': 1000, 'total': 4000}) + '\n').encode('utf-8'),
+                (json.dumps({'status': 'pulling', 'completed': 2000, 'total': 4000}) + '\n').encode('utf-8'),
+                (json.dumps({'status': 'pulling', 'completed': 3000, 'total': 4000}) + '\n').encode('utf-8'),
+                (json.dumps({'status': 'verifying'}) + '\n').encode('utf-8')
+            ]
+            mock_pool_manager.return_value.request.return_value = mock_pull_response
+
+            download_manager = DownloadManager(app, 'llm:7b')
+            app.downloads['llm:7b'] = download_manager
+            DownloadManager.download_thread_fn(download_manager, mock_pool_manager.return_value)
+
+            # The first progress, the interval progress, the status change, and the download end
+            self.assertEqual(app.models_version, 4)
+            self.assertEqual(download_manager.status, 'verifying')
+
+
     def test_download_fn_stop(self):
         with create_test_files([]) as temp_dir, \
              unittest.mock.patch('threading.Thread') as mock_thread, \
@@ -163,7 +771,7 @@ class TestDownloadManager(unittest.TestCase):
             mock_pull_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_pull_response.status = 200
             mock_pull_response.read_chunked.return_value = [
-                json.dumps({'status': 'success', 'completed': 1000, 'total': 2000}).encode('utf-8'),
+                (json.dumps({'status': 'success', 'completed': 1000, 'total': 2000}) + '\n').encode('utf-8'),
             ]
 
             # Configure the mock PoolManager instance
@@ -237,6 +845,60 @@ class TestDownloadManager(unittest.TestCase):
             self.assertFalse(os.path.exists(config_path))
 
 
+    def test_download_async_fn(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('ollama_chat.chat.AsyncEngine.submit') as mock_submit, \
+             unittest.mock.patch('ollama_chat.app.ollama_pull_async') as mock_ollama_pull_async:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, engine='async')
+
+            # The pull is stopped after the first progress chunk
+            async def ollama_pull_async(model, backends):
+                self.assertEqual(model, 'llm:7b')
+                self.assertIs(backends, app.backends)
+                yield {'status': 'pulling', 'completed': 1000, 'total': 2000}
+                download_manager.stop = True
+                yield {'status': 'success', 'completed': 2000, 'total': 2000}
+            mock_ollama_pull_async.side_effect = ollama_pull_async
+
+            # Create the DownloadManager instance
+            download_manager = DownloadManager(app, 'llm:7b')
+            app.downloads['llm:7b'] = download_manager
+            self.assertEqual(mock_submit.call_count, 1)
+
+            # Run the download coroutine
+            asyncio.run(mock_submit.call_args.args[0])
+            self.assertDictEqual(app.downloads, {})
+            self.assertEqual(download_manager.status, 'pulling')
+            self.assertEqual(download_manager.completed, 1000)
+            self.assertEqual(download_manager.total, 2000)
+
+            # Verify the config file
+            self.assertFalse(os.path.exists(config_path))
+
+
+    def test_download_async_fn_ollama_failure(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('ollama_chat.chat.AsyncEngine.submit') as mock_submit, \
+             unittest.mock.patch('ollama_chat.app.ollama_pull_async') as mock_ollama_pull_async:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, engine='async')
+
+            async def ollama_pull_async(unused_model, unused_backends):
+                raise urllib3.exceptions.HTTPError('Unknown model "llm:7b" (500)')
+                yield # pylint: disable=unreachable
+            mock_ollama_pull_async.side_effect = ollama_pull_async
+
+            # Create the DownloadManager instance and run the download coroutine
+            download_manager = DownloadManager(app, 'llm:7b')
+            app.downloads['llm:7b'] = download_manager
+            asyncio.run(mock_submit.call_args.args[0])
+            self.assertDictEqual(app.downloads, {})
+            self.assertEqual(download_manager.status, '')
+            self.assertEqual(download_manager.completed, 0)
+            self.assertEqual(download_manager.total, 0)
+
+
 class TestAPI(unittest.TestCase):
 
     def test_xorigin(self):
@@ -247,8 +909,11 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getConversations')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json'), ('Access-Control-Allow-Origin', '*')])
-            self.assertDictEqual(response, {'conversations': [], 'templates': []})
+            self.assertListEqual(headers, [
+                ('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY),
+                ('Access-Control-Allow-Origin', '*')
+            ])
+            self.assertDictEqual(response, {'conversations': [], 'templates': [], 'version': app.config.list_version})
 
             # Verify the app config
             with app.config() as config:
@@ -269,8 +934,10 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getConversations')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
-            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': []})
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
+            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': [], 'version': app.config.list_version})
 
             # Verify the app config
             expected_config = {'model': 'llm', 'conversations': []}
@@ -282,6 +949,115 @@ class TestAPI(unittest.TestCase):
                 self.assertDictEqual(json.load(config_fh), expected_config)
 
 
+    def test_get_conversations_etag(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'model': 'llm',
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                    {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The response's ETag is the config version
+            status, headers, _ = app.request('GET', '/getConversations')
+            self.assertEqual(status, '200 OK')
+            etag = f'"{app.config.instance_id}-{app.config.list_version}"'
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+
+            # Unchanged - not modified
+            for if_none_match in (etag, f'"other", {etag}'):
+                status, headers, content_bytes = app.request('GET', '/getConversations', environ={'HTTP_IF_NONE_MATCH': if_none_match})
+                self.assertEqual(status, '304 Not Modified')
+                self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+                self.assertEqual(content_bytes, b'')
+
+            # Each conversation list change changes the ETag
+            etags = {etag}
+            for url, request in (
+                ('/moveConversation', {'id': 'conv2', 'down': False}),
+                ('/setModel', {'model': 'llm2'}),
+                ('/createTemplate', {'title': 'Template 1', 'prompts': ['Hello']})
+            ):
+                status, _, _ = app.request('POST', url, wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+                status, headers, _ = app.request('GET', '/getConversations', environ={'HTTP_IF_NONE_MATCH': etag})
+                self.assertEqual(status, '200 OK')
+                etag = dict(headers)['ETag']
+                self.assertNotIn(etag, etags)
+                etags.add(etag)
+
+
+    def test_get_conversations_wait_version(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'model': 'llm',
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                    {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            version = app.config.list_version
+
+            # A different version responds immediately
+            status, _, content_bytes = app.request('GET', '/getConversations', query_string=f'waitVersion={version + 1}')
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(json.loads(content_bytes.decode('utf-8'))['version'], version)
+
+            # An unchanged version responds at the timeout
+            with unittest.mock.patch('ollama_chat.app.WAIT_VERSION_TIMEOUT', 0):
+                status, _, content_bytes = app.request('GET', '/getConversations', query_string=f'waitVersion={version}')
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(json.loads(content_bytes.decode('utf-8'))['version'], version)
+
+            # A conversation list change wakes the waiting request
+            responses = []
+            def wait_request():
+                responses.append(app.request('GET', '/getConversations', query_string=f'waitVersion={version}'))
+            wait_thread = threading.Thread(target=wait_request)
+            wait_thread.start()
+            request = {'id': 'conv2', 'down': False}
+            status, _, _ = app.request('POST', '/moveConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            wait_thread.join()
+            self.assertEqual(len(responses), 1)
+            status, _, content_bytes = responses[0]
+            self.assertEqual(status, '200 OK')
+            response = json.loads(content_bytes.decode('utf-8'))
+            self.assertEqual(response['version'], app.config.list_version)
+            self.assertNotEqual(response['version'], version)
+            self.assertListEqual([conversation['id'] for conversation in response['conversations']], ['conv2', 'conv1'])
+
+
+    def test_get_conversations_wait_version_max_waiters(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('ollama_chat.app.MAX_WAITERS', 1):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            version = app.config.list_version
+
+            # The maximum number of requests are waiting - an unchanged version responds immediately
+            self.assertTrue(app.waiters.acquire(blocking=False))
+            status, _, content_bytes = app.request('GET', '/getConversations', query_string=f'waitVersion={version}')
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(json.loads(content_bytes.decode('utf-8'))['version'], version)
+            app.waiters.release()
+
+            # The waiting request's slot is released
+            with unittest.mock.patch('ollama_chat.app.WAIT_VERSION_TIMEOUT', 0):
+                status, _, content_bytes = app.request('GET', '/getConversations', query_string=f'waitVersion={version}')
+            self.assertEqual(status, '200 OK')
+            self.assertTrue(app.waiters.acquire(blocking=False))
+
+
     def test_get_conversations_no_model(self):
         with create_test_files([]) as temp_dir:
             config_path = os.path.join(temp_dir, 'ollama-chat.json')
@@ -290,8 +1066,10 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getConversations')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
-            self.assertDictEqual(response, {'conversations': [], 'templates': []})
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
+            self.assertDictEqual(response, {'conversations': [], 'templates': [], 'version': app.config.list_version})
 
             # Verify the app config
             with app.config() as config:
@@ -324,6 +1102,53 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), expected_config)
 
 
+    def test_set_model_warm(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({'conversations': [], 'keepAlive': {'llm': '30m'}}))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread') as mock_thread, \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager, \
+             unittest.mock.patch('ollama_chat.app.time.monotonic', return_value=100) as mock_monotonic:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, warm=True)
+
+            # Setting the model starts the model's warm-up thread
+            status, _, _ = app.request('POST', '/setModel', wsgi_input=json.dumps({'model': 'llm'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            mock_thread.assert_called_once_with(target=unittest.mock.ANY, args=(app, 'llm'))
+            mock_thread.return_value.start.assert_called_once_with()
+            self.assertTrue(mock_thread.return_value.daemon)
+
+            # Run the warm-up thread function - the model is loaded with its keep-alive duration
+            mock_load_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_load_response.status = 200
+            mock_pool_manager.return_value.request.return_value = mock_load_response
+            models_version = app.models_version
+            warm_thread_fn = mock_thread.call_args.kwargs['target']
+            warm_thread_fn(app, 'llm')
+            mock_pool_manager.return_value.request.assert_called_once_with(
+                'POST', 'http://127.0.0.1:11434/api/chat', json={'model': 'llm', 'messages': [], 'stream': False, 'keep_alive': '30m'},
+                retries=0
+            )
+            mock_load_response.close.assert_called_once_with()
+            self.assertEqual(app.models_version, models_version + 1)
+
+            # The model is not warmed again until the warm-up interval passes
+            mock_monotonic.return_value = 159
+            app.request('POST', '/setModel', wsgi_input=json.dumps({'model': 'llm'}).encode('utf-8'))
+            self.assertEqual(mock_thread.call_count, 1)
+            mock_monotonic.return_value = 160
+            app.request('POST', '/setModel', wsgi_input=json.dumps({'model': 'llm'}).encode('utf-8'))
+            self.assertEqual(mock_thread.call_count, 2)
+
+            # A failed warm-up does not update the model list's version
+            mock_load_response.status = 404
+            models_version = app.models_version
+            warm_thread_fn(app, 'llm')
+            self.assertEqual(app.models_version, models_version)
+
+
     def test_move_conversation_down(self):
         test_files = [
             ('ollama-chat.json', json.dumps({
@@ -1018,7 +1843,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], ['Hello'])
+            mock_manager.assert_called_once_with(app, response['id'], ['Hello'], 'llm')
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1049,7 +1874,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], ['Hello'])
+            mock_manager.assert_called_once_with(app, response['id'], ['Hello'], 'llm')
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1079,7 +1904,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], [prompt])
+            mock_manager.assert_called_once_with(app, response['id'], [prompt], 'llm')
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1147,7 +1972,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'])
+            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'], 'llm', CHAT_PRIORITY_TEMPLATE)
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1191,7 +2016,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'])
+            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'], 'llm', CHAT_PRIORITY_TEMPLATE)
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1234,7 +2059,7 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertDictEqual(response, {'id': '12345678-1234-5678-1234-567812345678'})
-            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'])
+            mock_manager.assert_called_once_with(app, response['id'], ['Prompt 1'], 'llm', CHAT_PRIORITY_TEMPLATE)
             self.assertIs(app.chats['12345678-1234-5678-1234-567812345678'], mock_manager.return_value)
 
             # Verify the app config
@@ -1500,7 +2325,9 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(
                 response,
                 {
@@ -1509,7 +2336,9 @@ class TestAPI(unittest.TestCase):
                         'model': 'llm',
                         'title': 'Conversation 1',
                         'exchanges': [{'user': 'Hello', 'model': 'Hi there'}],
-                        'generating': False
+                        'generating': False,
+                        'version': 0,
+                        'modelOffset': 8
                     }
                 }
             )
@@ -1544,7 +2373,9 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(
                 response,
                 {
@@ -1553,7 +2384,9 @@ class TestAPI(unittest.TestCase):
                         'model': 'llm',
                         'title': 'Conversation 1',
                         'exchanges': [{'user': 'Hello', 'model': 'Hi there'}],
-                        'generating': True
+                        'generating': True,
+                        'version': 0,
+                        'modelOffset': 8
                     }
                 }
             )
@@ -1567,6 +2400,240 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), original_config)
 
 
+    def test_get_conversation_warm(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                    {'id': 'conv2', 'model': 'other:7b', 'title': 'Conversation 2', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread') as mock_thread:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, warm=True)
+
+            # A generating conversation's model is not warmed
+            app.chats['conv2'] = unittest.mock.Mock()
+            status, _, _ = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv2'}))
+            self.assertEqual(status, '200 OK')
+            mock_thread.assert_not_called()
+
+            # Getting a conversation that's not generating warms its model
+            status, _, _ = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            mock_thread.assert_called_once_with(target=unittest.mock.ANY, args=(app, 'llm'))
+            mock_thread.return_value.start.assert_called_once_with()
+
+
+    def test_get_conversation_delta(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {
+                        'id': 'conv1',
+                        'model': 'llm',
+                        'title': 'Conversation 1',
+                        'exchanges': [
+                            {'user': 'Hello', 'model': 'Hi there'},
+                            {'user': 'Think', 'model': 'OK', 'thinking': 'Hmm'},
+                            {'user': 'Bye', 'model': 'Goodbye'}
+                        ]
+                    }
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            def get_conversation(query):
+                query_string = encode_query_string({'id': 'conv1', **query})
+                status, _, content_bytes = app.request('GET', '/getConversation', query_string=query_string)
+                self.assertEqual(status, '200 OK')
+                return json.loads(content_bytes.decode('utf-8'))['conversation']
+
+            # The delta exchange's response text since the offsets, and the following exchanges
+            conversation = get_conversation({'sinceExchange': 1, 'sinceVersion': 0, 'sinceModelOffset': 1, 'sinceThinkingOffset': 2})
+            self.assertDictEqual(conversation, {
+                'id': 'conv1',
+                'model': 'llm',
+                'title': 'Conversation 1',
+                'exchanges': [{'user': 'Think', 'model': 'K', 'thinking': 'm'}, {'user': 'Bye', 'model': 'Goodbye'}],
+                'generating': False,
+                'version': 0,
+                'modelOffset': 7,
+                'sinceExchange': 1
+            })
+
+            # The offsets default to zero
+            conversation = get_conversation({'sinceExchange': 2, 'sinceVersion': 0})
+            self.assertListEqual(conversation['exchanges'], [{'user': 'Bye', 'model': 'Goodbye'}])
+            self.assertEqual(conversation['sinceExchange'], 2)
+
+            # Out-of-range delta index, offsets, or version - the entire conversation is returned
+            for query in (
+                {'sinceExchange': 3, 'sinceVersion': 0},
+                {'sinceExchange': 2, 'sinceVersion': 0, 'sinceModelOffset': 8},
+                {'sinceExchange': 2, 'sinceVersion': 0, 'sinceThinkingOffset': 1},
+                {'sinceExchange': 2},
+                {'sinceExchange': 2, 'sinceVersion': 1}
+            ):
+                conversation = get_conversation(query)
+                self.assertEqual(len(conversation['exchanges']), 3)
+                self.assertNotIn('sinceExchange', conversation)
+
+            # The most recent exchange is regenerated - a delta since an earlier version returns the entire
+            # conversation
+            with app.config.conversation('conv1') as conversation_:
+                del conversation_['exchanges'][-1]
+                app.config.journal_write({'truncate': {'id': 'conv1', 'index': 2}})
+                conversation_['exchanges'].append({'user': 'Bye', 'model': 'Later'})
+                app.config.update_version('conv1')
+            version = app.config.conversation_versions['conv1']
+            conversation = get_conversation({'sinceExchange': 2, 'sinceVersion': 0, 'sinceModelOffset': 2})
+            self.assertListEqual(conversation['exchanges'][2:], [{'user': 'Bye', 'model': 'Later'}])
+            self.assertNotIn('sinceExchange', conversation)
+
+            # A delta since the regenerated version is valid
+            conversation = get_conversation({'sinceExchange': 2, 'sinceVersion': version, 'sinceModelOffset': 2})
+            self.assertListEqual(conversation['exchanges'], [{'user': 'Bye', 'model': 'ter'}])
+            self.assertEqual(conversation['sinceExchange'], 2)
+
+            # A deleted conversation's exchange version is removed
+            with app.config():
+                app.config.delete_conversation('conv1')
+            self.assertDictEqual(app.config.exchange_versions, {})
+
+
+    def test_get_conversation_unlocked_encode(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {
+                        'id': 'conv1',
+                        'model': 'llm',
+                        'title': 'Conversation 1',
+                        'exchanges': [{'user': 'Hello', 'model': 'Hi there'}, {'user': 'Bye', 'model': 'Good'}]
+                    }
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The response is encoded outside of the conversation lock - response text is published while encoding
+            def json_dumps_published(response, compact=False):
+                conversation_lock = app.config.conversation_locks['conv1']
+                self.assertFalse(conversation_lock.locked())
+                with conversation_lock:
+                    app.config.conversations_by_id['conv1']['exchanges'][-1]['model'] += 'bye'
+                return json_dumps(response, compact=compact)
+
+            def get_exchanges(query):
+                query_string = encode_query_string({'id': 'conv1', **query})
+                status, _, content_bytes = app.request('GET', '/getConversation', query_string=query_string)
+                self.assertEqual(status, '200 OK')
+                return json.loads(content_bytes.decode('utf-8'))['conversation']['exchanges']
+
+            with unittest.mock.patch('ollama_chat.app.json_dumps', side_effect=json_dumps_published):
+                self.assertListEqual(get_exchanges({}), [{'user': 'Hello', 'model': 'Hi there'}, {'user': 'Bye', 'model': 'Good'}])
+                self.assertListEqual(
+                    get_exchanges({'sinceExchange': 0, 'sinceVersion': 0, 'sinceModelOffset': 2}),
+                    [{'user': 'Hello', 'model': ' there'}, {'user': 'Bye', 'model': 'Goodbye'}]
+                )
+            self.assertListEqual(
+                app.config.conversations_by_id['conv1']['exchanges'],
+                [{'user': 'Hello', 'model': 'Hi there'}, {'user': 'Bye', 'model': 'Goodbyebye'}]
+            )
+
+
+    def test_get_conversation_etag(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi there'}]}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            def get_conversation(etag):
+                return app.request('GET', '/getConversation', query_string='id=conv1', environ={'HTTP_IF_NONE_MATCH': etag})
+
+            # The response's ETag is the conversation version
+            status, headers, _ = get_conversation('"other"')
+            self.assertEqual(status, '200 OK')
+            etag = f'"{app.config.instance_id}-0-0"'
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+
+            # Unchanged - not modified
+            status, headers, content_bytes = get_conversation(etag)
+            self.assertEqual(status, '304 Not Modified')
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+            self.assertEqual(content_bytes, b'')
+
+            # Starting a chat changes the conversation version
+            request = {'id': 'conv1', 'user': 'Bye'}
+            status, _, _ = app.request('POST', '/replyConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            status, headers, content_bytes = get_conversation(etag)
+            self.assertEqual(status, '200 OK')
+            etag2 = f'"{app.config.instance_id}-{app.config.conversation_versions["conv1"]}-0"'
+            self.assertNotEqual(etag2, etag)
+            self.assertEqual(dict(headers)['ETag'], etag2)
+            self.assertTrue(json.loads(content_bytes.decode('utf-8'))['conversation']['generating'])
+
+            # Stopping the chat changes the conversation version
+            status, _, _ = app.request('POST', '/stopConversation', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            status, headers, content_bytes = get_conversation(etag2)
+            self.assertEqual(status, '200 OK')
+            self.assertNotEqual(dict(headers)['ETag'], etag2)
+            self.assertFalse(json.loads(content_bytes.decode('utf-8'))['conversation']['generating'])
+
+
+    def test_get_conversation_version(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi there'}]}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            def get_version():
+                status, _, content_bytes = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
+                self.assertEqual(status, '200 OK')
+                return json.loads(content_bytes.decode('utf-8'))['conversation']['version']
+
+            # Each conversation change updates the version
+            version = get_version()
+            self.assertEqual(version, 0)
+            request = {'id': 'conv1', 'title': 'New Title'}
+            status, _, _ = app.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            version2 = get_version()
+            self.assertNotEqual(version2, version)
+            self.assertEqual(get_version(), version2)
+            status, _, _ = app.request('POST', '/deleteConversationExchange', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertNotIn(get_version(), (version, version2))
+
+            # Deleting the conversation deletes its version
+            status, _, _ = app.request('POST', '/deleteConversation', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(app.config.conversation_versions, {})
+
+
     def test_get_conversation_unknown_id(self):
         original_config = {
             'conversations': [
@@ -1596,6 +2663,170 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), original_config)
 
 
+    def test_stream_conversation(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi there'}]}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Not generating - the most recent exchange and done events are sent
+            status, headers, content_bytes = app.request('GET', '/streamConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'text/event-stream')])
+            self.assertEqual(
+                content_bytes,
+                b'event: exchange\ndata: {"index":0,"model":"Hi there","user":"Hello"}\n\n'
+                b'event: done\ndata: {}\n\n'
+            )
+            self.assertDictEqual(app.config.conversation_pins, {})
+
+
+    def test_stream_conversation_generating(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': ''}]}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('ollama_chat.app.time.sleep') as mock_sleep:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            app.chats['conv1'] = unittest.mock.Mock()
+
+            # Simulate the chat between the stream's checks
+            def sleep(unused_seconds):
+                exchanges = app.config.conversations_by_id['conv1']['exchanges']
+                if mock_sleep.call_count == 1:
+                    exchanges[-1]['thinking'] = 'Hmm'
+                elif mock_sleep.call_count == 2:
+                    exchanges[-1]['model'] = 'Hi '
+                elif mock_sleep.call_count == 3:
+                    exchanges[-1]['model'] = 'Hi there'
+                    exchanges.append({'user': 'Bye', 'model': 'B'})
+                else:
+                    exchanges[-1]['model'] = 'Bye bye'
+                    del app.chats['conv1']
+            mock_sleep.side_effect = sleep
+
+            status, _, content_bytes = app.request('GET', '/streamConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(
+                content_bytes,
+                b'event: exchange\ndata: {"index":0,"model":"","user":"Hello"}\n\n'
+                b'event: thinking\ndata: {"index":0,"text":"Hmm"}\n\n'
+                b'event: model\ndata: {"index":0,"text":"Hi "}\n\n'
+                b'event: exchange\ndata: {"index":1,"model":"B","user":"Bye"}\n\n'
+                b'event: model\ndata: {"index":1,"text":"ye bye"}\n\n'
+                b'event: done\ndata: {}\n\n'
+            )
+            self.assertListEqual(mock_sleep.call_args_list, [unittest.mock.call(0.1)] * 4)
+            self.assertDictEqual(app.config.conversation_pins, {})
+
+
+    def test_stream_conversation_deleted(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('ollama_chat.app.time.sleep') as mock_sleep:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            app.chats['conv1'] = unittest.mock.Mock()
+
+            # The conversation is deleted while streaming
+            def sleep(unused_seconds):
+                with app.config():
+                    app.config.delete_conversation('conv1')
+            mock_sleep.side_effect = sleep
+
+            status, _, content_bytes = app.request('GET', '/streamConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(content_bytes, b'event: done\ndata: {}\n\n')
+            self.assertEqual(mock_sleep.call_count, 1)
+            self.assertDictEqual(app.config.conversation_pins, {})
+
+
+    def test_stream_conversation_deleted_before_stream(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The conversation is deleted before the stream starts - its lock is not created
+            start_response = unittest.mock.Mock()
+            environ = chisel.Context.create_environ('GET', '/streamConversation', encode_query_string({'id': 'conv1'}), b'')
+            content = app(environ, start_response)
+            with app.config():
+                app.config.delete_conversation('conv1')
+            self.assertListEqual(list(content), [b'event: done\ndata: {}\n\n'])
+            self.assertDictEqual(app.config.conversation_locks, {})
+            self.assertDictEqual(app.config.conversation_pins, {})
+
+
+    def test_stream_conversation_max_waiters(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': ''}]}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('ollama_chat.app.MAX_WAITERS', 1), \
+             unittest.mock.patch('ollama_chat.app.time.sleep') as mock_sleep:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            app.chats['conv1'] = unittest.mock.Mock()
+
+            # The maximum number of requests are waiting - the stream ends after the connect events
+            self.assertTrue(app.waiters.acquire(blocking=False))
+            status, _, content_bytes = app.request('GET', '/streamConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(content_bytes, b'event: exchange\ndata: {"index":0,"model":"","user":"Hello"}\n\n')
+            mock_sleep.assert_not_called()
+            self.assertDictEqual(app.config.conversation_pins, {})
+            app.waiters.release()
+
+            # The stream holds a waiter slot until it's closed
+            start_response = unittest.mock.Mock()
+            environ = chisel.Context.create_environ('GET', '/streamConversation', encode_query_string({'id': 'conv1'}), b'')
+            content = app(environ, start_response)
+            self.assertEqual(next(content), b'event: exchange\ndata: {"index":0,"model":"","user":"Hello"}\n\n')
+            self.assertFalse(app.waiters.acquire(blocking=False))
+            content.close()
+            self.assertTrue(app.waiters.acquire(blocking=False))
+            self.assertDictEqual(app.config.conversation_pins, {})
+
+
+    def test_stream_conversation_unknown_id(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            status, headers, content_bytes = app.request('GET', '/streamConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '400 Bad Request')
+            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {'error': 'UnknownConversationID'})
+
+
     def test_reply_conversation_success(self):
         original_config = {
             'conversations': [
@@ -1616,7 +2847,7 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(status, '200 OK')
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {})
-            mock_manager.assert_called_once_with(app, 'conv1', ['How are you?'])
+            mock_manager.assert_called_once_with(app, 'conv1', ['How are you?'], 'llm')
             self.assertIs(app.chats['conv1'], mock_manager.return_value)
 
             # Verify the app config
@@ -1792,6 +3023,7 @@ class TestAPI(unittest.TestCase):
         with create_test_files(test_files) as temp_dir:
             config_path = os.path.join(temp_dir, 'ollama-chat.json')
             app = OllamaChat(config_path)
+            app.command_cache.set('conv1', 0, 'Hello', 'Hello', {})
 
             # Delete conversation 'conv1'
             request = {'id': 'conv1'}
@@ -1799,6 +3031,7 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(status, '200 OK')
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {})
+            self.assertIsNone(app.command_cache.get('conv1', 0, 'Hello'))
 
             # Verify the app config
             expected_config = {
@@ -1814,6 +3047,28 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), expected_config)
 
 
+    def test_delete_conversation_refresh_includes(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, refresh_includes=True)
+            self.assertIsNone(app.command_cache)
+
+            # Delete conversation 'conv1'
+            request = {'id': 'conv1'}
+            status, _, content_bytes = app.request('POST', '/deleteConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {})
+            with app.config() as config:
+                self.assertDictEqual(config, {'conversations': []})
+
+
     def test_delete_conversation_unknown_id(self):
         with create_test_files([]) as temp_dir:
             config_path = os.path.join(temp_dir, 'ollama-chat.json')
@@ -2151,7 +3406,7 @@ class TestAPI(unittest.TestCase):
             self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {})
 
             # Check that ChatManager was called with the last user prompt
-            mock_manager.assert_called_once_with(app, 'conv1', ['How are you?'])
+            mock_manager.assert_called_once_with(app, 'conv1', ['How are you?'], 'llm')
             self.assertIs(app.chats['conv1'], mock_manager.return_value)
 
             # Verify the app config
@@ -2293,6 +3548,7 @@ class TestAPI(unittest.TestCase):
                 'models': [
                     {
                         'model': 'llm:7b',
+                        'digest': 'sha256:7b',
                         'details': {'parameter_size': '7B'},
                         'size': 4100000000,
                         'modified_at': '2023-10-01T12:00:00+00:00'
@@ -2326,12 +3582,16 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response, [
+                {'model': 'llm:7b', 'expires_at': '2023-10-05T12:00:00+00:00'}
+            ])
 
             status, headers, content_bytes = app.request('GET', '/getModels')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {
@@ -2342,15 +3602,24 @@ class TestAPI(unittest.TestCase):
                         'id': 'big:756b', 'name': 'big', 'parameters': 756000000000, 'size': 4000000000,
                         'modified': '2023-10-03T12:00:00+00:00'
                     },
-                    {'id': 'llm:7b', 'name': 'llm', 'parameters': 7000000000, 'size': 4100000000, 'modified': '2023-10-01T12:00:00+00:00'},
+                    {
+                        'id': 'llm:7b', 'name': 'llm', 'parameters': 7000000000, 'size': 4100000000,
+                        'modified': '2023-10-01T12:00:00+00:00', 'loadedUntil': '2023-10-05T12:00:00+00:00'
+                    },
                     {'id': 'other2:tag', 'modified': '2023-10-02T12:00:00+00:00', 'name': 'other2', 'parameters': 3000, 'size': 1800},
                     {'id': 'other:tag', 'name': 'other', 'parameters': 3000000, 'size': 1800000, 'modified': '2023-10-02T12:00:00+00:00'}
                 ],
                 'downloading': [],
-                'model': 'llm'
+                'model': 'llm',
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
 
+            # Verify the model cache's digests were updated
+            self.assertDictEqual(app.model_cache.digests, {
+                'llm:7b': 'sha256:7b', 'other:tag': None, 'other2:tag': None, 'big:1t': None, 'big:756b': None
+            })
+
             # Verify the app config
             with app.config() as config:
                 self.assertDictEqual(config, original_config)
@@ -2360,6 +3629,34 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), original_config)
 
 
+    def test_get_models_json_codec(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager, \
+             unittest.mock.patch('ollama_chat.codec.orjson', None), \
+             unittest.mock.patch('ollama_chat.codec.ujson', None):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Mock the list request
+            mock_list_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_list_response.status = 200
+            model = {'model': 'llm:7b', 'details': {'parameter_size': '7B'}, 'size': 4100000000, 'modified_at': '2023-10-01T12:00:00+00:00'}
+            mock_list_response.json.return_value = {'models': [model]}
+            mock_pool_manager.return_value.request.side_effect = mock_models_request(mock_list_response, [
+                {'model': 'llm:7b', 'expires_at': '2023-10-05T12:00:00+00:00'}
+            ])
+
+            # The response's datetimes are encoded without orjson
+            status, _, content_bytes = app.request('GET', '/getModels')
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(json.loads(content_bytes.decode('utf-8'))['models'], [
+                {
+                    'id': 'llm:7b', 'name': 'llm', 'parameters': 7000000000, 'size': 4100000000,
+                    'modified': '2023-10-01T12:00:00+00:00', 'loadedUntil': '2023-10-05T12:00:00+00:00'
+                }
+            ])
+
+
     def test_get_models_no_tag(self):
         original_config = {'conversations': []}
         test_files = [
@@ -2386,12 +3683,14 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             status, headers, content_bytes = app.request('GET', '/getModels')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {
@@ -2402,7 +3701,8 @@ class TestAPI(unittest.TestCase):
                         'modified': '2023-10-01T12:00:00+00:00'
                     }
                 ],
-                'downloading': []
+                'downloading': [],
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
 
@@ -2433,19 +3733,22 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             environ = {'wsgi.errors': StringIO()}
             status, headers, content_bytes = app.request('GET', '/getModels', environ=environ)
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {'id': 'llm:7b', 'name': 'llm', 'parameters': 0, 'size': 1000, 'modified': '2023-10-01T12:00:00+00:00'}
                 ],
                 'downloading': [],
-                'model': 'llm'
+                'model': 'llm',
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
             logs = environ['wsgi.errors'].getvalue()
@@ -2487,19 +3790,22 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             environ = {'wsgi.errors': StringIO()}
             status, headers, content_bytes = app.request('GET', '/getModels', environ=environ)
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {'id': 'llm:7b', 'name': 'llm', 'parameters': 0, 'size': 1000, 'modified': '2023-10-01T12:00:00+00:00'}
                 ],
                 'downloading': [],
-                'model': 'llm'
+                'model': 'llm',
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
             logs = environ['wsgi.errors'].getvalue()
@@ -2541,19 +3847,22 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             environ = {'wsgi.errors': StringIO()}
             status, headers, content_bytes = app.request('GET', '/getModels', environ=environ)
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {'id': 'llm:7b', 'name': 'llm', 'parameters': 0, 'size': 1000, 'modified': '2023-10-01T12:00:00+00:00'}
                 ],
                 'downloading': [],
-                'model': 'llm'
+                'model': 'llm',
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
             # An empty parameter size (MLX models) is a known case - no warning is logged
@@ -2569,6 +3878,70 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), original_config)
 
 
+    def test_get_models_etag(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Mock the list request
+            mock_list_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_list_response.status = 200
+            model = {'model': 'llm:7b', 'details': {'parameter_size': '7B'}, 'size': 4100000000, 'modified_at': '2023-10-01T12:00:00+00:00'}
+            mock_list_response.json.return_value = {'models': [model]}
+            mock_pool_manager.return_value.request.side_effect = mock_models_request(mock_list_response)
+
+            # The response's ETag is the models version
+            status, headers, _ = app.request('GET', '/getModels')
+            self.assertEqual(status, '200 OK')
+            etag = f'"{app.config.instance_id}-1"'
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+
+            # Unchanged - not modified
+            status, headers, content_bytes = app.request('GET', '/getModels', environ={'HTTP_IF_NONE_MATCH': etag})
+            self.assertEqual(status, '304 Not Modified')
+            self.assertListEqual(headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', etag)])
+            self.assertEqual(content_bytes, b'')
+
+            # A changed model list changes the models version
+            mock_list_response.json.return_value = {'models': [model, {**model, 'model': 'llm:13b'}]}
+            status, headers, content_bytes = app.request('GET', '/getModels', environ={'HTTP_IF_NONE_MATCH': etag})
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(dict(headers)['ETag'], f'"{app.config.instance_id}-2"')
+            self.assertListEqual([model['id'] for model in json.loads(content_bytes.decode('utf-8'))['models']], ['llm:13b', 'llm:7b'])
+
+
+    def test_get_models_wait_version(self):
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # Mock the list request
+            mock_list_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_list_response.status = 200
+            mock_list_response.json.return_value = {'models': []}
+            mock_pool_manager.return_value.request.side_effect = mock_models_request(mock_list_response)
+
+            # A different version responds immediately
+            status, _, content_bytes = app.request('GET', '/getModels', query_string='waitVersion=5')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {'models': [], 'downloading': [], 'version': 1})
+
+            # An unchanged version responds at the timeout
+            with unittest.mock.patch('ollama_chat.app.WAIT_VERSION_TIMEOUT', 0):
+                status, _, content_bytes = app.request('GET', '/getModels', query_string='waitVersion=1')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {'models': [], 'downloading': [], 'version': 1})
+
+            # The maximum number of requests are waiting - an unchanged version responds immediately
+            for _ in range(MAX_WAITERS):
+                self.assertTrue(app.waiters.acquire(blocking=False))
+            status, _, content_bytes = app.request('GET', '/getModels', query_string='waitVersion=1')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {'models': [], 'downloading': [], 'version': 1})
+
+
     def test_get_models_no_models(self):
         original_config = {'model': 'llm', 'conversations': []}
         test_files = [
@@ -2588,13 +3961,15 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             status, headers, content_bytes = app.request('GET', '/getModels')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
-            self.assertDictEqual(response, {'models': [], 'downloading': [], 'model': 'llm'})
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
+            self.assertDictEqual(response, {'models': [], 'downloading': [], 'model': 'llm', 'version': app.models_version})
             mock_list_response.close.assert_called_once_with()
 
             # Verify the app config
@@ -2623,7 +3998,7 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             # Add downloading models
             mock_download = unittest.mock.Mock()
@@ -2640,14 +4015,17 @@ class TestAPI(unittest.TestCase):
             status, headers, content_bytes = app.request('GET', '/getModels')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [],
                 'downloading': [
                     {'id': 'downloading_model', 'status': 'downloading', 'completed': 5000000, 'size': 10000000},
                     {'id': 'downloading_model2', 'status': 'unknown', 'completed': 0}
                 ],
-                'model': 'llm'
+                'model': 'llm',
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
 
@@ -2716,17 +4094,20 @@ class TestAPI(unittest.TestCase):
 
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
-            mock_pool_manager_instance.request.return_value = mock_list_response
+            mock_pool_manager_instance.request.side_effect = mock_models_request(mock_list_response)
 
             status, headers, content_bytes = app.request('GET', '/getModels')
             response = json.loads(content_bytes.decode('utf-8'))
             self.assertEqual(status, '200 OK')
-            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertListEqual(
+                headers, [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)]
+            )
             self.assertDictEqual(response, {
                 'models': [
                     {'id': 'llm:7b', 'name': 'llm', 'parameters': 7000000000, 'size': 4100000000, 'modified': '2023-10-01T12:00:00+00:00'}
                 ],
-                'downloading': []
+                'downloading': [],
+                'version': app.models_version
             })
             mock_list_response.close.assert_called_once_with()
 
@@ -2747,6 +4128,7 @@ class TestAPI(unittest.TestCase):
              unittest.mock.patch('ollama_chat.app.DownloadManager') as mock_download_manager:
             config_path = os.path.join(temp_dir, 'ollama-chat.json')
             app = OllamaChat(config_path)
+            app.model_cache.set('llm:7b', ['completion'])
 
             # Initiate model download
             request = {'model': 'llm:7b'}
@@ -2756,6 +4138,9 @@ class TestAPI(unittest.TestCase):
             self.assertListEqual(headers, [('Content-Type', 'application/json')])
             self.assertDictEqual(response, {})
 
+            # Verify the model's cached capabilities were invalidated
+            self.assertIsNone(app.model_cache.get('llm:7b'))
+
             # Verify DownloadManager was called and stored
             mock_download_manager.assert_called_once_with(app, 'llm:7b')
             self.assertIn('llm:7b', app.downloads)
@@ -2876,6 +4261,7 @@ class TestAPI(unittest.TestCase):
             # Configure the mock PoolManager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
             mock_pool_manager_instance.request.return_value = mock_delete_response
+            app.model_cache.set('llm:7b', ['completion'])
 
             # Delete model 'llm:7b'
             request = {'model': 'llm:7b'}
@@ -2887,6 +4273,7 @@ class TestAPI(unittest.TestCase):
                 'DELETE', 'http://127.0.0.1:11434/api/delete', json={'model': 'llm:7b'}, retries=0
             )
             mock_delete_response.close.assert_called_once_with()
+            self.assertIsNone(app.model_cache.get('llm:7b'))
 
             # Verify the app config
             with app.config() as config:
@@ -2935,6 +4322,29 @@ class TestAPI(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), original_config)
 
 
+    def test_get_stats(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, pool_size=8, url_pool_size=2)
+            app.pool_stats.add_connection()
+            app.pool_stats.add_request()
+            app.pool_stats.add_request()
+            app.url_pool_stats.add_request()
+            app.load_stats.add_chat(2500000000)
+            app.load_stats.add_chat(50000000)
+
+            # The JSON storage does not archive conversations
+            status, headers, content_bytes = app.request('GET', '/getStats')
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(headers, [('Content-Type', 'application/json')])
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {
+                'backends': [{'host': 'http://127.0.0.1:11434', 'outstanding': 0, 'down': False, 'loaded': []}],
+                'loads': {'chats': 2, 'coldStarts': 1, 'loadSeconds': 2.5},
+                'ollamaPool': {'maxsize': 8, 'requests': 2, 'connections': 1, 'reused': 1},
+                'urlPool': {'maxsize': 2, 'requests': 1, 'connections': 0, 'reused': 1}
+            })
+
+
     def test_get_system_info(self):
         with create_test_files([]) as temp_dir:
             config_path = os.path.join(temp_dir, 'ollama-chat.json')
@@ -1,23 +1,35 @@
 # Licensed under the MIT License
 # https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
 
+import asyncio
 import base64
+import concurrent.futures
+import itertools
 import json
 import os
 import pathlib
+import threading
 import unittest
 import unittest.mock
 
 import urllib3
 
 from ollama_chat.app import OllamaChat
-from ollama_chat.chat import _escape_markdown_text, _process_commands, config_template_prompts, ChatManager
+import ollama_chat.chat
+from ollama_chat.chat import \
+    _escape_markdown_text, _process_commands, config_template_prompts, _ChatStream, AsyncEngine, ChatManager, ChatScheduler, \
+    CommandCache
 
 from .util import create_test_files
 
 
 class TestChatManager(unittest.TestCase):
 
+    # Run a chat with the chat engine under test
+    def run_chat(self, chat_manager):
+        ChatManager.chat_thread_fn(chat_manager)
+
+
     def test_chat_fn(self):
         test_files = [
             ('ollama-chat.json', json.dumps({
@@ -39,27 +51,22 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Hi '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'there!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Hi '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'there!'}}) + '\n').encode('utf-8')
             ]
 
-            # Create a mock show response
-            mock_show_response2 = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
-            mock_show_response2.status = 200
-            mock_show_response2.json.return_value = {'capabilities': []}
-
             # Create a second mock chat response
             mock_chat_response2 = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response2.status = 200
             mock_chat_response2.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Bye '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'bye!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Bye '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'bye!'}}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock pool manager instance
             mock_pool_manager_instance = mock_pool_manager.return_value
             mock_pool_manager_instance.request.side_effect = [
-                mock_show_response, mock_chat_response, mock_show_response2, mock_chat_response2
+                mock_show_response, mock_chat_response, mock_chat_response2
             ]
 
             # Create the ChatManager instance
@@ -73,11 +80,11 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
 
             # Verify the ollama.chat calls
-            self.assertEqual(mock_pool_manager_instance.request.call_count, 4)
+            self.assertEqual(mock_pool_manager_instance.request.call_count, 3)
             self.assertListEqual(
                 mock_pool_manager_instance.request.call_args_list,
                 [
@@ -96,7 +103,6 @@ class TestChatManager(unittest.TestCase):
                         preload_content=False,
                         retries=0
                     ),
-                    unittest.mock.call('POST', 'http://127.0.0.1:11434/api/show', json={'model': 'llm'}, retries=0),
                     unittest.mock.call(
                         'POST',
                         'http://127.0.0.1:11434/api/chat',
@@ -117,7 +123,6 @@ class TestChatManager(unittest.TestCase):
             )
             mock_show_response.close.assert_called_once_with()
             mock_chat_response.close.assert_called_once_with()
-            mock_show_response2.close.assert_called_once_with()
             mock_chat_response2.close.assert_called_once_with()
 
             # Verify the app config
@@ -169,29 +174,24 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'thinking': 'Hmmm '}}).encode('utf-8'),
-                json.dumps({'message': {'thinking': 'Haw'}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'Hi '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'there!'}}).encode('utf-8')
+                (json.dumps({'message': {'thinking': 'Hmmm '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'thinking': 'Haw'}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'Hi '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'there!'}}) + '\n').encode('utf-8')
             ]
 
-            # Create a second mock show response
-            mock_show_response2 = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
-            mock_show_response2.status = 200
-            mock_show_response2.json.return_value = {'capabilities': ['thinking']}
-
             # Create a second mock chat response
             mock_chat_response2 = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response2.status = 200
             mock_chat_response2.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Bye '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'bye!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Bye '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'bye!'}}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock session instance
             mock_pool_manager_instance = mock_pool_manager.return_value
             mock_pool_manager_instance.request.side_effect = [
-                mock_show_response, mock_chat_response, mock_show_response2, mock_chat_response2
+                mock_show_response, mock_chat_response, mock_chat_response2
             ]
 
             # Create the ChatManager instance
@@ -205,7 +205,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
 
             # Verify the ollama.chat calls
@@ -227,7 +227,6 @@ class TestChatManager(unittest.TestCase):
                         preload_content=False,
                         retries=0
                     ),
-                    unittest.mock.call('POST', 'http://127.0.0.1:11434/api/show', json={'model': 'llm'}, retries=0),
                     unittest.mock.call(
                         'POST',
                         'http://127.0.0.1:11434/api/chat',
@@ -248,7 +247,6 @@ class TestChatManager(unittest.TestCase):
             )
             mock_show_response.close.assert_called_once_with()
             mock_chat_response.close.assert_called_once_with()
-            mock_show_response2.close.assert_called_once_with()
             mock_chat_response2.close.assert_called_once_with()
 
             # Verify the app config
@@ -324,7 +322,7 @@ class TestChatManager(unittest.TestCase):
             app = OllamaChat(config_path)
             chat_manager = ChatManager(app, 'conv1', ['Hello'])
             app.chats['conv1'] = chat_manager
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
             mock_chat_response.close.assert_called_once_with()
 
@@ -349,6 +347,65 @@ class TestChatManager(unittest.TestCase):
                 self.assertDictEqual(config, expected_config)
 
 
+    def test_chat_fn_keep_alive(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ],
+                'keepAlive': {'llm:latest': '30m'}
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager:
+
+            # Create a mock show response
+            mock_show_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_show_response.status = 200
+            mock_show_response.json.return_value = {'capabilities': []}
+
+            # Create a mock chat response - the final chunk has the model load duration
+            mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+            mock_chat_response.status = 200
+            mock_chat_response.read_chunked.return_value = [
+                (json.dumps({'message': {'content': 'Hi'}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': ''}, 'done': True, 'load_duration': 3000000000}) + '\n').encode('utf-8')
+            ]
+
+            # Configure the mock pool manager instance
+            mock_pool_manager_instance = mock_pool_manager.return_value
+            mock_pool_manager_instance.request.side_effect = [mock_show_response, mock_chat_response]
+
+            # Create and run the ChatManager
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            chat_manager = ChatManager(app, 'conv1', ['Hello'])
+            app.chats['conv1'] = chat_manager
+            self.run_chat(chat_manager)
+            self.assertDictEqual(app.chats, {})
+
+            # The model's keep-alive duration is sent with the chat
+            self.assertEqual(mock_pool_manager_instance.request.call_args_list[1], unittest.mock.call(
+                'POST',
+                'http://127.0.0.1:11434/api/chat',
+                json={
+                    'model': 'llm',
+                    'messages': [{'role': 'user', 'content': 'Hello', 'images': None}],
+                    'stream': True,
+                    'think': False,
+                    'keep_alive': '30m'
+                },
+                preload_content=False,
+                retries=0
+            ))
+
+            # The chat waited for its model to load
+            self.assertDictEqual(app.load_stats.stats(), {'chats': 1, 'coldStarts': 1, 'loadSeconds': 3})
+            with app.config() as config:
+                self.assertListEqual(config['conversations'][0]['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+
+
     def test_chat_fn_truncated_stream(self):
         test_files = [
             ('ollama-chat.json', json.dumps({
@@ -371,7 +428,7 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Hi '}}).encode('utf-8') + b'\n',
+                (json.dumps({'message': {'content': 'Hi '}}) + '\n').encode('utf-8') + b'\n',
                 truncated
             ]
 
@@ -384,7 +441,7 @@ class TestChatManager(unittest.TestCase):
             app = OllamaChat(config_path)
             chat_manager = ChatManager(app, 'conv1', ['Hello'])
             app.chats['conv1'] = chat_manager
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
             mock_chat_response.close.assert_called_once_with()
 
@@ -439,7 +496,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
 
             # Verify the ollama.chat calls
@@ -512,7 +569,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
 
             # Verify the ollama.chat calls
@@ -583,7 +640,7 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'error': 'BOOM!'}).encode('utf-8')
+                (json.dumps({'error': 'BOOM!'}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock pool manager instance
@@ -601,7 +658,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
 
             # Verify the ollama.chat calls
@@ -651,6 +708,129 @@ class TestChatManager(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), expected_config)
 
 
+    def test_chat_fn_journal(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('ollama_chat.chat.time.monotonic', side_effect=itertools.count(0, 0.6)), \
+             unittest.mock.patch('ollama_chat.chat.ollama_chat') as mock_ollama_chat:
+            mock_ollama_chat.return_value = [
+                {'message': {'role': 'assistant', 'content': '', 'thinking': 'Hmm'}},
+                {'message': {'role': 'assistant', 'content': 'Hi '}},
+                {'message': {'role': 'assistant', 'content': 'there!'}}
+            ]
+
+            # Run the chat - the config save is deferred
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            journal_path = os.path.join(temp_dir, 'ollama-chat.journal')
+            app = OllamaChat(config_path, save_delay=60, journal=True)
+            chat_manager = ChatManager(app, 'conv1', ['Hello'])
+            app.chats['conv1'] = chat_manager
+            self.run_chat(chat_manager)
+
+            # The response text is journaled at intervals
+            with open(journal_path, 'r', encoding='utf-8') as fh_journal:
+                self.assertListEqual([json.loads(line) for line in fh_journal], [
+                    {'exchange': {'id': 'conv1', 'index': 0, 'user': 'Hello'}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'thinking', 'offset': 0, 'text': 'Hmm'}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 0, 'text': 'Hi '}},
+                    {'text': {'id': 'conv1', 'index': 0, 'field': 'model', 'offset': 3, 'text': 'there!'}}
+                ])
+
+            # The journal is replayed on startup
+            app2 = OllamaChat(config_path, journal=True)
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [
+                            {'user': 'Hello', 'model': 'Hi there!', 'thinking': 'Hmm'}
+                        ]}
+                    ]
+                })
+            self.assertFalse(os.path.exists(journal_path))
+
+
+    def test_chat_fn_command_cache(self):
+        for refresh_includes in (False, True):
+            test_files = [
+                ('ollama-chat.json', json.dumps({
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+                    ]
+                })),
+                ('notes.txt', 'Version 1')
+            ]
+            with create_test_files(test_files) as temp_dir, \
+                 unittest.mock.patch('threading.Thread'), \
+                 unittest.mock.patch('ollama_chat.chat.ollama_chat') as mock_ollama_chat:
+                mock_ollama_chat.side_effect = lambda *unused_args: iter([{'message': {'content': 'OK'}}])
+                config_path = os.path.join(temp_dir, 'ollama-chat.json')
+                notes_path = os.path.join(temp_dir, 'notes.txt')
+                app = OllamaChat(config_path, refresh_includes=refresh_includes)
+
+                # Run the first chat
+                chat_manager = ChatManager(app, 'conv1', [f'/file {pathlib.Path(notes_path).as_posix()}'])
+                self.run_chat(chat_manager)
+
+                # Update the file and run the second chat - the cached file content is used, unless refreshing
+                with open(notes_path, 'w', encoding='utf-8') as fh_notes:
+                    fh_notes.write('Version 2')
+                chat_manager = ChatManager(app, 'conv1', ['Summarize'])
+                self.run_chat(chat_manager)
+                self.assertEqual(mock_ollama_chat.call_count, 2)
+                self.assertIn('Version 1', mock_ollama_chat.call_args_list[0].args[2][2]['content'])
+                self.assertIn(
+                    'Version 2' if refresh_includes else 'Version 1',
+                    mock_ollama_chat.call_args_list[1].args[2][2]['content']
+                )
+                self.assertEqual(mock_ollama_chat.call_args_list[1].args[2][4], {'role': 'user', 'content': 'Summarize', 'images': None})
+
+
+    def test_chat_fn_stream_buffer(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('ollama_chat.chat.time.monotonic', return_value=0), \
+             unittest.mock.patch('ollama_chat.chat.STREAM_PUBLISH_CHUNKS', 2), \
+             unittest.mock.patch('ollama_chat.chat.ollama_chat') as mock_ollama_chat:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The response stream records the published response text after each chunk
+            published = []
+            def ollama_chat(unused_pool_manager, unused_model, unused_messages, unused_model_cache, unused_backends, unused_keep_alive):
+                for content in ('A', 'B', 'C', 'D', 'E'):
+                    yield {'message': {'role': 'assistant', 'content': content}}
+                    published.append(app.config.conversations_by_id['conv1']['exchanges'][-1]['model'])
+            mock_ollama_chat.side_effect = ollama_chat
+
+            # Run the chat - the response text is published every two chunks
+            chat_manager = ChatManager(app, 'conv1', ['Hello'])
+            app.chats['conv1'] = chat_manager
+            self.run_chat(chat_manager)
+            self.assertListEqual(published, ['', 'AB', 'AB', 'ABCD', 'ABCD'])
+            with app.config() as config:
+                self.assertDictEqual(config, {
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [
+                            {'user': 'Hello', 'model': 'ABCDE'}
+                        ]}
+                    ]
+                })
+
+
     def test_chat_fn_stop(self):
         test_files = [
             ('ollama-chat.json', json.dumps({
@@ -672,8 +852,8 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Hi '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'there!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Hi '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'there!'}}) + '\n').encode('utf-8')
             ]
 
             # Create a second mock show response
@@ -685,8 +865,8 @@ class TestChatManager(unittest.TestCase):
             mock_chat_response2 = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response2.status = 200
             mock_chat_response2.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Bye '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'bye!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Bye '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'bye!'}}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock session instance
@@ -706,7 +886,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
             mock_show_response.close.assert_called_once_with()
             mock_chat_response.close.assert_called_once_with()
@@ -727,6 +907,38 @@ class TestChatManager(unittest.TestCase):
                 self.assertEqual(json.load(config_fh), expected_config)
 
 
+    def test_chat_fn_commands_unlocked(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('urllib3.PoolManager') as mock_pool_manager:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            chat_manager = ChatManager(app, 'conv1', ['/?'])
+            app.chats['conv1'] = chat_manager
+            with app.config():
+                conversation_lock = app.config.conversation_lock('conv1')
+
+            # The prompt commands are processed without holding the conversation lock - the chat is stopped
+            # while they're processed, so the conversation is not updated
+            def process_commands(chat, unused_prompt, flags):
+                self.assertFalse(conversation_lock.locked())
+                chat.stop = True
+                flags['help'] = 'usage: /'
+                return 'Displaying top-level help'
+            with unittest.mock.patch('ollama_chat.chat._process_commands', side_effect=process_commands):
+                self.run_chat(chat_manager)
+            mock_pool_manager.return_value.request.assert_not_called()
+            with app.config() as config:
+                self.assertListEqual(config['conversations'][0]['exchanges'], [{'user': '/?', 'model': ''}])
+
+
     def test_chat_fn_help(self):
         test_files = [
             ('ollama-chat.json', json.dumps({
@@ -753,7 +965,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             mock_pool_manager_instance.request.assert_not_called()
             self.assertDictEqual(app.chats, {})
 
@@ -806,7 +1018,7 @@ class TestChatManager(unittest.TestCase):
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             mock_pool_manager_instance.request.assert_not_called()
             self.assertDictEqual(app.chats, {})
 
@@ -868,8 +1080,8 @@ file content
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Bye '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'bye!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Bye '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'bye!'}}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock session instance
@@ -887,7 +1099,7 @@ file content
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
             mock_show_response.close.assert_called_once_with()
             mock_chat_response.close.assert_called_once_with()
@@ -947,8 +1159,8 @@ file content
             mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
             mock_chat_response.status = 200
             mock_chat_response.read_chunked.return_value = [
-                json.dumps({'message': {'content': 'Bye '}}).encode('utf-8'),
-                json.dumps({'message': {'content': 'bye!'}}).encode('utf-8')
+                (json.dumps({'message': {'content': 'Bye '}}) + '\n').encode('utf-8'),
+                (json.dumps({'message': {'content': 'bye!'}}) + '\n').encode('utf-8')
             ]
 
             # Configure the mock session instance
@@ -966,7 +1178,7 @@ file content
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             self.assertDictEqual(app.chats, {})
             mock_show_response.close.assert_called_once_with()
             mock_chat_response.close.assert_called_once_with()
@@ -1028,7 +1240,7 @@ file content
             self.assertTrue(mock_thread.return_value.daemon)
 
             # Run the thread function
-            ChatManager.chat_thread_fn(chat_manager)
+            self.run_chat(chat_manager)
             mock_pool_manager_instance.request.assert_not_called()
             self.assertDictEqual(app.chats, {})
 
@@ -1056,6 +1268,346 @@ file content
                 self.assertEqual(json.load(config_fh), expected_config)
 
 
+# Run the chat manager tests with the asynchronous chat engine - the mocked Ollama chat API is called by
+# the asynchronous Ollama chat API, and worker thread functions are run synchronously (the tests mock
+# threading.Thread)
+class TestChatManagerAsync(TestChatManager):
+
+    def run_chat(self, chat_manager):
+        async def ollama_chat_async(model, messages, model_cache, backends, keep_alive):
+            for chunk in ollama_chat.chat.ollama_chat(chat_manager.app.pool_manager, model, messages, model_cache, backends, keep_alive):
+                yield chunk
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.set_default_executor(SynchronousExecutor())
+            with unittest.mock.patch('ollama_chat.chat.ollama_chat_async', ollama_chat_async):
+                loop.run_until_complete(ChatManager.chat_async_fn(chat_manager))
+        finally:
+            loop.close()
+
+
+    def test_chat_manager_engine(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread') as mock_thread, \
+             unittest.mock.patch('ollama_chat.chat.AsyncEngine.submit') as mock_submit:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, engine='async')
+            self.assertIsInstance(app.engine, AsyncEngine)
+
+            # The chat coroutine is submitted to the engine - no chat thread is started
+            chat_manager = ChatManager(app, 'conv1', ['Hello'])
+            mock_thread.assert_not_called()
+            self.assertEqual(mock_submit.call_count, 1)
+            chat_coroutine = mock_submit.call_args.args[0]
+            self.assertEqual(chat_coroutine.cr_code, ChatManager.chat_async_fn.__code__)
+            chat_coroutine.close()
+            self.assertListEqual(chat_manager.prompts, ['Hello'])
+
+
+    def test_chat_stream_locked(self):
+        conversation = {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': ''}]}
+        with create_test_files([]) as temp_dir, \
+             unittest.mock.patch('ollama_chat.chat.STREAM_PUBLISH_CHUNKS', 1):
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+            chat_manager = unittest.mock.Mock(app=app, conversation_id='conv1', stop=False)
+            conversation_lock = threading.Lock()
+            stream = _ChatStream(chat_manager, conversation, conversation_lock)
+            stream.start()
+
+            # The conversation lock is held (e.g. by a config save), so the response text remains buffered
+            with conversation_lock:
+                stream.add({'message': {'content': 'Hi'}}, blocking=False)
+            self.assertEqual(conversation['exchanges'][-1]['model'], '')
+            self.assertListEqual(stream.buffer['model'], ['Hi'])
+
+            # The buffered response text is published with the next chunk
+            stream.add({'message': {'content': ' there'}}, blocking=False)
+            self.assertEqual(conversation['exchanges'][-1]['model'], 'Hi there')
+            self.assertListEqual(stream.buffer['model'], [])
+
+
+    def test_chat_stream_stopped(self):
+        conversation = {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': ''}]}
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, journal=True)
+            chat_manager = unittest.mock.Mock(app=app, conversation_id='conv1', stop=False)
+            stream = _ChatStream(chat_manager, conversation, threading.Lock())
+            stream.start()
+            stream.add({'message': {'content': 'Hi'}})
+            self.assertListEqual(stream.buffer['model'], ['Hi'])
+
+            # The chat is stopped and its exchange deleted - the buffered response text is discarded
+            chat_manager.stop = True
+            conversation['exchanges'].clear()
+            stream.finish()
+            stream.error(Exception('BOOM'))
+            self.assertListEqual(conversation['exchanges'], [])
+            self.assertListEqual(stream.buffer['model'], [])
+
+            # A new exchange is not modified
+            conversation['exchanges'].append({'user': 'Goodbye', 'model': ''})
+            stream.add({'message': {'content': 'Bye'}})
+            stream.finish()
+            self.assertListEqual(conversation['exchanges'], [{'user': 'Goodbye', 'model': ''}])
+            self.assertListEqual(stream.buffer['model'], [])
+            self.assertListEqual(app.config.journal.read(), [])
+
+
+class TestCommandCache(unittest.TestCase):
+
+    def test_command_cache(self):
+        command_cache = CommandCache(max_conversations=2)
+        self.assertIsNone(command_cache.get('conv1', 0, '/image a.png'))
+
+        # Cache an exchange - the cached flags are copies
+        flags = {'images': ['aW1hZ2U=']}
+        command_cache.set('conv1', 0, '/image a.png', '', flags)
+        flags['show'] = True
+        self.assertEqual(command_cache.get('conv1', 0, '/image a.png'), ('', {'images': ['aW1hZ2U=']}))
+        self.assertIsNone(command_cache.get('conv1', 1, '/image a.png'))
+
+        # A changed prompt is not cached
+        self.assertIsNone(command_cache.get('conv1', 0, '/image b.png'))
+
+        # The least-recently-used conversation is evicted
+        command_cache.set('conv2', 0, 'Hello', 'Hello', {})
+        self.assertIsNotNone(command_cache.get('conv1', 0, '/image a.png'))
+        command_cache.set('conv3', 0, 'Hello', 'Hello', {})
+        self.assertListEqual(list(command_cache.conversations), ['conv1', 'conv3'])
+
+        # Delete a conversation
+        command_cache.delete('conv1')
+        command_cache.delete('conv4')
+        self.assertListEqual(list(command_cache.conversations), ['conv3'])
+
+
+class TestAsyncEngine(unittest.TestCase):
+
+    def test_submit(self):
+        async def coroutine_fn(value):
+            return value * 2
+
+        with unittest.mock.patch('threading.Thread') as mock_thread:
+            engine = AsyncEngine()
+            self.assertIsNone(engine.loop)
+
+            # The event loop thread is started with the first coroutine
+            future = engine.submit(coroutine_fn(1))
+            future2 = engine.submit(coroutine_fn(2))
+            mock_thread.assert_called_once_with(target=engine.loop.run_forever)
+            self.assertTrue(mock_thread.return_value.daemon)
+            mock_thread.return_value.start.assert_called_once_with()
+
+            # Run the event loop until the coroutines complete
+            try:
+                engine.loop.run_until_complete(asyncio.gather(
+                    asyncio.wrap_future(future, loop=engine.loop),
+                    asyncio.wrap_future(future2, loop=engine.loop)
+                ))
+            finally:
+                engine.loop.close()
+            self.assertEqual(future.result(), 2)
+            self.assertEqual(future2.result(), 4)
+
+
+# Thread pool executor that runs each function synchronously
+class SynchronousExecutor(concurrent.futures.ThreadPoolExecutor):
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+class TestChatScheduler(unittest.TestCase):
+
+    def test_scheduler(self):
+        with unittest.mock.patch('threading.Thread') as mock_thread, \
+             unittest.mock.patch('ollama_chat.chat.ChatManager.chat_thread_fn') as mock_chat_thread_fn:
+            scheduler = ChatScheduler(2, 1)
+
+            # Queue the chats - worker threads are started up to the maximum
+            chat1, chat2, chat3, chat4 = (unittest.mock.Mock() for _ in range(4))
+            scheduler.submit(chat1, 'llm')
+            scheduler.submit(chat2, 'llm')
+            scheduler.submit(chat3, 'llm', priority=1)
+            scheduler.submit(chat4, 'llm2')
+            self.assertListEqual(mock_thread.call_args_list, [
+                unittest.mock.call(target=scheduler._worker_thread_fn),
+                unittest.mock.call(target=scheduler._worker_thread_fn)
+            ])
+            self.assertEqual(mock_thread.return_value.start.call_count, 2)
+            self.assertTrue(mock_thread.return_value.daemon)
+            self.assertEqual(scheduler.workers, 2)
+
+            # The queue is ordered by priority, then by queued order
+            self.assertEqual(scheduler.queue_position(chat1), 1)
+            self.assertEqual(scheduler.queue_position(chat2), 2)
+            self.assertEqual(scheduler.queue_position(chat4), 3)
+            self.assertEqual(scheduler.queue_position(chat3), 4)
+
+            # Cancel a queued chat
+            self.assertTrue(scheduler.cancel(chat2))
+            self.assertFalse(scheduler.cancel(chat2))
+            self.assertIsNone(scheduler.queue_position(chat2))
+
+            # Run the workers - the second worker runs while the first worker runs chat1, so chat3
+            # waits for chat1 to complete (the per-model limit)
+            chat_runs = []
+            def chat_thread_fn(chat):
+                chat_runs.append((chat, dict(scheduler.model_chats)))
+                if chat is chat1:
+                    scheduler._worker_thread_fn()
+            mock_chat_thread_fn.side_effect = chat_thread_fn
+            scheduler._worker_thread_fn()
+            self.assertListEqual(chat_runs, [
+                (chat1, {'llm': 1}),
+                (chat4, {'llm': 1, 'llm2': 1}),
+                (chat3, {'llm': 1})
+            ])
+            self.assertListEqual(scheduler.queue, [])
+            self.assertDictEqual(scheduler.model_chats, {})
+            self.assertEqual(scheduler.workers, 0)
+
+
+    def test_scheduler_unlimited_models(self):
+        with unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('ollama_chat.chat.ChatManager.chat_thread_fn') as mock_chat_thread_fn:
+            scheduler = ChatScheduler(2)
+            chat1, chat2, chat3 = (unittest.mock.Mock() for _ in range(3))
+            scheduler.submit(chat1, 'llm')
+            scheduler.submit(chat2, 'llm')
+            scheduler.submit(chat3, 'llm')
+
+            # Run the workers - the second worker runs while the first worker runs chat1. A chat
+            # error does not stop the worker.
+            chat_runs = []
+            def chat_thread_fn(chat):
+                chat_runs.append((chat, dict(scheduler.model_chats)))
+                if chat is chat1:
+                    scheduler._worker_thread_fn()
+                elif chat is chat2:
+                    raise Exception('BOOM!')
+            mock_chat_thread_fn.side_effect = chat_thread_fn
+            scheduler._worker_thread_fn()
+            self.assertListEqual(chat_runs, [
+                (chat1, {'llm': 1}),
+                (chat2, {'llm': 2}),
+                (chat3, {'llm': 2})
+            ])
+            self.assertDictEqual(scheduler.model_chats, {})
+            self.assertEqual(scheduler.workers, 0)
+
+
+    def test_chat_manager_queued(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                    {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread') as mock_thread:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, max_chats=1)
+
+            # Reply to the conversations - the chats are queued
+            for id_ in ('conv1', 'conv2'):
+                request = {'id': id_, 'user': 'Hello'}
+                status, _, _ = app.request('POST', '/replyConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+            mock_thread.assert_called_once_with(target=app.scheduler._worker_thread_fn)
+            self.assertEqual(app.scheduler.queue_position(app.chats['conv2']), 2)
+
+            # The queued conversation has its queue position
+            status, _, content_bytes = app.request('GET', '/getConversation', query_string='id=conv2')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {
+                'conversation': {
+                    'id': 'conv2',
+                    'model': 'llm',
+                    'title': 'Conversation 2',
+                    'exchanges': [{'user': 'Hello', 'model': ''}],
+                    'generating': True,
+                    'modelOffset': 0,
+                    'version': app.config.conversation_versions['conv2'], 'queued': 2
+                }
+            })
+
+            # Stop the queued conversation - it's removed from the queue
+            chat2 = app.chats['conv2']
+            status, _, _ = app.request('POST', '/stopConversation', wsgi_input=json.dumps({'id': 'conv2'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertIsNone(app.scheduler.queue_position(chat2))
+
+            # A running conversation has no queue position
+            app.scheduler.cancel(app.chats['conv1'])
+            status, _, content_bytes = app.request('GET', '/getConversation', query_string='id=conv1')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {
+                'conversation': {
+                    'id': 'conv1',
+                    'model': 'llm',
+                    'title': 'Conversation 1',
+                    'exchanges': [{'user': 'Hello', 'model': ''}],
+                    'generating': True,
+                    'modelOffset': 0,
+                    'version': app.config.conversation_versions['conv1']
+                }
+            })
+
+
+    def test_chat_manager_queued_journal(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+                ]
+            }))
+        ]
+        with create_test_files(test_files) as temp_dir, \
+             unittest.mock.patch('threading.Thread'), \
+             unittest.mock.patch('ollama_chat.chat.ollama_chat') as mock_ollama_chat:
+            mock_ollama_chat.return_value = [{'message': {'role': 'assistant', 'content': 'Hi'}}]
+
+            # Queue the chat - its prompt is journaled
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            journal_path = os.path.join(temp_dir, 'ollama-chat.journal')
+            app = OllamaChat(config_path, save_delay=60, journal=True, max_chats=1)
+            with app.config():
+                chat_manager = ChatManager(app, 'conv1', ['Hello'], 'llm')
+                app.chats['conv1'] = chat_manager
+            with open(journal_path, 'r', encoding='utf-8') as fh_journal:
+                self.assertListEqual([json.loads(line) for line in fh_journal], [
+                    {'exchange': {'id': 'conv1', 'index': 0, 'user': 'Hello'}}
+                ])
+
+            # The queued prompt is replayed on startup
+            app2 = OllamaChat(config_path, journal=True)
+            with app2.config() as config:
+                self.assertListEqual(config['conversations'][0]['exchanges'], [{'user': 'Hello', 'model': ''}])
+
+            # Run the queued chat - the prompt is not added again
+            ChatManager.chat_thread_fn(chat_manager)
+            with app.config() as config:
+                self.assertListEqual(config['conversations'][0]['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+
+
 class TestConfigTemplatePrompts(unittest.TestCase):
 
     def test_basic(self):
@@ -1354,7 +1906,7 @@ file content 2
         mock_response.data = b'url content'
 
         mock_chat = unittest.mock.Mock()
-        mock_chat.app.pool_manager.request.return_value = mock_response
+        mock_chat.app.url_pool_manager.request.return_value = mock_response
 
         flags = {}
         self.assertEqual(
@@ -1373,7 +1925,7 @@ url content
         mock_response.data = b'error content'
 
         mock_chat = unittest.mock.Mock()
-        mock_chat.app.pool_manager.request.return_value = mock_response
+        mock_chat.app.url_pool_manager.request.return_value = mock_response
 
         flags = {}
         with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
@@ -1388,7 +1940,7 @@ url content
         mock_response.data = b'url content'
 
         mock_chat = unittest.mock.Mock()
-        mock_chat.app.pool_manager.request.return_value = mock_response
+        mock_chat.app.url_pool_manager.request.return_value = mock_response
 
         flags = {}
         self.assertEqual(
@@ -1403,7 +1955,7 @@ url content
         self.assertDictEqual(flags, {'show': True})
 
         # Show mode requires a second render pass, but the URL is still fetched only once
-        self.assertEqual(mock_chat.app.pool_manager.request.call_count, 1)
+        self.assertEqual(mock_chat.app.url_pool_manager.request.call_count, 1)
         mock_response.close.assert_called_once_with()
 
 
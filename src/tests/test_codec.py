@@ -0,0 +1,57 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+import datetime
+import unittest
+import unittest.mock
+
+from ollama_chat.codec import json_dumps, json_loads, orjson
+
+
+class TestCodec(unittest.TestCase):
+
+    @unittest.skipUnless(orjson, 'orjson is not installed')
+    def test_orjson(self):
+        value = {'b': [1, 'two', None], 'a': {'c': True}}
+        self.assertEqual(json_dumps(value), b'{\n  "a": {\n    "c": true\n  },\n  "b": [\n    1,\n    "two",\n    null\n  ]\n}')
+        self.assertEqual(json_dumps(value, compact=True), b'{"a":{"c":true},"b":[1,"two",null]}')
+        self.assertDictEqual(json_loads(b'{"a": {"c": true}, "b": [1, "two", null]}'), value)
+        self.assertDictEqual(json_loads('{"a": {"c": true}, "b": [1, "two", null]}'), value)
+
+
+    def test_ujson(self):
+        with unittest.mock.patch('ollama_chat.codec.orjson', None), \
+             unittest.mock.patch('ollama_chat.codec.ujson') as mock_ujson:
+            mock_ujson.dumps.return_value = '{"a":1}'
+            mock_ujson.loads.return_value = {'a': 1}
+            self.assertEqual(json_dumps({'a': 1}), b'{"a":1}')
+            self.assertEqual(json_dumps({'a': 1}, compact=True), b'{"a":1}')
+            self.assertDictEqual(json_loads(b'{"a":1}'), {'a': 1})
+            self.assertListEqual(mock_ujson.dumps.call_args_list, [
+                unittest.mock.call(
+                    {'a': 1}, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False, indent=2, default=unittest.mock.ANY
+                ),
+                unittest.mock.call(
+                    {'a': 1}, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False, indent=0, default=unittest.mock.ANY
+                )
+            ])
+            mock_ujson.loads.assert_called_once_with(b'{"a":1}')
+
+
+    def test_json(self):
+        value = {'b': [1, 'two', None], 'a': {'c': True}}
+        with unittest.mock.patch('ollama_chat.codec.orjson', None), \
+             unittest.mock.patch('ollama_chat.codec.ujson', None):
+            self.assertEqual(json_dumps(value), b'{\n  "a": {\n    "c": true\n  },\n  "b": [\n    1,\n    "two",\n    null\n  ]\n}')
+            self.assertEqual(json_dumps(value, compact=True), b'{"a":{"c":true},"b":[1,"two",null]}')
+            self.assertDictEqual(json_loads(b'{"a": {"c": true}, "b": [1, "two", null]}'), value)
+
+
+    def test_json_datetime(self):
+        value = {'modified': datetime.datetime(2023, 10, 1, 12, tzinfo=datetime.timezone.utc)}
+        with unittest.mock.patch('ollama_chat.codec.orjson', None), \
+             unittest.mock.patch('ollama_chat.codec.ujson', None):
+            self.assertEqual(json_dumps(value, compact=True), b'{"modified":"2023-10-01T12:00:00+00:00"}')
+            with self.assertRaises(TypeError) as cm_exc:
+                json_dumps({'a': {1, 2}})
+            self.assertEqual(str(cm_exc.exception), 'Object of type set is not JSON serializable')
@@ -33,6 +33,42 @@ class TestMain(unittest.TestCase):
             self.assertEqual(stderr.getvalue(), '')
 
 
+    def test_main_max_chats_async(self):
+        with unittest.mock.patch('threading.Thread') as mock_thread, \
+             unittest.mock.patch('webbrowser.open') as mock_open, \
+             unittest.mock.patch('waitress.serve') as mock_serve, \
+             unittest.mock.patch('sys.stdout', StringIO()) as stdout, \
+             unittest.mock.patch('sys.stderr', StringIO()) as stderr:
+
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['-g', '4', '-k', 'async'])
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            mock_thread.assert_not_called()
+            mock_open.assert_not_called()
+            mock_serve.assert_not_called()
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith('ollama-chat: error: argument -g: not allowed with argument -k async\n'))
+
+
+    def test_main_max_model_chats_no_max_chats(self):
+        with unittest.mock.patch('threading.Thread') as mock_thread, \
+             unittest.mock.patch('webbrowser.open') as mock_open, \
+             unittest.mock.patch('waitress.serve') as mock_serve, \
+             unittest.mock.patch('sys.stdout', StringIO()) as stdout, \
+             unittest.mock.patch('sys.stderr', StringIO()) as stderr:
+
+            with self.assertRaises(SystemExit) as cm_exc:
+                main(['-e', '2'])
+
+            self.assertEqual(cm_exc.exception.code, 2)
+            mock_thread.assert_not_called()
+            mock_open.assert_not_called()
+            mock_serve.assert_not_called()
+            self.assertEqual(stdout.getvalue(), '')
+            self.assertTrue(stderr.getvalue().endswith('ollama-chat: error: argument -e: requires argument -g\n'))
+
+
     def test_main_config_default(self):
         with unittest.mock.patch('os.path.isfile', return_value=False) as mock_isfile, \
              unittest.mock.patch('threading.Thread') as mock_thread, \
@@ -57,7 +93,7 @@ class TestMain(unittest.TestCase):
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -65,8 +101,10 @@ class TestMain(unittest.TestCase):
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(
                 stdout.getvalue(),
@@ -80,7 +118,7 @@ ollama-chat: 200 GET /getConversations\x20
 
     def test_main_config_cwd(self):
         with unittest.mock.patch('os.path.isfile', return_value=True) as mock_isfile, \
-             unittest.mock.patch('builtins.open', unittest.mock.mock_open(read_data='{"model": "llm", "conversations": []}')), \
+             unittest.mock.patch('builtins.open', unittest.mock.mock_open(read_data=b'{"model": "llm", "conversations": []}')), \
              unittest.mock.patch('threading.Thread') as mock_thread, \
              unittest.mock.patch('webbrowser.open') as mock_open, \
              unittest.mock.patch('waitress.serve') as mock_serve, \
@@ -103,7 +141,7 @@ ollama-chat: 200 GET /getConversations\x20
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -111,8 +149,10 @@ ollama-chat: 200 GET /getConversations\x20
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(
                 stdout.getvalue(),
@@ -144,7 +184,7 @@ ollama-chat: 200 GET /getConversations\x20
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -152,8 +192,10 @@ ollama-chat: 200 GET /getConversations\x20
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(
                 stdout.getvalue(),
@@ -188,7 +230,7 @@ ollama-chat: 200 GET /getConversations\x20
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -196,8 +238,10 @@ ollama-chat: 200 GET /getConversations\x20
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(
                 stdout.getvalue(),
@@ -232,7 +276,7 @@ ollama-chat: 200 GET /getConversations\x20
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -240,8 +284,10 @@ ollama-chat: 200 GET /getConversations\x20
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'model': 'llm', 'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(
                 stdout.getvalue(),
@@ -273,7 +319,7 @@ ollama-chat: 200 GET /getConversations\x20
             serve_args, serve_kwargs = mock_serve.call_args
             application_wrap = serve_args[0]
             self.assertTrue(callable(application_wrap))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             start_response_calls = []
             def start_response(status, response_headers):
@@ -281,8 +327,10 @@ ollama-chat: 200 GET /getConversations\x20
             environ = chisel.Context.create_environ('GET', '/getConversations')
             response = json.loads(application_wrap(environ, start_response)[0].decode('utf-8'))
 
-            self.assertListEqual(start_response_calls, [('200 OK', [('Content-Type', 'application/json')])])
-            self.assertDictEqual(response, {'conversations': [], 'templates': []})
+            self.assertListEqual(start_response_calls, [
+                ('200 OK', [('Cache-Control', 'no-cache'), ('Content-Type', 'application/json'), ('ETag', unittest.mock.ANY)])
+            ])
+            self.assertDictEqual(response, {'conversations': [], 'templates': [], 'version': unittest.mock.ANY})
 
             self.assertEqual(stdout.getvalue(), '')
             self.assertEqual(stderr.getvalue(), '')
@@ -324,7 +372,7 @@ ollama-chat: 200 GET /getConversations\x20
             mock_serve.assert_called_once()
             serve_args, serve_kwargs = mock_serve.call_args
             self.assertTrue(callable(serve_args[0]))
-            self.assertDictEqual(serve_kwargs, {'port': 8080})
+            self.assertDictEqual(serve_kwargs, {'port': 8080, 'threads': 16})
 
             self.assertEqual(stdout.getvalue(), 'ollama-chat: Serving at http://127.0.0.1:8080/ ...\n')
             self.assertEqual(stderr.getvalue(), '')
@@ -375,6 +423,7 @@ ollama-chat: 200 GET /getConversations\x20
             thread_instance.join.assert_not_called()
 
             mock_serve.assert_called_once()
+            mock_application.config.flush.assert_called_once_with()
             self.assertEqual(stdout.getvalue(), 'ollama-chat: Serving at http://127.0.0.1:8080/ ...\n')
             self.assertEqual(stderr.getvalue(), '')
 
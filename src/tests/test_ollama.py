@@ -0,0 +1,867 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+import asyncio
+import datetime
+import http.server
+import json
+import os
+import threading
+import unittest
+import unittest.mock
+
+import urllib3
+
+from ollama_chat.ollama import ModelCache, OllamaBackends, PoolStats, _NDJSONDecoder, create_pool_manager, model_keep_alive, \
+    ollama_chat, ollama_chat_async, ollama_delete, ollama_list, ollama_load, ollama_ps, ollama_pull, ollama_pull_async
+
+
+# Helper to run an asynchronous Ollama API function with a local HTTP server that sends the raw
+# responses, in order - returns the yielded chunks and the received requests. If backend hosts are
+# provided, the function is called with backends of those hosts followed by the server.
+def run_with_server(ollama_fn, args, responses, backend_hosts=None):
+    requests = []
+
+    async def handle_request(reader, writer):
+        request_head = (await reader.readuntil(b'\r\n\r\n')).decode('utf-8')
+        content_length = int(request_head.lower().split('content-length: ')[1].split('\r\n')[0])
+        requests.append((request_head.split('\r\n')[0], json.loads(await reader.readexactly(content_length))))
+        writer.write(responses.pop(0))
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle_request, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            if backend_hosts is not None:
+                backends = OllamaBackends([*backend_hosts, f'http://127.0.0.1:{port}'])
+                return [chunk async for chunk in ollama_fn(*args, backends=backends)]
+            with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': f'http://127.0.0.1:{port}'}):
+                return [chunk async for chunk in ollama_fn(*args)]
+
+    return asyncio.run(run()), requests
+
+
+# Helper to create a raw HTTP response
+def http_response(status, body, chunks=None, content_length=True):
+    head = f'HTTP/1.1 {status} Status\r\nContent-Type: application/json\r\n'.encode('utf-8')
+    if chunks is not None:
+        body_chunked = b''.join(f'{len(chunk):x}\r\n'.encode('utf-8') + chunk + b'\r\n' for chunk in chunks)
+        return head + b'Transfer-Encoding: chunked\r\n\r\n' + body_chunked + b'0\r\n\r\n'
+    if content_length:
+        head += f'Content-Length: {len(body)}\r\n'.encode('utf-8')
+    return head + b'\r\n' + body
+
+
+class TestOllamaAsync(unittest.TestCase):
+
+    def test_ollama_chat_async(self):
+        responses = [
+            http_response(200, json.dumps({'capabilities': ['completion', 'thinking']}).encode('utf-8')),
+            http_response(200, None, chunks=[
+                b'{"message": {"thinking": "Hmm"}}\n{"message": {"con',
+                b'tent": "Hello"}}\n',
+                b'{"message": {"content": " \xf0\x9f',
+                b'\x98\x80"}}\n'
+            ])
+        ]
+        chunks, requests = run_with_server(ollama_chat_async, ('llm', [{'role': 'user', 'content': 'Hi'}]), responses)
+        self.assertListEqual(chunks, [
+            {'message': {'thinking': 'Hmm'}},
+            {'message': {'content': 'Hello'}},
+            {'message': {'content': ' \U0001f600'}}
+        ])
+        self.assertListEqual(requests, [
+            ('POST /api/show HTTP/1.1', {'model': 'llm'}),
+            ('POST /api/chat HTTP/1.1', {'model': 'llm', 'messages': [{'role': 'user', 'content': 'Hi'}], 'stream': True, 'think': True})
+        ])
+
+
+    def test_ollama_chat_async_model_cache(self):
+        model_cache = ModelCache()
+        responses = [
+            http_response(200, json.dumps({'capabilities': ['completion', 'thinking']}).encode('utf-8')),
+            http_response(200, b'{"message": {"content": "Hello"}}\n'),
+            http_response(200, b'{"message": {"content": "Bye"}}\n')
+        ]
+        chunks, requests = run_with_server(ollama_chat_async, ('llm', [], model_cache), responses)
+        self.assertListEqual(chunks, [{'message': {'content': 'Hello'}}])
+        self.assertListEqual(model_cache.get('llm'), ['completion', 'thinking'])
+
+        # The cached capabilities are used - no show request
+        chunks2, requests2 = run_with_server(ollama_chat_async, ('llm', [], model_cache), responses)
+        self.assertListEqual(chunks2, [{'message': {'content': 'Bye'}}])
+        self.assertListEqual(requests + requests2, [
+            ('POST /api/show HTTP/1.1', {'model': 'llm'}),
+            ('POST /api/chat HTTP/1.1', {'model': 'llm', 'messages': [], 'stream': True, 'think': True}),
+            ('POST /api/chat HTTP/1.1', {'model': 'llm', 'messages': [], 'stream': True, 'think': True})
+        ])
+
+
+    def test_ollama_chat_async_read_to_close(self):
+        responses = [
+            http_response(200, b'{}'),
+            http_response(200, b'{"message": {"content": "Hello"}}\n', content_length=False)
+        ]
+        chunks, requests = run_with_server(ollama_chat_async, ('llm', []), responses)
+        self.assertListEqual(chunks, [{'message': {'content': 'Hello'}}])
+        self.assertListEqual(requests, [
+            ('POST /api/show HTTP/1.1', {'model': 'llm'}),
+            ('POST /api/chat HTTP/1.1', {'model': 'llm', 'messages': [], 'stream': True, 'think': False})
+        ])
+
+
+    def test_ollama_chat_async_unknown_model(self):
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_chat_async, ('llm', []), [http_response(404, b'{}')])
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (404)')
+
+
+    def test_ollama_chat_async_chat_failure(self):
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_chat_async, ('llm', []), [http_response(200, b'{}'), http_response(500, b'')])
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (500)')
+
+
+    def test_ollama_chat_async_error_chunk(self):
+        responses = [http_response(200, b'{}'), http_response(200, None, chunks=[b'{"error": "model crashed"}\n'])]
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_chat_async, ('llm', []), responses)
+        self.assertEqual(str(cm_exc.exception), 'model crashed')
+
+
+    def test_ollama_chat_async_truncated_stream(self):
+        responses = [http_response(200, b'{}'), http_response(200, None, chunks=[b'{"message": {"content": "Hel'])]
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_chat_async, ('llm', []), responses)
+        self.assertEqual(str(cm_exc.exception), 'Invalid streamed response: \'{"message": {"content": "Hel\'')
+
+
+    def test_ollama_chat_async_host_no_scheme(self):
+        async def handle_request(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(http_response(200, b'{"message": {"content": "Hello"}}\n'))
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle_request, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            model_cache = ModelCache()
+            model_cache.set('llm', [])
+            async with server:
+                with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': f'127.0.0.1:{port}'}):
+                    return [chunk async for chunk in ollama_chat_async('llm', [], model_cache)]
+
+        self.assertListEqual(asyncio.run(run()), [{'message': {'content': 'Hello'}}])
+
+
+    def test_ollama_chat_async_read_timeout(self):
+        async def handle_request(reader, unused_writer):
+            await reader.read()
+
+        async def run():
+            server = await asyncio.start_server(handle_request, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': f'http://127.0.0.1:{port}'}):
+                    return [chunk async for chunk in ollama_chat_async('llm', [])]
+
+        with unittest.mock.patch('ollama_chat.ollama.OLLAMA_READ_TIMEOUT', 0.1):
+            with self.assertRaises(TimeoutError):
+                asyncio.run(run())
+
+
+    def test_ollama_chat_async_invalid_response(self):
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_chat_async, ('llm', []), [b'Invalid\r\n'])
+        self.assertEqual(str(cm_exc.exception), 'Invalid response')
+
+
+    def test_ollama_chat_async_https(self):
+        async def run():
+            return [chunk async for chunk in ollama_chat_async('llm', [])]
+
+        with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': 'https://ollama.example.com'}), \
+             unittest.mock.patch('asyncio.open_connection', side_effect=OSError('Connection refused')) as mock_open_connection:
+            with self.assertRaises(OSError):
+                asyncio.run(run())
+            mock_open_connection.assert_called_once_with('ollama.example.com', 443, ssl=True)
+
+
+    def test_ollama_pull_async(self):
+        responses = [
+            http_response(200, None, chunks=[b'{"status": "pulling", "completed": 1, "total": 2}\n{"status": "success"}\n'])
+        ]
+        chunks, requests = run_with_server(ollama_pull_async, ('llm',), responses)
+        self.assertListEqual(chunks, [{'status': 'pulling', 'completed': 1, 'total': 2}, {'status': 'success'}])
+        self.assertListEqual(requests, [('POST /api/pull HTTP/1.1', {'model': 'llm', 'stream': True})])
+
+
+    def test_ollama_pull_async_unterminated(self):
+        responses = [http_response(200, None, chunks=[b'{"status": "pulling"}\n{"status": "success"}'])]
+        chunks, _ = run_with_server(ollama_pull_async, ('llm',), responses)
+        self.assertListEqual(chunks, [{'status': 'pulling'}, {'status': 'success'}])
+
+
+    def test_ollama_pull_async_failure(self):
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            run_with_server(ollama_pull_async, ('llm',), [http_response(500, b'')])
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (500)')
+
+
+    def test_ollama_chat_async_keep_alive(self):
+        model_cache = ModelCache()
+        model_cache.set('llm', [])
+        responses = [http_response(200, b'{"message": {"content": "Hello"}}\n')]
+        chunks, requests = run_with_server(ollama_chat_async, ('llm', [], model_cache, None, '30m'), responses)
+        self.assertListEqual(chunks, [{'message': {'content': 'Hello'}}])
+        self.assertListEqual(requests, [
+            ('POST /api/chat HTTP/1.1', {'model': 'llm', 'messages': [], 'stream': True, 'think': False, 'keep_alive': '30m'})
+        ])
+
+
+    def test_ollama_chat_async_backend_failover(self):
+        responses = [
+            http_response(200, json.dumps({'capabilities': ['completion']}).encode('utf-8')),
+            http_response(200, b'{"message": {"content": "Hello"}}\n')
+        ]
+        chunks, requests = run_with_server(ollama_chat_async, ('llm', []), responses, backend_hosts=['http://127.0.0.1:1'])
+        self.assertListEqual(chunks, [{'message': {'content': 'Hello'}}])
+        self.assertListEqual([request_line for request_line, _ in requests], ['POST /api/show HTTP/1.1', 'POST /api/chat HTTP/1.1'])
+
+
+    def test_ollama_pull_async_backends(self):
+        responses = [http_response(200, b'{"status": "success"}\n')]
+        chunks, requests = run_with_server(ollama_pull_async, ('llm',), responses, backend_hosts=['http://127.0.0.1:1'])
+        self.assertListEqual(chunks, [{'status': 'success'}])
+        self.assertListEqual(requests, [('POST /api/pull HTTP/1.1', {'model': 'llm', 'stream': True})])
+
+
+    def test_ollama_pull_async_backends_down(self):
+        backends = OllamaBackends(['http://127.0.0.1:1'])
+        async def run():
+            return [chunk async for chunk in ollama_pull_async('llm', backends=backends)]
+        with self.assertRaises(OSError):
+            asyncio.run(run())
+
+
+    def test_ollama_pull_async_backends_read_error(self):
+        async def iter_ndjson_async(unused_response):
+            yield {'status': 'pulling'}
+            raise ConnectionResetError()
+
+        responses = [http_response(200, b'')]
+        with unittest.mock.patch('ollama_chat.ollama._iter_ndjson_async', iter_ndjson_async):
+            with self.assertRaises(ConnectionResetError):
+                run_with_server(ollama_pull_async, ('llm',), responses, backend_hosts=[])
+
+
+    def test_ollama_chat_async_backends_down(self):
+        backends = OllamaBackends(['http://127.0.0.1:1'])
+        async def run():
+            return [chunk async for chunk in ollama_chat_async('llm', [], backends=backends)]
+        with self.assertRaises(OSError):
+            asyncio.run(run())
+        self.assertTrue(backends.stats()[0]['down'])
+
+
+class TestOllama(unittest.TestCase):
+
+    def test_ollama_chat_no_model_cache(self):
+        mock_show_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+        mock_show_response.status = 200
+        mock_show_response.json.return_value = {}
+        mock_chat_response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+        mock_chat_response.status = 200
+        mock_chat_response.read_chunked.return_value = [b'{"message": {"content": "Hello"}}']
+        mock_pool_manager = unittest.mock.Mock(spec=urllib3.PoolManager)
+        mock_pool_manager.request.side_effect = [mock_show_response, mock_chat_response]
+
+        self.assertListEqual(list(ollama_chat(mock_pool_manager, 'llm', [])), [{'message': {'content': 'Hello'}}])
+        self.assertListEqual(mock_pool_manager.request.call_args_list, [
+            unittest.mock.call('POST', 'http://127.0.0.1:11434/api/show', json={'model': 'llm'}, retries=0),
+            unittest.mock.call(
+                'POST', 'http://127.0.0.1:11434/api/chat', json={'model': 'llm', 'messages': [], 'stream': True, 'think': False},
+                preload_content=False, retries=0
+            )
+        ])
+
+
+    def test_model_keep_alive(self):
+        keep_alives = {'llm': '30m', 'other:7b': '-1m'}
+        self.assertEqual(model_keep_alive(keep_alives, 'llm:latest'), '30m')
+        self.assertEqual(model_keep_alive(keep_alives, 'other:7b'), '-1m')
+        self.assertIsNone(model_keep_alive(keep_alives, 'other'))
+        self.assertIsNone(model_keep_alive(None, 'llm'))
+
+
+# Helper to create a mock Ollama API response
+def mock_response(status, data=None, chunks=None):
+    response = unittest.mock.Mock(spec=urllib3.response.HTTPResponse)
+    response.status = status
+    response.json.return_value = data
+    response.read_chunked.return_value = chunks or []
+    return response
+
+
+# Helper to create a mock pool manager that responds by URL, in order - an exception is raised
+def mock_backends_pool_manager(url_responses):
+    def request(unused_method, url, **unused_kwargs):
+        response = url_responses[url].pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    pool_manager = unittest.mock.Mock(spec=urllib3.PoolManager)
+    pool_manager.request.side_effect = request
+    return pool_manager
+
+
+# A backend connection error
+def connection_error():
+    return urllib3.exceptions.NewConnectionError(None, 'Connection refused')
+
+
+class TestOllamaBackends(unittest.TestCase):
+
+    def test_backends_default(self):
+        backends = OllamaBackends()
+        with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': 'http://ollama.local:8000'}):
+            self.assertListEqual(backends.hosts, ['http://ollama.local:8000'])
+            self.assertListEqual(backends.route('llm:latest'), ['http://ollama.local:8000'])
+            self.assertListEqual(backends.reachable(), ['http://ollama.local:8000'])
+
+            # A single backend does not query the loaded models
+            mock_pool_manager = unittest.mock.Mock(spec=urllib3.PoolManager)
+            backends.refresh_loaded(mock_pool_manager)
+            mock_pool_manager.request.assert_not_called()
+
+
+    def test_backends_host_no_scheme(self):
+        self.assertListEqual(OllamaBackends(['host1:11434/', 'https://host2']).hosts, ['http://host1:11434', 'https://host2'])
+        with unittest.mock.patch.dict(os.environ, {'OLLAMA_HOST': '0.0.0.0:8000'}):
+            self.assertListEqual(OllamaBackends().hosts, ['http://0.0.0.0:8000'])
+
+
+    def test_backends_route(self):
+        backends = OllamaBackends(['http://host1:11434/', 'http://host2:11434', 'http://host3:11434'])
+        self.assertListEqual(backends.hosts, ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=100):
+            # The fewest outstanding requests is first
+            with backends.request('http://host1:11434'):
+                self.assertListEqual(backends.route('llm:latest'), ['http://host2:11434', 'http://host3:11434', 'http://host1:11434'])
+            self.assertListEqual(backends.route('llm:latest'), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+
+            # A backend with the model loaded is first
+            backends.loaded = {'http://host3:11434': {'llm:latest'}}
+            self.assertListEqual(backends.route('llm:latest'), ['http://host3:11434', 'http://host1:11434', 'http://host2:11434'])
+            self.assertListEqual(backends.route(), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+
+            # A down backend is last
+            backends.mark_down('http://host3:11434')
+            self.assertListEqual(backends.route('llm:latest'), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+            self.assertListEqual(backends.reachable(), ['http://host1:11434', 'http://host2:11434'])
+            self.assertListEqual(backends.stats(), [
+                {'host': 'http://host1:11434', 'outstanding': 0, 'down': False, 'loaded': []},
+                {'host': 'http://host2:11434', 'outstanding': 0, 'down': False, 'loaded': []},
+                {'host': 'http://host3:11434', 'outstanding': 0, 'down': True, 'loaded': ['llm:latest']}
+            ])
+
+            # If every backend is down, all are reachable
+            backends.mark_down('http://host1:11434')
+            backends.mark_down('http://host2:11434')
+            self.assertListEqual(backends.reachable(), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+
+        # The down backends are retried after the retry interval
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=130):
+            self.assertListEqual(backends.reachable(), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+            self.assertFalse(any(backend_stats['down'] for backend_stats in backends.stats()))
+
+        # A responding backend is marked up
+        backends.mark_down('http://host2:11434')
+        backends.mark_up('http://host2:11434')
+        self.assertListEqual(backends.reachable(), ['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+
+
+    def test_backends_refresh_loaded(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/ps': [mock_response(200, {'models': [{'model': 'llm'}]}), connection_error()],
+            'http://host2:11434/api/ps': [mock_response(200, {'models': []})],
+            'http://host3:11434/api/ps': [mock_response(500), mock_response(200, {'models': [{'model': 'other:7b'}]})]
+        })
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=100):
+            # A down backend is not queried
+            backends.mark_down('http://host2:11434')
+            backends.refresh_loaded(mock_pool_manager)
+            self.assertListEqual(backends.stats(), [
+                {'host': 'http://host1:11434', 'outstanding': 0, 'down': False, 'loaded': ['llm:latest']},
+                {'host': 'http://host2:11434', 'outstanding': 0, 'down': True, 'loaded': []},
+                {'host': 'http://host3:11434', 'outstanding': 0, 'down': False, 'loaded': []}
+            ])
+            self.assertListEqual(mock_pool_manager.request.call_args_list, [
+                unittest.mock.call('GET', 'http://host1:11434/api/ps', retries=0, timeout=2),
+                unittest.mock.call('GET', 'http://host3:11434/api/ps', retries=0, timeout=2)
+            ])
+
+            # The loaded models are not refreshed until they expire
+            backends.refresh_loaded(mock_pool_manager)
+            self.assertEqual(mock_pool_manager.request.call_count, 2)
+
+        # A backend that fails to connect is marked down, and a down backend that responds after its retry
+        # interval is marked up
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=140):
+            backends.refresh_loaded(mock_pool_manager)
+            self.assertEqual(mock_pool_manager.request.call_count, 5)
+            self.assertListEqual(backends.stats(), [
+                {'host': 'http://host1:11434', 'outstanding': 0, 'down': True, 'loaded': []},
+                {'host': 'http://host2:11434', 'outstanding': 0, 'down': False, 'loaded': []},
+                {'host': 'http://host3:11434', 'outstanding': 0, 'down': False, 'loaded': ['other:7b']}
+            ])
+
+
+    def test_ollama_chat_backend_failover(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/ps': [connection_error()],
+            'http://host2:11434/api/ps': [mock_response(200, {'models': []})],
+            'http://host1:11434/api/show': [connection_error()],
+            'http://host2:11434/api/show': [mock_response(200, {'capabilities': ['completion']})],
+            'http://host2:11434/api/chat': [mock_response(200, chunks=[b'{"message": {"content": "Hello"}}\n'])]
+        })
+        self.assertListEqual(list(ollama_chat(mock_pool_manager, 'llm', [], backends=backends)), [{'message': {'content': 'Hello'}}])
+        self.assertListEqual([backend_stats['down'] for backend_stats in backends.stats()], [True, False])
+        self.assertListEqual([backend_stats['outstanding'] for backend_stats in backends.stats()], [0, 0])
+
+
+    def test_ollama_chat_backends_down(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        backends.loaded_time = 0
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/show': [connection_error()],
+            'http://host2:11434/api/show': [connection_error()]
+        })
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=5):
+            with self.assertRaises(urllib3.exceptions.NewConnectionError):
+                list(ollama_chat(mock_pool_manager, 'llm', [], backends=backends))
+            self.assertListEqual([backend_stats['down'] for backend_stats in backends.stats()], [True, True])
+
+
+    def test_ollama_list(self):
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://127.0.0.1:11434/api/tags': [mock_response(200, {'models': [
+                {'model': 'llm:latest', 'details': {}, 'size': 100, 'modified_at': '2026-01-01T00:00:00Z'}
+            ]})]
+        })
+        self.assertListEqual(ollama_list(mock_pool_manager), [
+            {'model': 'llm:latest', 'digest': None, 'details': {}, 'size': 100,
+             'modified_at': datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)}
+        ])
+
+
+    def test_ollama_list_backends(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/tags': [connection_error()],
+            'http://host2:11434/api/tags': [mock_response(200, {'models': [
+                {'model': 'llm:latest', 'digest': 'a1', 'details': {}, 'size': 100, 'modified_at': '2026-01-01T00:00:00Z'}
+            ]})],
+            'http://host3:11434/api/tags': [mock_response(200, {'models': [
+                {'model': 'llm:latest', 'digest': 'a2', 'details': {}, 'size': 100, 'modified_at': '2026-01-02T00:00:00Z'},
+                {'model': 'other:7b', 'digest': 'b1', 'details': {}, 'size': 200, 'modified_at': '2026-01-03T00:00:00Z'}
+            ]})]
+        })
+        self.assertListEqual([(model['model'], model['digest']) for model in ollama_list(mock_pool_manager, backends)], [
+            ('llm:latest', 'a1'),
+            ('other:7b', 'b1')
+        ])
+        self.assertListEqual([backend_stats['down'] for backend_stats in backends.stats()], [True, False, False])
+
+
+    def test_ollama_list_backends_down(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/tags': [connection_error()],
+            'http://host2:11434/api/tags': [connection_error()]
+        })
+        with self.assertRaises(urllib3.exceptions.NewConnectionError):
+            ollama_list(mock_pool_manager, backends)
+
+
+    def test_ollama_list_failure(self):
+        mock_pool_manager = mock_backends_pool_manager({'http://127.0.0.1:11434/api/tags': [mock_response(500)]})
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            ollama_list(mock_pool_manager)
+        self.assertEqual(str(cm_exc.exception), 'Unexpected error (500)')
+
+
+    def test_ollama_ps(self):
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://127.0.0.1:11434/api/ps': [
+                mock_response(200, {'models': [{'model': 'llm:latest', 'expires_at': '2026-01-01T00:05:00Z'}]})
+            ]
+        })
+        self.assertListEqual(ollama_ps(mock_pool_manager), [
+            {'model': 'llm:latest', 'expires_at': datetime.datetime(2026, 1, 1, 0, 5, tzinfo=datetime.timezone.utc)}
+        ])
+
+
+    def test_ollama_ps_backends(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/ps': [mock_response(200, {'models': [{'model': 'llm:latest', 'expires_at': '2026-01-01T00:05:00Z'}]})],
+            'http://host2:11434/api/ps': [mock_response(200, {'models': [{'model': 'llm:latest', 'expires_at': '2026-01-01T00:10:00Z'}]})],
+            'http://host3:11434/api/ps': [mock_response(200, {'models': [
+                {'model': 'llm:latest', 'expires_at': '2026-01-01T00:01:00Z'},
+                {'model': 'other:7b', 'expires_at': '2026-01-01T00:02:00Z'}
+            ]})]
+        })
+
+        # The latest unload time of each loaded model
+        self.assertListEqual(ollama_ps(mock_pool_manager, backends), [
+            {'model': 'llm:latest', 'expires_at': datetime.datetime(2026, 1, 1, 0, 10, tzinfo=datetime.timezone.utc)},
+            {'model': 'other:7b', 'expires_at': datetime.datetime(2026, 1, 1, 0, 2, tzinfo=datetime.timezone.utc)}
+        ])
+
+
+    def test_ollama_load(self):
+        mock_pool_manager = mock_backends_pool_manager({'http://127.0.0.1:11434/api/chat': [mock_response(200), mock_response(200)]})
+        ollama_load(mock_pool_manager, 'llm')
+        ollama_load(mock_pool_manager, 'llm', '-1m')
+        self.assertListEqual(mock_pool_manager.request.call_args_list, [
+            unittest.mock.call(
+                'POST', 'http://127.0.0.1:11434/api/chat', json={'model': 'llm', 'messages': [], 'stream': False}, retries=0
+            ),
+            unittest.mock.call(
+                'POST', 'http://127.0.0.1:11434/api/chat',
+                json={'model': 'llm', 'messages': [], 'stream': False, 'keep_alive': '-1m'}, retries=0
+            )
+        ])
+
+
+    def test_ollama_load_backends(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        backends.loaded = {'http://host2:11434': {'llm:latest'}}
+        backends.loaded_time = 0
+        mock_pool_manager = mock_backends_pool_manager({'http://host2:11434/api/chat': [mock_response(200)]})
+
+        # The model is loaded on the backend that its chats are routed to
+        ollama_load(mock_pool_manager, 'llm', backends=backends)
+        mock_pool_manager.request.assert_called_once_with(
+            'POST', 'http://host2:11434/api/chat', json={'model': 'llm', 'messages': [], 'stream': False}, retries=0
+        )
+
+
+    def test_ollama_load_failure(self):
+        mock_response_load = mock_response(404)
+        mock_pool_manager = mock_backends_pool_manager({'http://127.0.0.1:11434/api/chat': [mock_response_load]})
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            ollama_load(mock_pool_manager, 'llm')
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (404)')
+        mock_response_load.close.assert_called_once_with()
+
+
+    def test_ollama_delete(self):
+        mock_pool_manager = mock_backends_pool_manager({'http://127.0.0.1:11434/api/delete': [mock_response(200)]})
+        ollama_delete(mock_pool_manager, 'llm')
+        mock_pool_manager.request.assert_called_once_with('DELETE', 'http://127.0.0.1:11434/api/delete', json={'model': 'llm'}, retries=0)
+
+
+    def test_ollama_delete_backends(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/delete': [mock_response(200), mock_response(404), mock_response(200)],
+            'http://host2:11434/api/delete': [mock_response(404), mock_response(404), mock_response(500)]
+        })
+
+        # The model is deleted from the backends that have it
+        ollama_delete(mock_pool_manager, 'llm', backends)
+
+        # No backend has the model
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            ollama_delete(mock_pool_manager, 'llm', backends)
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (404)')
+
+        # A backend fails
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            ollama_delete(mock_pool_manager, 'llm', backends)
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (500)')
+
+
+    def test_ollama_delete_backends_down(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/delete': [mock_response(404)],
+            'http://host2:11434/api/delete': [mock_response(200)],
+            'http://host3:11434/api/delete': [connection_error()]
+        })
+
+        # The unreachable backend is skipped
+        ollama_delete(mock_pool_manager, 'llm', backends)
+        self.assertListEqual([backend_stats['down'] for backend_stats in backends.stats()], [False, False, True])
+
+        # No backend is reachable
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/delete': [connection_error()],
+            'http://host2:11434/api/delete': [connection_error()]
+        })
+        with self.assertRaises(urllib3.exceptions.NewConnectionError):
+            ollama_delete(mock_pool_manager, 'llm', backends)
+
+
+    def test_ollama_pull(self):
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://127.0.0.1:11434/api/pull': [mock_response(200, chunks=[b'{"status": "success"}\n'])]
+        })
+        self.assertListEqual(list(ollama_pull(mock_pool_manager, 'llm')), [{'status': 'success'}])
+
+
+    def test_ollama_pull_backends(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434', 'http://host3:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/pull': [mock_response(200, chunks=[b'{"status": "success"}\n'])],
+            'http://host2:11434/api/pull': [connection_error()],
+            'http://host3:11434/api/pull': [mock_response(500)]
+        })
+        chunks = []
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            for chunk in ollama_pull(mock_pool_manager, 'llm', backends):
+                chunks.append(chunk)
+        self.assertEqual(str(cm_exc.exception), 'Unknown model "llm" (500)')
+        self.assertListEqual(chunks, [{'status': 'success'}])
+        self.assertListEqual([backend_stats['down'] for backend_stats in backends.stats()], [False, True, False])
+
+
+    def test_ollama_pull_backends_down(self):
+        backends = OllamaBackends(['http://host1:11434', 'http://host2:11434'])
+        mock_pool_manager = mock_backends_pool_manager({
+            'http://host1:11434/api/pull': [connection_error()],
+            'http://host2:11434/api/pull': [connection_error()]
+        })
+        with self.assertRaises(urllib3.exceptions.NewConnectionError):
+            list(ollama_pull(mock_pool_manager, 'llm', backends))
+
+
+class TestModelCache(unittest.TestCase):
+
+
+    def test_model_cache(self):
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=0):
+            model_cache = ModelCache()
+            self.assertIsNone(model_cache.get('llm'))
+
+            # An untagged model name is the "latest" tag
+            model_cache.set('llm', ['completion'])
+            self.assertListEqual(model_cache.get('llm'), ['completion'])
+            self.assertListEqual(model_cache.get('llm:latest'), ['completion'])
+
+            # Invalidate
+            model_cache.invalidate('llm:latest')
+            self.assertIsNone(model_cache.get('llm'))
+
+
+    def test_model_cache_ttl(self):
+        with unittest.mock.patch('ollama_chat.ollama.time.monotonic', return_value=0) as mock_monotonic:
+            model_cache = ModelCache(ttl=60)
+            model_cache.set('llm', ['completion'])
+            mock_monotonic.return_value = 59
+            self.assertListEqual(model_cache.get('llm'), ['completion'])
+
+            # The cache entry expires
+            mock_monotonic.return_value = 60
+            self.assertIsNone(model_cache.get('llm'))
+            self.assertDictEqual(model_cache.capabilities, {})
+
+
+    def test_model_cache_digests(self):
+        model_cache = ModelCache()
+        model_cache.update_digests([{'model': 'llm:latest', 'digest': 'a1'}, {'model': 'other:7b', 'digest': 'b1'}])
+        model_cache.set('llm', ['completion'])
+        model_cache.set('other:7b', ['completion', 'thinking'])
+        model_cache.set('gone:7b', ['completion'])
+
+        # Unchanged digests keep their cache entries - changed and unlisted models are invalidated
+        model_cache.update_digests([{'model': 'llm:latest', 'digest': 'a1'}, {'model': 'other:7b', 'digest': 'b2'}])
+        self.assertListEqual(model_cache.get('llm'), ['completion'])
+        self.assertIsNone(model_cache.get('other:7b'))
+        self.assertIsNone(model_cache.get('gone:7b'))
+        self.assertListEqual(list(model_cache.capabilities), ['llm:latest'])
+
+        # A model whose digest changes before the next list update is invalidated on get
+        model_cache.set('other:7b', ['completion'])
+        model_cache.digests['other:7b'] = 'b3'
+        self.assertIsNone(model_cache.get('other:7b'))
+
+
+class TestPoolStats(unittest.TestCase):
+
+    def test_pool_stats(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self): # pylint: disable=invalid-name
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'OK')
+
+            def log_message(self, *unused_args): # pylint: disable=arguments-differ
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            pool_stats = PoolStats(2)
+            pool_manager = create_pool_manager(pool_stats)
+            self.assertDictEqual(pool_stats.stats(), {'maxsize': 2, 'requests': 0, 'connections': 0, 'reused': 0})
+
+            # The kept-alive connection is reused
+            for _ in range(3):
+                response = pool_manager.request('GET', f'http://127.0.0.1:{server.server_address[1]}/', retries=0)
+                self.assertEqual(response.data, b'OK')
+            self.assertDictEqual(pool_stats.stats(), {'maxsize': 2, 'requests': 3, 'connections': 1, 'reused': 2})
+            pool_manager.clear()
+        finally:
+            server.shutdown()
+            server.server_close()
+            server_thread.join()
+
+
+    def test_pool_streamed_release(self):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self): # pylint: disable=invalid-name
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if request['model'] == 'unknown':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '9')
+                    self.end_headers()
+                    self.wfile.write(b'Not Found')
+                else:
+                    self.send_response(200)
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    for chunk in (b'{"message": {"content": "Hello"}}\n', b'{"message": {"content": " there"}}\n'):
+                        self.wfile.write(f'{len(chunk):x}\r\n'.encode('utf-8') + chunk + b'\r\n')
+                    self.wfile.write(b'0\r\n\r\n')
+
+            def log_message(self, *unused_args): # pylint: disable=arguments-differ
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            host = f'http://127.0.0.1:{server.server_address[1]}'
+            pool_manager = create_pool_manager(PoolStats(2))
+            pool = pool_manager.connection_from_url(host)
+            backends = OllamaBackends([host])
+            model_cache = ModelCache()
+            model_cache.set('unknown', [])
+            model_cache.set('llm:7b', [])
+
+            # Error responses and stopped chats return their connections to the pool
+            for _ in range(3):
+                with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+                    list(ollama_chat(pool_manager, 'unknown', [], model_cache=model_cache, backends=backends))
+                self.assertEqual(str(cm_exc.exception), 'Unknown model "unknown" (404)')
+                self.assertEqual(pool.pool.qsize(), 2)
+
+                with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+                    list(ollama_pull(pool_manager, 'unknown', backends=backends))
+                self.assertEqual(str(cm_exc.exception), 'Unknown model "unknown" (404)')
+                self.assertEqual(pool.pool.qsize(), 2)
+
+                chat_chunks = ollama_chat(pool_manager, 'llm:7b', [], model_cache=model_cache, backends=backends)
+                self.assertDictEqual(next(chat_chunks), {'message': {'content': 'Hello'}})
+                chat_chunks.close()
+                self.assertEqual(pool.pool.qsize(), 2)
+
+            # A completed chat returns its connection to the pool
+            self.assertListEqual(
+                list(ollama_chat(pool_manager, 'llm:7b', [], model_cache=model_cache, backends=backends)),
+                [{'message': {'content': 'Hello'}}, {'message': {'content': ' there'}}]
+            )
+            self.assertEqual(pool.pool.qsize(), 2)
+            pool_manager.clear()
+        finally:
+            server.shutdown()
+            server.server_close()
+            server_thread.join()
+
+
+    def test_create_pool_manager_https(self):
+        pool_stats = PoolStats(2)
+        pool_manager = create_pool_manager(pool_stats)
+        pool = pool_manager.connection_from_url('https://ollama.example.com')
+        self.assertIs(pool.pool_stats, pool_stats)
+        self.assertEqual(pool.pool.maxsize, 2)
+        self.assertTrue(pool.block)
+        self.assertEqual(pool.timeout.connect_timeout, 10)
+        self.assertEqual(pool.timeout.read_timeout, 600)
+        self.assertEqual(pool.wait_timeout, 60)
+
+
+    def test_create_pool_manager_pool_timeout(self):
+        pool_manager = create_pool_manager(PoolStats(1))
+        pool = pool_manager.connection_from_url('http://127.0.0.1:1')
+        pool.wait_timeout = 0.01
+
+        # A request waits at most the pool timeout for a free connection
+        connection = pool._get_conn()
+        try:
+            with self.assertRaises(urllib3.exceptions.EmptyPoolError):
+                pool_manager.request('GET', 'http://127.0.0.1:1/api/tags', retries=0)
+        finally:
+            pool._put_conn(connection)
+
+
+class TestNDJSONDecoder(unittest.TestCase):
+
+    def test_decode(self):
+        objects = [{'message': {'content': f'token {ix} \U0001f600'}} for ix in range(100)]
+        ndjson = ''.join(json.dumps(obj) + '\n' for obj in objects).encode('utf-8')
+
+        # The objects are decoded regardless of the chunk boundaries
+        for chunk_size in (1, 3, 7, 64, len(ndjson)):
+            decoder = _NDJSONDecoder()
+            decoded = []
+            for ix in range(0, len(ndjson), chunk_size):
+                decoded.extend(decoder.decode(ndjson[ix:ix + chunk_size]))
+            decoded.extend(decoder.close())
+            self.assertListEqual(decoded, objects)
+
+
+    def test_decode_partial_line(self):
+        decoder = _NDJSONDecoder()
+        self.assertListEqual(decoder.decode(b'{"a": 1}\n{"b"'), [{'a': 1}])
+        self.assertEqual(decoder.buffer, b'{"b"')
+        self.assertListEqual(decoder.decode(b': 2'), [])
+        self.assertEqual(decoder.scan_index, 7)
+        self.assertListEqual(decoder.decode(b'}\n'), [{'b': 2}])
+        self.assertEqual(decoder.buffer, b'')
+        self.assertListEqual(decoder.close(), [])
+
+
+    def test_decode_blank_lines(self):
+        decoder = _NDJSONDecoder()
+        self.assertListEqual(decoder.decode(b'\n{"a": 1}\r\n  \n{"b": 2}\n'), [{'a': 1}, {'b': 2}])
+        self.assertListEqual(decoder.close(), [])
+
+
+    def test_decode_unterminated(self):
+        decoder = _NDJSONDecoder()
+        self.assertListEqual(decoder.decode(b'{"a": 1}'), [])
+        self.assertListEqual(decoder.close(), [{'a': 1}])
+
+
+    def test_decode_invalid(self):
+        decoder = _NDJSONDecoder()
+        with self.assertRaises(urllib3.exceptions.HTTPError) as cm_exc:
+            decoder.decode(b'{"a": 1}{"b": 2}\n')
+        self.assertEqual(str(cm_exc.exception), 'Invalid streamed response: \'{"a": 1}{"b": 2}\'')
@@ -0,0 +1,824 @@
+# Licensed under the MIT License
+# https://github.com/craigahobbs/ollama-chat/blob/main/LICENSE
+
+import gzip
+import json
+import os
+import shutil
+import time
+import unittest
+import unittest.mock
+
+from schema_markdown import ValidationError, encode_query_string
+from ollama_chat.app import OLLAMA_CHAT_TYPES, OllamaChat
+from ollama_chat.storage import Journal, JSONStorage, ShardedStorage, SQLiteStorage
+
+from .util import create_test_files
+
+
+class TestJSONStorage(unittest.TestCase):
+
+    def test_save_atomic(self):
+        original_config = {'conversations': []}
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            storage = JSONStorage(config_path, OLLAMA_CHAT_TYPES)
+
+            # A failed write leaves the config file unchanged
+            with self.assertRaises(TypeError):
+                storage.save({'conversations': [], 'model': object()}, (), ())
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), original_config)
+            self.assertListEqual(os.listdir(temp_dir), ['ollama-chat.json'])
+
+            # Successful write - the config file's checksum file is also written
+            storage.save({'conversations': [], 'model': 'llm'}, (), ())
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertDictEqual(json.load(fh_config), {'conversations': [], 'model': 'llm'})
+            self.assertListEqual(sorted(os.listdir(temp_dir)), ['ollama-chat.json', 'ollama-chat.json.sha256'])
+
+
+    def test_checksum(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            storage = JSONStorage(config_path, OLLAMA_CHAT_TYPES)
+            config = {'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}]}
+            storage.save(config, (), ())
+
+            # A config file written by ollama-chat is not validated
+            with unittest.mock.patch('schema_markdown.validate_type') as mock_validate_type:
+                self.assertDictEqual(storage.load(), config)
+            mock_validate_type.assert_not_called()
+
+            # A modified config file is validated
+            with open(config_path, 'a', encoding='utf-8') as fh_config:
+                fh_config.write('\n')
+            with unittest.mock.patch('schema_markdown.validate_type', side_effect=lambda _, __, value: value) as mock_validate_type:
+                self.assertDictEqual(storage.load(), config)
+            mock_validate_type.assert_called_once_with(OLLAMA_CHAT_TYPES, 'OllamaChatConfig', config)
+
+            # The trusted config file is migrated to sharded storage without validation
+            storage.save(config, (), ())
+            with unittest.mock.patch('schema_markdown.validate_type') as mock_validate_type:
+                self.assertDictEqual(ShardedStorage(config_path, OLLAMA_CHAT_TYPES).load(), config)
+            mock_validate_type.assert_not_called()
+
+            # An index file without a checksum file is validated
+            os.remove(f'{config_path}.sha256')
+            index = {'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'}]}
+            with unittest.mock.patch('schema_markdown.validate_type', side_effect=lambda _, __, value: value) as mock_validate_type:
+                self.assertDictEqual(ShardedStorage(config_path, OLLAMA_CHAT_TYPES).load(), index)
+            mock_validate_type.assert_called_once_with(OLLAMA_CHAT_TYPES, 'OllamaChatIndex', index)
+
+
+    def test_validate_exchanges(self):
+        config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': [{'user': 'Hello'}]}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path)
+
+            # The conversation exchanges are not validated on load
+            self.assertDictEqual(app.config.config, config)
+            self.assertSetEqual(app.config.storage.unvalidated_ids, {'conv1', 'conv2'})
+
+            # The conversation exchanges are validated on access
+            with app.config():
+                self.assertListEqual(app.config.get_conversation('conv1')['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+                with self.assertRaises(ValidationError) as cm_exc:
+                    app.config.get_conversation('conv2')
+                self.assertEqual(str(cm_exc.exception), 'Required member "exchanges.0.model" missing')
+            self.assertSetEqual(app.config.storage.unvalidated_ids, {'conv2'})
+
+            # The checksum file is not written while there are unvalidated conversations
+            with app.config(save=True):
+                pass
+            self.assertListEqual(os.listdir(temp_dir), ['ollama-chat.json'])
+
+            # Delete the invalid conversation - the checksum file is written
+            request = {'id': 'conv2'}
+            status, _, _ = app.request('POST', '/deleteConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertSetEqual(app.config.storage.unvalidated_ids, set())
+            self.assertListEqual(sorted(os.listdir(temp_dir)), ['ollama-chat.json', 'ollama-chat.json.sha256'])
+
+
+    def test_validate_invalid_config(self):
+        test_files = [
+            ('ollama-chat.json', json.dumps({'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'}]}))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            with self.assertRaises(ValidationError) as cm_exc:
+                JSONStorage(config_path, OLLAMA_CHAT_TYPES).load()
+            self.assertEqual(str(cm_exc.exception), 'Required member "conversations.0.exchanges" missing')
+
+
+    def test_validate_malformed_exchange(self):
+        for exchanges, error in (
+            (1, 'Invalid value 1 (type "int") for member "conversations.0.exchanges", expected type "array"'),
+            ([1], 'Invalid value 1 (type "int") for member "conversations.0.exchanges.0", expected type "ConversationExchange"')
+        ):
+            with self.subTest(exchanges=exchanges):
+                config = {'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': exchanges}]}
+                test_files = [
+                    ('ollama-chat.json', json.dumps(config))
+                ]
+                with create_test_files(test_files) as temp_dir:
+                    config_path = os.path.join(temp_dir, 'ollama-chat.json')
+                    with self.assertRaises(ValidationError) as cm_exc:
+                        JSONStorage(config_path, OLLAMA_CHAT_TYPES).load()
+                    self.assertEqual(str(cm_exc.exception), error)
+
+
+    def test_compact(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, compact=True)
+            with app.config(save=True) as config:
+                config['model'] = 'llm'
+            with open(config_path, 'r', encoding='utf-8') as fh_config:
+                self.assertEqual(fh_config.read(), '{"conversations":[],"model":"llm"}')
+
+
+class TestJournal(unittest.TestCase):
+
+    def test_journal(self):
+        with create_test_files([]) as temp_dir:
+            journal_path = os.path.join(temp_dir, 'ollama-chat.journal')
+            journal = Journal(journal_path, OLLAMA_CHAT_TYPES)
+
+            # Read and clear a missing journal
+            self.assertListEqual(journal.read(), [])
+            journal.clear()
+            self.assertFalse(os.path.exists(journal_path))
+
+            # Write, read, and clear
+            journal.write({'delete': {'id': 'conv1'}})
+            journal.write({'title': {'id': 'conv2', 'title': 'Title'}})
+            self.assertListEqual(journal.read(), [{'delete': {'id': 'conv1'}}, {'title': {'id': 'conv2', 'title': 'Title'}}])
+            journal.clear()
+            self.assertFalse(os.path.exists(journal_path))
+
+            # Reading stops at an invalid record
+            journal.write({'delete': {'id': 'conv1'}})
+            journal.write({'unknown': {'id': 'conv2'}})
+            journal.write({'delete': {'id': 'conv3'}})
+            self.assertListEqual(journal.read(), [{'delete': {'id': 'conv1'}}])
+            journal.clear()
+
+
+    def test_journal_checkpoint(self):
+        with create_test_files([]) as temp_dir:
+            journal_path = os.path.join(temp_dir, 'ollama-chat.journal')
+            checkpoint_path = os.path.join(temp_dir, 'ollama-chat.journal.checkpoint')
+            journal = Journal(journal_path, OLLAMA_CHAT_TYPES)
+
+            # Checkpoint an empty journal
+            journal.checkpoint()
+            self.assertListEqual(os.listdir(temp_dir), [])
+
+            # Checkpoint - the checkpoint records are read before the journal records
+            journal.write({'delete': {'id': 'conv1'}})
+            journal.checkpoint()
+            self.assertFalse(os.path.exists(journal_path))
+            journal.write({'delete': {'id': 'conv2'}})
+            self.assertListEqual(journal.read(), [{'delete': {'id': 'conv1'}}, {'delete': {'id': 'conv2'}}])
+
+            # Checkpoint again (the checkpoint's save failed) - the records are appended to the checkpoint
+            journal.checkpoint()
+            journal.write({'delete': {'id': 'conv3'}})
+            with open(checkpoint_path, 'r', encoding='utf-8') as fh_checkpoint:
+                self.assertListEqual(
+                    [json.loads(line) for line in fh_checkpoint],
+                    [{'delete': {'id': 'conv1'}}, {'delete': {'id': 'conv2'}}]
+                )
+            self.assertListEqual(journal.read(), [{'delete': {'id': 'conv1'}}, {'delete': {'id': 'conv2'}}, {'delete': {'id': 'conv3'}}])
+
+            # Clear the checkpoint
+            journal.clear_checkpoint()
+            self.assertListEqual(journal.read(), [{'delete': {'id': 'conv3'}}])
+
+            # Clear the journal and checkpoint
+            journal.checkpoint()
+            journal.write({'delete': {'id': 'conv4'}})
+            journal.clear()
+            self.assertListEqual(os.listdir(temp_dir), [])
+
+
+class TestShardedStorage(unittest.TestCase):
+
+    def test_init_missing_config(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+            with app.config() as config:
+                self.assertDictEqual(config, {'conversations': []})
+
+            # Verify no files were written
+            self.assertListEqual(os.listdir(temp_dir), [])
+
+
+    def test_migrate(self):
+        original_config = {
+            'model': 'llm',
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]},
+                {'id': 'conv/2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ],
+            'templates': [
+                {'id': 'tmpl1', 'title': 'Template 1', 'prompts': ['Hello']}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+
+            # Verify the app config
+            with app.config() as config:
+                self.assertDictEqual(config, original_config)
+
+            # Verify the index file
+            with open(config_path, 'r', encoding='utf-8') as config_fh:
+                self.assertDictEqual(json.load(config_fh), {
+                    'model': 'llm',
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                        {'id': 'conv/2', 'model': 'llm', 'title': 'Conversation 2'}
+                    ],
+                    'templates': [
+                        {'id': 'tmpl1', 'title': 'Template 1'}
+                    ]
+                })
+
+            # Verify the backup of the single-file config
+            with open(f'{config_path}.bak', 'r', encoding='utf-8') as backup_fh:
+                self.assertDictEqual(json.load(backup_fh), original_config)
+
+            # Verify the shard files
+            shard_dir = os.path.join(temp_dir, 'ollama-chat.d')
+            self.assertListEqual(sorted(os.listdir(os.path.join(shard_dir, 'conversations'))), ['conv%2F2.json', 'conv1.json'])
+            with open(os.path.join(shard_dir, 'conversations', 'conv1.json'), 'r', encoding='utf-8') as shard_fh:
+                self.assertDictEqual(json.load(shard_fh), original_config['conversations'][0])
+            with open(os.path.join(shard_dir, 'templates', 'tmpl1.json'), 'r', encoding='utf-8') as shard_fh:
+                self.assertDictEqual(json.load(shard_fh), original_config['templates'][0])
+
+            # Reload the sharded config - the conversation shards are loaded on demand
+            app2 = OllamaChat(config_path, storage='sharded')
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'model': 'llm',
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                        {'id': 'conv/2', 'model': 'llm', 'title': 'Conversation 2'}
+                    ],
+                    'templates': original_config['templates']
+                })
+                app2.config.get_conversation('conv1')
+                app2.config.get_conversation('conv/2')
+                self.assertDictEqual(config, original_config)
+
+
+    def test_migrate_no_save(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+            ],
+            'noSave': True
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+            with app.config() as config:
+                self.assertDictEqual(config, original_config)
+
+            # Verify the config file was not migrated
+            self.assertListEqual(os.listdir(temp_dir), ['ollama-chat.json'])
+
+            # The conversation exchanges are not evicted, since they're not in the storage
+            app.config.conversation_cache_size = 0
+            with app.config():
+                app.config.add_conversation({'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []})
+                self.assertListEqual(app.config.get_conversation('conv2')['exchanges'], [])
+                self.assertListEqual(app.config.get_conversation('conv1')['exchanges'], [])
+
+
+    def test_storage_detected(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+            ],
+            'templates': [
+                {'id': 'tmpl1', 'title': 'Template 1', 'prompts': ['Hello']}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+            self.assertIsInstance(app.config.storage, ShardedStorage)
+
+            # Without a storage name, the migrated config uses sharded storage
+            app2 = OllamaChat(config_path)
+            self.assertIsInstance(app2.config.storage, ShardedStorage)
+            status, _, content_bytes = app2.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(json.loads(content_bytes.decode('utf-8'))['conversation']['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+            status, _, content_bytes = app2.request('GET', '/getTemplate', query_string=encode_query_string({'id': 'tmpl1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), original_config['templates'][0])
+
+            # Other storage names are errors
+            for storage in ('json', 'sqlite'):
+                with self.subTest(storage=storage):
+                    with self.assertRaises(ValueError) as cm_exc:
+                        OllamaChat(config_path, storage=storage)
+                    self.assertEqual(
+                        str(cm_exc.exception), f'Configuration file "{config_path}" uses sharded storage, not {storage} storage'
+                    )
+
+            # An index file without its shard directory is not loaded as a single-file config
+            shutil.rmtree(os.path.join(temp_dir, 'ollama-chat.d'))
+            with self.assertRaises(ValueError) as cm_exc:
+                OllamaChat(config_path)
+            self.assertEqual(str(cm_exc.exception), f'Configuration file "{config_path}" is a sharded storage index')
+
+
+    def test_save_changed_shards(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+
+            # Set a conversation title - only the index and the conversation's shard are written
+            with unittest.mock.patch.object(
+                    ShardedStorage, '_write_shard', autospec=True, side_effect=ShardedStorage._write_shard
+            ) as mock_write_shard:
+                request = {'id': 'conv2', 'title': 'New Title'}
+                status, _, _ = app.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+            mock_write_shard.assert_called_once_with(
+                app.config.storage, 'conversations', 'conv2', {'id': 'conv2', 'model': 'llm', 'title': 'New Title', 'exchanges': []}
+            )
+            with open(config_path, 'r', encoding='utf-8') as config_fh:
+                self.assertDictEqual(json.load(config_fh), {
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                        {'id': 'conv2', 'model': 'llm', 'title': 'New Title'}
+                    ]
+                })
+
+            # Move a conversation - only the index is written
+            with unittest.mock.patch('ollama_chat.storage.ShardedStorage._write_shard') as mock_write_shard:
+                request = {'id': 'conv1', 'down': True}
+                status, _, _ = app.request('POST', '/moveConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+            mock_write_shard.assert_not_called()
+            with open(config_path, 'r', encoding='utf-8') as config_fh:
+                self.assertDictEqual(json.load(config_fh), {
+                    'conversations': [
+                        {'id': 'conv2', 'model': 'llm', 'title': 'New Title'},
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'}
+                    ]
+                })
+
+            # Delete a conversation - its shard is deleted
+            request = {'id': 'conv1'}
+            status, _, _ = app.request('POST', '/deleteConversation', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(os.listdir(os.path.join(temp_dir, 'ollama-chat.d', 'conversations')), ['conv2.json'])
+
+            # Reload the sharded config
+            app2 = OllamaChat(config_path, storage='sharded')
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'conversations': [
+                        {'id': 'conv2', 'model': 'llm', 'title': 'New Title'}
+                    ]
+                })
+
+            # Set an unloaded conversation's title - its shard is loaded and written
+            request = {'id': 'conv2', 'title': 'Newer Title'}
+            status, _, _ = app2.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'conversations': [
+                        {'id': 'conv2', 'model': 'llm', 'title': 'Newer Title'}
+                    ]
+                })
+            with open(os.path.join(temp_dir, 'ollama-chat.d', 'conversations', 'conv2.json'), 'r', encoding='utf-8') as shard_fh:
+                self.assertDictEqual(json.load(shard_fh), {'id': 'conv2', 'model': 'llm', 'title': 'Newer Title', 'exchanges': []})
+
+
+    def test_shard_validation(self):
+        conversation = {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+        test_files = [
+            ('ollama-chat.json', json.dumps({'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'}]})),
+            (('ollama-chat.d', 'conversations', 'conv1.json'), json.dumps(conversation))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            storage = ShardedStorage(config_path, OLLAMA_CHAT_TYPES)
+            storage.load()
+
+            # The shard is validated on first read only
+            with unittest.mock.patch('schema_markdown.validate_type', side_effect=lambda _, __, value: value) as mock_validate_type:
+                self.assertListEqual(storage.load_exchanges('conv1'), conversation['exchanges'])
+                self.assertListEqual(storage.load_exchanges('conv1'), conversation['exchanges'])
+            mock_validate_type.assert_called_once_with(OLLAMA_CHAT_TYPES, 'Conversation', conversation)
+
+            # A shard written by the storage is not validated
+            conversation['exchanges'].append({'user': 'Bye', 'model': 'Bye'})
+            storage.save({'conversations': [conversation]}, {'conv1'}, ())
+            with unittest.mock.patch('schema_markdown.validate_type') as mock_validate_type:
+                self.assertListEqual(storage.load_exchanges('conv1'), conversation['exchanges'])
+            mock_validate_type.assert_not_called()
+
+            # A modified shard is validated
+            with open(os.path.join(temp_dir, 'ollama-chat.d', 'conversations', 'conv1.json'), 'a', encoding='utf-8') as fh_shard:
+                fh_shard.write('\n')
+            with unittest.mock.patch('schema_markdown.validate_type', side_effect=lambda _, __, value: value) as mock_validate_type:
+                self.assertListEqual(storage.load_exchanges('conv1'), conversation['exchanges'])
+            mock_validate_type.assert_called_once_with(OLLAMA_CHAT_TYPES, 'Conversation', conversation)
+
+
+    def test_archive(self):
+        conversation1 = {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}] * 10}
+        conversation2 = {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+        conversation1_json = json.dumps(conversation1)
+        test_files = [
+            ('ollama-chat.json', json.dumps({
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                    {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2'},
+                    {'id': 'conv3', 'model': 'llm', 'title': 'Conversation 3'}
+                ]
+            })),
+            (('ollama-chat.d', 'conversations', 'conv1.json'), conversation1_json),
+            (('ollama-chat.d', 'conversations', 'conv2.json'), json.dumps(conversation2)),
+            (('ollama-chat.d', 'archive', 'conv2.json.gz'), ''),
+            (('ollama-chat.d', 'archive', 'conv4.json.gz'), ''),
+            (('ollama-chat.d', 'archive', 'README.txt'), '')
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            conversations_dir = os.path.join(temp_dir, 'ollama-chat.d', 'conversations')
+            archive_dir = os.path.join(temp_dir, 'ollama-chat.d', 'archive')
+            archive_time = time.time() - 31 * 86400
+            os.utime(os.path.join(conversations_dir, 'conv1.json'), (archive_time, archive_time))
+
+            # Only the old conversation is archived - the interrupted and unknown archives are deleted
+            app = OllamaChat(config_path, storage='sharded', archive_days=30)
+            self.assertListEqual(os.listdir(conversations_dir), ['conv2.json'])
+            self.assertListEqual(sorted(os.listdir(archive_dir)), ['README.txt', 'conv1.json.gz'])
+            with open(os.path.join(archive_dir, 'conv1.json.gz'), 'rb') as fh_archive:
+                archive_size = len(fh_archive.read())
+            status, _, content_bytes = app.request('GET', '/getConversations')
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(json.loads(content_bytes.decode('utf-8'))['conversations'], [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'generating': False, 'archived': True},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'generating': False},
+                {'id': 'conv3', 'model': 'llm', 'title': 'Conversation 3', 'generating': False}
+            ])
+
+            # Get the archived conversation - it's decompressed
+            status, _, content_bytes = app.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(
+                json.loads(content_bytes.decode('utf-8')),
+                {'conversation': {**conversation1, 'generating': False, 'version': 0, 'modelOffset': 2}}
+            )
+
+            # Get the archive stats
+            status, _, content_bytes = app.request('GET', '/getStats')
+            self.assertEqual(status, '200 OK')
+            response = json.loads(content_bytes.decode('utf-8'))
+            self.assertGreaterEqual(response['archive']['rehydrationSeconds'], response['archive']['rehydrationMaxSeconds'])
+            self.assertGreater(response['archive']['rehydrationMaxSeconds'], 0)
+            del response['archive']['rehydrationSeconds']
+            del response['archive']['rehydrationMaxSeconds']
+            self.assertDictEqual(response, {
+                'archive': {
+                    'conversations': 1,
+                    'bytesSaved': len(conversation1_json) - archive_size,
+                    'rehydrations': 1
+                },
+                'backends': [{'host': 'http://127.0.0.1:11434', 'outstanding': 0, 'down': False, 'loaded': []}],
+                'loads': {'chats': 0, 'coldStarts': 0, 'loadSeconds': 0},
+                'ollamaPool': {'maxsize': 32, 'requests': 0, 'connections': 0, 'reused': 0},
+                'urlPool': {'maxsize': 4, 'requests': 0, 'connections': 0, 'reused': 0}
+            })
+
+            # Reload - the archived conversation remains archived, and its bytes saved is read once, on load
+            app2 = OllamaChat(config_path, storage='sharded', archive_days=30)
+            self.assertSetEqual(app2.config.storage.archived_ids, {'conv1'})
+            with unittest.mock.patch('builtins.open', side_effect=AssertionError):
+                self.assertEqual(app2.config.storage.archive_stats()['bytesSaved'], len(conversation1_json) - archive_size)
+            self.assertSetEqual(OllamaChat(config_path, storage='sharded').config.storage.archived_ids, {'conv1'})
+
+            # Change the archived conversation - it's moved back to the conversations directory
+            request = {'id': 'conv1', 'title': 'New Title'}
+            status, _, _ = app2.request('POST', '/setConversationTitle', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(sorted(os.listdir(conversations_dir)), ['conv1.json', 'conv2.json'])
+            self.assertListEqual(os.listdir(archive_dir), ['README.txt'])
+            with open(os.path.join(conversations_dir, 'conv1.json'), 'r', encoding='utf-8') as fh_shard:
+                self.assertDictEqual(json.load(fh_shard), {**conversation1, 'title': 'New Title'})
+            self.assertSetEqual(app2.config.storage.archived_ids, set())
+            self.assertDictEqual(app2.config.storage.archive_stats(), {
+                'conversations': 0,
+                'bytesSaved': 0,
+                'rehydrations': 1,
+                'rehydrationSeconds': app2.config.storage.rehydration_seconds,
+                'rehydrationMaxSeconds': app2.config.storage.rehydration_seconds
+            })
+
+            # An archived conversation moved back by a save while it's read is read from the conversations directory
+            app2.config.storage.archived_ids.add('conv1')
+            self.assertListEqual(app2.config.storage.load_exchanges('conv1'), conversation1['exchanges'])
+            app2.config.storage.archived_ids.discard('conv1')
+
+            # Archive the conversation again and delete it - its archive is deleted
+            os.utime(os.path.join(conversations_dir, 'conv1.json'), (archive_time, archive_time))
+            app3 = OllamaChat(config_path, storage='sharded', archive_days=30)
+            with open(os.path.join(archive_dir, 'conv1.json.gz'), 'rb') as fh_archive:
+                self.assertDictEqual(json.loads(gzip.decompress(fh_archive.read())), {**conversation1, 'title': 'New Title'})
+            status, _, _ = app3.request('POST', '/deleteConversation', wsgi_input=json.dumps({'id': 'conv1'}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(os.listdir(conversations_dir), ['conv2.json'])
+            self.assertListEqual(os.listdir(archive_dir), ['README.txt'])
+
+
+    def test_save_templates(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sharded')
+
+            # Create a template
+            request = {'title': 'Template 1', 'prompts': ['Hello']}
+            status, _, content_bytes = app.request('POST', '/createTemplate', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            template_id = json.loads(content_bytes.decode('utf-8'))['id']
+
+            # Update the template
+            request = {'id': template_id, 'title': 'Template 2', 'prompts': ['Goodbye']}
+            status, _, _ = app.request('POST', '/updateTemplate', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+
+            # Reload the sharded config
+            app2 = OllamaChat(config_path, storage='sharded')
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'conversations': [],
+                    'templates': [
+                        {'id': template_id, 'title': 'Template 2', 'prompts': ['Goodbye']}
+                    ]
+                })
+
+            # Save with no changes - nothing is written
+            with unittest.mock.patch('ollama_chat.storage.ShardedStorage._write_shard') as mock_write_shard, \
+                 unittest.mock.patch('ollama_chat.storage._write_json') as mock_write_json:
+                with app.config(save=True):
+                    pass
+            mock_write_shard.assert_not_called()
+            mock_write_json.assert_not_called()
+
+            # Delete the template (its shard file was already deleted)
+            os.remove(os.path.join(temp_dir, 'ollama-chat.d', 'templates', f'{template_id}.json'))
+            status, _, _ = app.request('POST', '/deleteTemplate', wsgi_input=json.dumps({'id': template_id}).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            self.assertListEqual(os.listdir(os.path.join(temp_dir, 'ollama-chat.d', 'templates')), [])
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    def test_init_missing_config(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.db')
+            app = OllamaChat(config_path)
+            self.assertIsInstance(app.config.storage, SQLiteStorage)
+            with app.config() as config:
+                self.assertDictEqual(config, {'conversations': []})
+
+            # Verify no files were written
+            self.assertListEqual(os.listdir(temp_dir), [])
+
+
+    def test_storage_name(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sqlite')
+            self.assertIsInstance(app.config.storage, SQLiteStorage)
+
+
+    def test_migrate(self):
+        original_config = {
+            'model': 'llm',
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]},
+                {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []}
+            ],
+            'templates': [
+                {'id': 'tmpl1', 'title': 'Template 1', 'prompts': ['Hello']}
+            ]
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sqlite')
+            self.assertIsInstance(app.config.storage, SQLiteStorage)
+            with app.config() as config:
+                self.assertDictEqual(config, original_config)
+
+            # Verify the single-file config was moved to the backup file
+            self.assertListEqual(sorted(os.listdir(temp_dir)), ['ollama-chat.json', 'ollama-chat.json.bak'])
+            with open(f'{config_path}.bak', 'r', encoding='utf-8') as backup_fh:
+                self.assertDictEqual(json.load(backup_fh), original_config)
+
+            # Without a storage name, the migrated config uses SQLite storage
+            app2 = OllamaChat(config_path)
+            self.assertIsInstance(app2.config.storage, SQLiteStorage)
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'model': 'llm',
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                        {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2'}
+                    ],
+                    'templates': original_config['templates']
+                })
+                app2.config.get_conversation('conv1')
+                app2.config.get_conversation('conv2')
+                self.assertDictEqual(config, original_config)
+
+
+    def test_migrate_no_save(self):
+        original_config = {
+            'conversations': [
+                {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}
+            ],
+            'noSave': True
+        }
+        test_files = [
+            ('ollama-chat.json', json.dumps(original_config))
+        ]
+        with create_test_files(test_files) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            app = OllamaChat(config_path, storage='sqlite')
+            with app.config() as config:
+                self.assertDictEqual(config, original_config)
+
+            # Verify the config file was not migrated
+            self.assertListEqual(os.listdir(temp_dir), ['ollama-chat.json'])
+
+
+    def test_migrate_trusted(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.json')
+            config = {'conversations': [{'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': []}]}
+
+            # An index file is not migrated
+            ShardedStorage(config_path, OLLAMA_CHAT_TYPES).save(config, (), ())
+            shutil.rmtree(os.path.join(temp_dir, 'ollama-chat.d'))
+            with self.assertRaises(ValueError) as cm_exc:
+                SQLiteStorage(config_path, OLLAMA_CHAT_TYPES).load()
+            self.assertEqual(str(cm_exc.exception), f'Configuration file "{config_path}" is a sharded storage index')
+            self.assertListEqual(sorted(os.listdir(temp_dir)), ['ollama-chat.json', 'ollama-chat.json.sha256'])
+
+            # The trusted config file is migrated without validation
+            JSONStorage(config_path, OLLAMA_CHAT_TYPES).save(config, (), ())
+            with unittest.mock.patch('schema_markdown.validate_type') as mock_validate_type:
+                self.assertDictEqual(SQLiteStorage(config_path, OLLAMA_CHAT_TYPES).load(), config)
+            mock_validate_type.assert_not_called()
+
+
+    def test_save_load(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.db')
+            app = OllamaChat(config_path)
+
+            # Add conversations
+            with app.config(save=True) as config:
+                config['model'] = 'llm'
+                app.config.add_conversation({'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []})
+                app.config.add_conversation({
+                    'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1',
+                    'exchanges': [{'user': 'Hello', 'model': 'Hi'}, {'user': 'Think', 'model': 'OK', 'thinking': 'Hmm'}]
+                })
+                app.config.changed(conversation_id='conv1')
+                app.config.changed(conversation_id='conv2')
+
+            # Create a template
+            request = {'title': 'Template 1', 'prompts': ['Hello']}
+            status, _, content_bytes = app.request('POST', '/createTemplate', wsgi_input=json.dumps(request).encode('utf-8'))
+            self.assertEqual(status, '200 OK')
+            template_id = json.loads(content_bytes.decode('utf-8'))['id']
+
+            # Reload the config - the conversation exchanges are not loaded
+            app2 = OllamaChat(config_path)
+            expected_templates = [{'id': template_id, 'title': 'Template 1', 'prompts': ['Hello']}]
+            with app2.config() as config:
+                self.assertDictEqual(config, {
+                    'model': 'llm',
+                    'conversations': [
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1'},
+                        {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2'}
+                    ],
+                    'templates': expected_templates
+                })
+
+            # The conversation list does not load exchanges
+            status, _, content_bytes = app2.request('GET', '/getConversations')
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {
+                'model': 'llm',
+                'conversations': [
+                    {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'generating': False},
+                    {'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'generating': False}
+                ],
+                'templates': [{'id': template_id, 'title': 'Template 1'}],
+                'version': app2.config.list_version
+            })
+
+            # Get a conversation - only its exchanges are loaded
+            status, _, content_bytes = app2.request('GET', '/getConversation', query_string=encode_query_string({'id': 'conv1'}))
+            self.assertEqual(status, '200 OK')
+            self.assertDictEqual(json.loads(content_bytes.decode('utf-8')), {
+                'conversation': {
+                    'id': 'conv1',
+                    'model': 'llm',
+                    'title': 'Conversation 1',
+                    'exchanges': [{'user': 'Hello', 'model': 'Hi'}, {'user': 'Think', 'model': 'OK', 'thinking': 'Hmm'}],
+                    'generating': False,
+                    'version': 0,
+                    'modelOffset': 2,
+                    'thinkingOffset': 3
+                }
+            })
+            with app2.config() as config:
+                self.assertNotIn('exchanges', config['conversations'][1])
+
+
+    def test_save_changes(self):
+        with create_test_files([]) as temp_dir:
+            config_path = os.path.join(temp_dir, 'ollama-chat.db')
+            app = OllamaChat(config_path)
+            with app.config(save=True):
+                app.config.add_conversation({'id': 'conv3', 'model': 'llm', 'title': 'Conversation 3', 'exchanges': []})
+                app.config.add_conversation({'id': 'conv2', 'model': 'llm', 'title': 'Conversation 2', 'exchanges': []})
+                app.config.add_conversation({
+                    'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1',
+                    'exchanges': [{'user': 'Hello', 'model': 'Hi'}, {'user': 'Goodbye', 'model': 'Bye'}]
+                })
+
+            # Set a title, move, delete, and delete an exchange
+            app2 = OllamaChat(config_path)
+            for url, request in [
+                ('/setConversationTitle', {'id': 'conv2', 'title': 'New Title'}),
+                ('/moveConversation', {'id': 'conv1', 'down': True}),
+                ('/deleteConversation', {'id': 'conv3'}),
+                ('/deleteConversationExchange', {'id': 'conv1'})
+            ]:
+                status, _, _ = app2.request('POST', url, wsgi_input=json.dumps(request).encode('utf-8'))
+                self.assertEqual(status, '200 OK')
+
+            # Reload the config
+            app3 = OllamaChat(config_path)
+            with app3.config() as config:
+                self.assertEqual(app3.config.get_conversation('conv1')['exchanges'], [{'user': 'Hello', 'model': 'Hi'}])
+                self.assertEqual(app3.config.get_conversation('conv2')['exchanges'], [])
+                self.assertDictEqual(config, {
+                    'conversations': [
+                        {'id': 'conv2', 'model': 'llm', 'title': 'New Title', 'exchanges': []},
+                        {'id': 'conv1', 'model': 'llm', 'title': 'Conversation 1', 'exchanges': [{'user': 'Hello', 'model': 'Hi'}]}
+                    ]
+                })